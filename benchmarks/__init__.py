@@ -0,0 +1,4 @@
+"""Benchmarks for the dognition helpers.
+
+Run them from the repository root, e.g. ``python -m benchmarks.bench_pagination``.
+"""
@@ -0,0 +1,101 @@
+"""Breed LIKE searches: full-scan ``LIKE`` vs :class:`dognition.breedsearch.LikeIndex`.
+
+Times suffix, prefix and substring patterns on ``dogs`` at its current
+size and again with the table multiplied (100x by default), the scan with
+``breed LIKE ?`` and the index path with a trigram/suffix lookup followed
+by ``breed IN (...)`` on an indexed ``breed`` column.  Both paths must
+return the same rows.  The synthetic breeds are few and evenly spread, so
+each pattern matches a large share of the table and fetching the rows
+dominates; the ``COUNT(*)`` columns show the lookup cost on its own.
+"""
+
+from dognition.breedsearch import LikeIndex
+from dognition.db import placeholder, quote
+
+from .common import open_database, parser, timed
+
+PATTERNS = ("%terrier", "s%", "%retriever%", "%shep%dog")
+COLUMNS = ("user_guid", "gender", "breed")
+
+
+def scan(conn, pattern):
+    cursor = conn.cursor()
+    cursor.execute("SELECT %s FROM dogs WHERE breed LIKE %s"
+                   % (", ".join(quote(c) for c in COLUMNS), placeholder(conn)),
+                   (pattern,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def scan_count(conn, pattern):
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM dogs WHERE breed LIKE %s"
+                   % placeholder(conn), (pattern,))
+    count = cursor.fetchone()[0]
+    cursor.close()
+    return count
+
+
+def index_count(conn, index, pattern):
+    predicate, values = index.where(pattern)
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM dogs WHERE " + predicate, values)
+    count = cursor.fetchone()[0]
+    cursor.close()
+    return count
+
+
+def multiply(conn, factor):
+    """Grow ``dogs`` to ``factor`` times its size by copying its rows."""
+    cursor = conn.cursor()
+    cursor.execute("CREATE TEMPORARY TABLE copies (n INTEGER)")
+    cursor.executemany("INSERT INTO copies VALUES (%s)" % placeholder(conn),
+                       [(n,) for n in range(1, factor)])
+    cursor.execute("INSERT INTO dogs SELECT dogs.* FROM dogs, copies")
+    cursor.execute("DROP TABLE copies")
+    conn.commit()
+    cursor.close()
+
+
+def measure(conn, label, repeat):
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM dogs")
+    print("%s: %d dogs" % (label, cursor.fetchone()[0]))
+    cursor.close()
+    build, index = timed(LikeIndex, conn)
+    print("  index of %d distinct breeds built in %.1f ms"
+          % (len(index.index), build * 1000))
+    print("  %-14s %8s %10s %10s %8s %10s %10s %8s" % (
+        "pattern", "rows", "LIKE ms", "index ms", "speedup",
+        "LIKE cnt", "index cnt", "speedup"))
+    for pattern in PATTERNS:
+        scan_s, expected = timed(scan, conn, pattern, repeat=repeat)
+        index_s, found = timed(index.select, pattern, COLUMNS, repeat=repeat)
+        assert sorted(found) == sorted(expected), pattern
+        count_scan_s, _ = timed(scan_count, conn, pattern, repeat=repeat)
+        count_index_s, count = timed(index_count, conn, index, pattern, repeat=repeat)
+        assert count == len(expected), pattern
+        print("  %-14s %8d %10.2f %10.2f %7.1fx %10.2f %10.2f %7.1fx" % (
+            pattern, len(found), scan_s * 1000, index_s * 1000, scan_s / index_s,
+            count_scan_s * 1000, count_index_s * 1000, count_scan_s / count_index_s))
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0], tables=("dogs",))
+    p.add_argument("--factor", type=int, default=100,
+                   help="multiplier for the second run")
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args(argv)
+    conn = open_database(args)
+    conn.cursor().execute(LikeIndex(conn).index_ddl())
+    measure(conn, "1x", args.repeat)
+    if args.url:
+        print("skipping the %dx run against a live server" % args.factor)
+        return
+    multiply(conn, args.factor)
+    measure(conn, "%dx" % args.factor, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
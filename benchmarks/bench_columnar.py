@@ -0,0 +1,67 @@
+"""Categorical queries on the server vs the dictionary-encoded cache.
+
+Loads the categorical columns of ``dogs`` and ``complete_tests`` into a
+:class:`dognition.columnar.ColumnarCache`, reports its size next to the
+same columns held as fetched row tuples, and times DISTINCT, IN-list,
+LIKE and GROUP BY queries both ways.  Needs NumPy.
+"""
+
+import sys
+
+from dognition.columnar import CATEGORICAL_COLUMNS, ColumnarCache
+
+from .common import open_database, parser, timed
+
+CASES = (
+    ("SELECT DISTINCT breed FROM dogs",
+     lambda cache: cache.table("dogs")["breed"].distinct()),
+    ("SELECT COUNT(*) FROM dogs WHERE breed IN ('Golden Retriever', 'Poodle')",
+     lambda cache: int(cache.table("dogs")["breed"].isin(
+         ["Golden Retriever", "Poodle"]).sum())),
+    ("SELECT COUNT(*) FROM dogs WHERE gender = 'female' AND breed LIKE '%terrier'",
+     lambda cache: int((cache.table("dogs")["gender"].eq("female")
+                        & cache.table("dogs")["breed"].like("%terrier")).sum())),
+    ("SELECT breed_type, gender, COUNT(*) FROM dogs GROUP BY breed_type, gender",
+     lambda cache: cache.table("dogs").group_count(["breed_type", "gender"])),
+    ("SELECT test_name, COUNT(*) FROM complete_tests GROUP BY test_name",
+     lambda cache: cache.table("complete_tests").group_count("test_name")),
+    ("SELECT COUNT(DISTINCT subcategory_name) FROM complete_tests",
+     lambda cache: cache.table("complete_tests")["subcategory_name"].count_distinct()),
+)
+
+
+def server(conn, sql):
+    cursor = conn.cursor()
+    cursor.execute(sql)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def tuple_bytes(rows):
+    return sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row) for row in rows)
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0], tables=("complete_tests",))
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args(argv)
+    conn = open_database(args)
+    cache = ColumnarCache(conn)
+    print("%-16s %10s %12s %12s %10s" % ("table", "rows", "tuples MB", "codes MB", "load s"))
+    for table in ("dogs", "complete_tests"):
+        columns = ", ".join(CATEGORICAL_COLUMNS[table])
+        raw = tuple_bytes(server(conn, "SELECT %s FROM %s" % (columns, table)))
+        load_s, cached = timed(cache.table, table)
+        print("%-16s %10d %12.2f %12.2f %10.2f" % (
+            table, cached.rows, raw / 1e6, cached.nbytes / 1e6, load_s))
+    print()
+    print("%-72s %10s %10s" % ("query", "server ms", "cache ms"))
+    for sql, run in CASES:
+        server_s, _ = timed(server, conn, sql, repeat=args.repeat)
+        cache_s, _ = timed(run, cache, repeat=args.repeat)
+        print("%-72s %10.2f %10.2f" % (sql[:72], server_s * 1000, cache_s * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""EXPLAIN and timing of YEAR()/MONTH() filters before and after rewriting.
+
+Runs the Exercise 2 date filters on a scaled-up complete_tests with an
+index on created_at, once as written and once after
+:func:`dognition.sargable.rewrite`, and checks both return the same rows.
+"""
+
+from dognition.db import explain
+from dognition.sargable import rewrite
+
+from .common import open_database, parser, timed
+
+QUERIES = (
+    "SELECT dog_guid, test_name, subcategory_name, created_at\n"
+    "FROM complete_tests\nWHERE YEAR(created_at)=2014 AND MONTH(created_at)=10",
+    "SELECT COUNT(*)\nFROM complete_tests\nWHERE YEAR(created_at)=2014",
+    "SELECT COUNT(*)\nFROM reviews\nWHERE YEAR(created_at)=2014",
+)
+
+
+def run(conn, sql):
+    cursor = conn.cursor()
+    cursor.execute(sql)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0], tables=("complete_tests", "reviews"),
+               scale=5.0)
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args(argv)
+    conn = open_database(args)
+    if not args.url:
+        for table in ("complete_tests", "reviews"):
+            conn.execute("CREATE INDEX %s_created_at ON %s (created_at)"
+                         % (table, table))
+
+    for sql in QUERIES:
+        rewritten, changes = rewrite(sql)
+        before_s, before = timed(run, conn, sql, repeat=args.repeat)
+        after_s, after = timed(run, conn, rewritten, repeat=args.repeat)
+        print("=" * 72)
+        print(" ".join(sql.split()))
+        for change in changes:
+            print("  rewrite: " + change)
+        print("  before plan: " + " | ".join(explain(conn, sql)))
+        print("  after plan:  " + " | ".join(explain(conn, rewritten)))
+        print("  before %8.1f ms   after %8.1f ms   speed-up %5.1fx   rows match: %s"
+              % (before_s * 1000, after_s * 1000, before_s / after_s,
+                 sorted(before) == sorted(after)))
+
+
+if __name__ == "__main__":
+    main()
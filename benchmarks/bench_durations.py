@@ -0,0 +1,71 @@
+"""Exercise 4's duration questions: one query each vs one profile scan.
+
+Runs the average, min/max, negative count, negative rows and positive-only
+average of the test duration in minutes as separate queries over
+exam_answers, plus Exercise 5's per-test average below 6000 hours, then
+answers the same from a single :class:`dognition.durations.DurationProfile`
+scan.  Needs NumPy.
+"""
+
+from dognition.db import dialect_of
+from dognition.durations import DurationProfile
+
+from .common import open_database, parser, timed
+
+QUESTIONS = (
+    "SELECT AVG({minutes}) FROM exam_answers",
+    "SELECT MIN({minutes}), MAX({minutes}) FROM exam_answers",
+    "SELECT COUNT({minutes}) FROM exam_answers WHERE {minutes} < 0",
+    "SELECT * FROM exam_answers WHERE {minutes} < 0",
+    "SELECT AVG({minutes}) FROM exam_answers WHERE {minutes} > 0",
+    "SELECT test_name, AVG({hours}) FROM exam_answers WHERE {hours} < 6000 "
+    "GROUP BY test_name",
+)
+
+
+def duration_sql(conn, unit):
+    if dialect_of(conn) == "sqlite":
+        # integer division truncates towards zero, as TIMESTAMPDIFF does
+        return ("((CAST(strftime('%%s', end_time) AS INTEGER)"
+                " - CAST(strftime('%%s', start_time) AS INTEGER)) / %d)"
+                % {"minute": 60, "hour": 3600}[unit])
+    return "TIMESTAMPDIFF(%s, start_time, end_time)" % unit
+
+
+def run_queries(conn):
+    minutes, hours = duration_sql(conn, "minute"), duration_sql(conn, "hour")
+    answers = []
+    cursor = conn.cursor()
+    for question in QUESTIONS:
+        cursor.execute(question.format(minutes=minutes, hours=hours))
+        answers.append(cursor.fetchall())
+    cursor.close()
+    return answers
+
+
+def run_profile(conn):
+    profile = DurationProfile.load(conn)
+    overall = profile.stats()
+    return [overall.mean, (overall.min, overall.max), overall.negative,
+            len(profile.negative_rows), profile.stats(low=0).mean,
+            {k: v.mean for k, v in profile.by_group("hour", high=6000).items()}]
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0], tables=("exam_answers",), scale=0.2)
+    args = p.parse_args(argv)
+    conn = open_database(args)
+    queries_s, answers = timed(run_queries, conn)
+    profile_s, found = timed(run_profile, conn)
+    assert abs(float(answers[0][0][0]) - found[0]) < 1e-6
+    assert tuple(answers[1][0]) == found[1]
+    assert answers[2][0][0] == found[2] == len(answers[3]) == found[3]
+    assert abs(float(answers[4][0][0]) - found[4]) < 1e-6
+    print("%d separate queries: %8.2fs" % (len(QUESTIONS), queries_s))
+    print("one profile scan:   %8.2fs" % profile_s)
+    print("average %.1f min, %d negative, positive-only average %.1f min"
+          % (found[0], found[2], found[4]))
+
+
+if __name__ == "__main__":
+    main()
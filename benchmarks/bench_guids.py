@@ -0,0 +1,141 @@
+"""GUID joins, GROUP BY and index size: 36-character text vs 16 binary bytes.
+
+Times the Exercise 7 join, a GROUP BY and a COUNT(DISTINCT) on the GUID
+columns and a single-key lookup, then converts the columns with
+:func:`dognition.guids.migrate` and runs the same queries through
+:func:`dognition.guids.rewrite_guids` and :func:`decode_rows`, checking
+that the answers are unchanged.  Reports the size of the GUID indexes
+before and after, and how inserting keys in creation order grows an index
+of text, of plain ``UUID_TO_BIN`` and of the swapped, time-ordered layout.
+Without ``--url`` the synthetic copy is written to a temporary file; with
+``--url`` the database is migrated in place and restored afterwards.
+"""
+
+import os
+import tempfile
+import uuid
+
+from dognition import db, synthetic
+from dognition.catalog import SchemaCatalog
+from dognition.guids import (analyze, decode_rows, guid_columns, migrate, restore,
+                             rewrite_guids)
+
+from .bench_topn import server
+from .common import parser, timed
+
+QUERIES = (
+    ("join", "SELECT d.dog_guid AS DogID, d.user_guid AS UserID, AVG(r.rating) AS AvgRating, "
+             "COUNT(r.rating) AS NumRatings, d.breed FROM dogs d, reviews r "
+             "WHERE d.dog_guid=r.dog_guid AND d.user_guid=r.user_guid "
+             "GROUP BY UserID, DogID, d.breed HAVING NumRatings >= 3"),
+    ("group", "SELECT dog_guid, COUNT(*) AS tests FROM complete_tests GROUP BY dog_guid"),
+    ("distinct", "SELECT COUNT(DISTINCT user_guid) FROM complete_tests"),
+    ("lookup", "SELECT user_guid, membership_type FROM users WHERE user_guid=%s"),
+)
+
+
+def index_bytes(conn, names):
+    """Bytes used by the indexes ``names``."""
+    cursor = conn.cursor()
+    if db.dialect_of(conn) == "sqlite":
+        cursor.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")
+    else:
+        cursor.execute("SELECT index_name, SUM(stat_value) * @@innodb_page_size "
+                       "FROM mysql.innodb_index_stats WHERE stat_name = 'size' "
+                       "AND database_name = DATABASE() GROUP BY index_name")
+    sizes = dict(cursor.fetchall())
+    cursor.close()
+    return sum(int(sizes.get(name, 0)) for name in names)
+
+
+def measure(conn, queries, convert=False, repeat=1):
+    found = {}
+    for name, sql in queries:
+        if convert:
+            sql = rewrite_guids(sql)
+        seconds, rows = timed(server, conn, sql, repeat=repeat)
+        found[name] = (seconds, decode_rows(rows) if convert else rows)
+    return found
+
+
+def ordered_inserts(count):
+    """Seconds and index bytes for ``count`` keys inserted in creation order.
+
+    The keys are version-1 UUIDs about ten seconds apart, so their low
+    timestamp group (first in the text) wraps every seven minutes and only
+    the swapped layout is increasing.
+    """
+    conn = db.connect("sqlite://")
+    keys = []
+    for i in range(count):
+        stamp = 0x1E57144CE225842 + i * 100000007
+        keys.append(str(uuid.UUID(fields=(stamp & 0xFFFFFFFF, (stamp >> 32) & 0xFFFF,
+                                          0x1000 | (stamp >> 48) & 0x0FFF, 0xBA, 0x71,
+                                          0x058FBC01CF0B))))
+    found = []
+    for label, values in (("text", keys),
+                          ("binary", [db.uuid_to_bin(k) for k in keys]),
+                          ("swapped", [db.uuid_to_bin(k, 1) for k in keys])):
+        conn.execute("CREATE TABLE k_%s (k)" % label)
+        conn.execute("CREATE INDEX ix_%s ON k_%s (k)" % (label, label))
+        seconds, _ = timed(conn.executemany, "INSERT INTO k_%s VALUES (?)" % label,
+                           [(v,) for v in values])
+        found.append((label, seconds, index_bytes(conn, ["ix_%s" % label])))
+    conn.close()
+    return found
+
+
+def run(conn, repeat):
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_guid FROM users ORDER BY user_guid LIMIT 1")
+    probe = cursor.fetchone()[0]
+    cursor.close()
+    queries = [(name, sql % ("'%s'" % probe) if "%s" in sql else sql) for name, sql in QUERIES]
+    columns = guid_columns(SchemaCatalog.fetch(conn))
+    indexes = {index.name for c in columns for index in c.indexes}
+    # migrate() analyzes the tables it converts; start from the same footing
+    cursor = conn.cursor()
+    analyze(cursor, [c.table for c in columns], db.dialect_of(conn))
+    cursor.close()
+    before_bytes = index_bytes(conn, indexes)
+    before = measure(conn, queries, repeat=repeat)
+    migrate_s, _ = timed(migrate, conn)
+    after_bytes = index_bytes(conn, indexes)
+    after = measure(conn, queries, convert=True, repeat=repeat)
+    print("migration %.1fs; GUID indexes %.1f MB -> %.1f MB (%.0f%%)" % (
+        migrate_s, before_bytes / 1e6, after_bytes / 1e6, 100.0 * after_bytes / before_bytes))
+    print("  %-10s %10s %10s %8s" % ("query", "text ms", "binary ms", "speedup"))
+    for name, _ in queries:
+        (text_s, expected), (binary_s, rows) = before[name], after[name]
+        assert sorted(map(repr, expected)) == sorted(map(repr, rows)), name
+        print("  %-10s %10.2f %10.2f %7.2fx" % (name, text_s * 1000, binary_s * 1000,
+                                                text_s / binary_s))
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0], tables=("reviews", "complete_tests"))
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--inserts", type=int, default=200000,
+                   help="keys to insert for the index-order comparison")
+    args = p.parse_args(argv)
+    if args.url:
+        conn = db.connect(args.url)
+        try:
+            run(conn, args.repeat)
+        finally:
+            restore(conn)
+            conn.close()
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dognition.db")
+            conn = synthetic.create(path, scale=args.scale, seed=args.seed, tables=args.tables)
+            print("built synthetic dognitiondb (scale %g) at %s" % (args.scale, path))
+            run(conn, args.repeat)
+            conn.close()
+    print("inserting %d keys in creation order:" % args.inserts)
+    for label, seconds, size in ordered_inserts(args.inserts):
+        print("  %-8s %8.2fs  index %.1f MB" % (label, seconds, size / 1e6))
+
+
+if __name__ == "__main__":
+    main()
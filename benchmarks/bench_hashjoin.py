@@ -0,0 +1,115 @@
+"""Exercise 7 and 8 dogs/reviews joins: the server's plan vs dognition.hashjoin.
+
+Each query joins on ``dog_guid`` and ``user_guid`` and aggregates; the local
+version reads the two tables into a :class:`dognition.hashjoin.TableCache`
+once (timed as "load") and then hash-joins and aggregates in Python, which
+is what every later query against the cache costs.  The local results must
+match the server's.  Runs at each ``--scales`` factor; SQLite 3.39 or later
+is needed for the RIGHT JOIN query.
+"""
+
+import os
+import tempfile
+
+from dognition import db, synthetic
+from dognition.hashjoin import TableCache, join
+
+from .bench_topn import server
+from .common import parser, timed
+
+ON = [("dog_guid", "dog_guid"), ("user_guid", "user_guid")]
+DOGS = ["dog_guid", "user_guid", "breed", "breed_group", "breed_type"]
+REVIEWS = ["dog_guid", "user_guid", "rating"]
+
+QUERIES = (
+    ("inner", "SELECT d.dog_guid AS DogID, d.user_guid AS UserID, AVG(r.rating) AS AvgRating, "
+              "COUNT(r.rating) AS NumRatings, d.breed, d.breed_group, d.breed_type "
+              "FROM dogs d, reviews r "
+              "WHERE d.dog_guid=r.dog_guid AND d.user_guid=r.user_guid "
+              "GROUP BY UserID, DogID, d.breed, d.breed_group, d.breed_type "
+              "HAVING NumRatings >= 3"),
+    ("left", "SELECT d.breed_group, COUNT(*), COUNT(r.rating) "
+             "FROM dogs d LEFT JOIN reviews r "
+             "ON d.dog_guid=r.dog_guid AND d.user_guid=r.user_guid GROUP BY d.breed_group"),
+    ("right", "SELECT d.breed_type, COUNT(r.dog_guid), SUM(r.rating) "
+              "FROM reviews r RIGHT JOIN dogs d "
+              "ON r.dog_guid=d.dog_guid AND r.user_guid=d.user_guid GROUP BY d.breed_type"),
+    ("anti", "SELECT d.breed_group, COUNT(*) AS Unrated "
+             "FROM dogs d LEFT JOIN reviews r "
+             "ON d.dog_guid=r.dog_guid AND d.user_guid=r.user_guid "
+             "WHERE r.dog_guid IS NULL GROUP BY d.breed_group"),
+)
+
+
+def _add(groups, key, counted, value):
+    """Count ``counted`` rows and non-NULL ``value``s, and sum the values, per key."""
+    found = groups.get(key)
+    if found is None:
+        found = groups[key] = [0, 0, 0]
+    found[0] += counted
+    if value is not None:
+        found[1] += 1
+        found[2] += value
+
+
+def local(cache, how):
+    dogs = cache.relation("dogs", DOGS)
+    reviews = cache.relation("reviews", REVIEWS)
+    groups = {}
+    if how == "inner":
+        for row in join(dogs, reviews, ON).rows:
+            _add(groups, (row[1], row[0]) + row[2:5], True, row[7])
+        return [(k[1], k[0], s / n, n) + k[2:] for k, (_, n, s) in groups.items()
+                if n >= 3]
+    if how == "left":
+        for row in join(dogs, reviews, ON, "left").rows:
+            _add(groups, row[3], True, row[7])
+        return [(k, rows, n) for k, (rows, n, _) in groups.items()]
+    if how == "right":
+        for row in join(reviews, dogs, [(b, a) for a, b in ON], "right").rows:
+            _add(groups, row[7], row[0] is not None, row[2])
+        return [(k, rows, s if n else None) for k, (rows, n, s) in groups.items()]
+    for row in join(dogs, reviews, ON, "anti").rows:
+        _add(groups, row[3], True, None)
+    return [(k, rows) for k, (rows, _, _) in groups.items()]
+
+
+def _rows(rows):
+    return sorted((tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+                   for row in rows), key=repr)
+
+
+def run(conn, repeat):
+    cache = TableCache(conn)
+    load_s, _ = timed(lambda: (cache.relation("dogs", DOGS), cache.relation("reviews", REVIEWS)))
+    print("cache load %.2fs (%d rows)" % (load_s, cache.rows))
+    print("  %-6s %10s %10s %8s %8s" % ("join", "server ms", "local ms", "speedup", "rows"))
+    for how, sql in QUERIES:
+        server_s, expected = timed(server, conn, sql, repeat=repeat)
+        local_s, found = timed(local, cache, how, repeat=repeat)
+        assert _rows(expected) == _rows(found), how
+        print("  %-6s %10.1f %10.1f %7.1fx %8d" % (how, server_s * 1000, local_s * 1000,
+                                                   server_s / local_s, len(found)))
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0], tables=("reviews",))
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--scales", type=float, nargs="+", default=[1, 10, 100],
+                   help="synthetic scale factors to run at (ignored with --url)")
+    args = p.parse_args(argv)
+    if args.url:
+        run(db.connect(args.url), args.repeat)
+        return
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as directory:
+            # on disk: the larger scales do not fit SQLite's memory databases well
+            conn = synthetic.create(os.path.join(directory, "dognition.db"), scale=scale,
+                                    seed=args.seed, tables=args.tables)
+            print("scale %g" % scale)
+            run(conn, args.repeat)
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
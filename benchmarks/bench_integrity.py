@@ -0,0 +1,66 @@
+"""Whole-schema orphan scan: server anti-joins one by one vs dognition.integrity.
+
+Counts the orphaned rows of every :func:`dognition.integrity.implied_keys`
+relationship with ``LEFT JOIN ... IS NULL`` on the server, one after the
+other, then runs :func:`dognition.integrity.scan` with 1, 2, 4, ... worker
+processes (up to ``--workers``, by default the CPU count).  The orphan
+counts must agree.  Prints each wall time next to the longest single check
+of that run, which is what the scan approaches once there is a core for
+every check.
+"""
+
+import os
+import tempfile
+
+from dognition import db, integrity, synthetic
+from dognition.catalog import SchemaCatalog
+
+from .bench_orphans import LEFT_JOIN
+from .bench_topn import server
+from .common import parser, timed
+
+
+def run(url, conn, counts, repeat):
+    catalog = SchemaCatalog.fetch(conn)
+    checks = integrity.implied_keys(catalog)
+    expected, server_s = [], 0.0
+    for check in checks:
+        seconds, rows = timed(server, conn, LEFT_JOIN % check._asdict(), repeat=repeat)
+        expected.append(rows[0][0])
+        server_s += seconds
+    print("%d relationships; server anti-joins one by one %.2fs" % (len(checks), server_s))
+    print("  %8s %9s %11s %8s" % ("workers", "wall s", "largest s", "speedup"))
+    first = None
+    for workers in counts:
+        seconds, reports = timed(integrity.scan, url, checks, workers=workers,
+                                 catalog=catalog, repeat=repeat)
+        assert [r.orphans for r in reports] == expected, workers
+        first = first or seconds
+        print("  %8d %9.2f %11.2f %7.1fx" % (workers, seconds,
+                                             max(r.seconds for r in reports), first / seconds))
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0],
+               tables=("reviews", "complete_tests", "site_activities", "exam_answers"))
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                   help="largest worker count to try")
+    args = p.parse_args(argv)
+    counts = [1]
+    while counts[-1] * 2 <= args.workers:
+        counts.append(counts[-1] * 2)
+    if args.url:
+        run(args.url, db.connect(args.url), counts, args.repeat)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "dognition.db")
+        conn = synthetic.create(path, scale=args.scale, seed=args.seed, tables=args.tables)
+        conn.commit()
+        print("built synthetic dognitiondb (scale %g) at %s" % (args.scale, path))
+        run("sqlite:///" + path, conn, counts, args.repeat)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Exercise 7 and 10 multi-table joins: written order vs dognition.joinorder.
+
+Each query runs three ways: as written, leaving the order to the server;
+with the tables forced into the order they are written (``STRAIGHT_JOIN``,
+or ``CROSS JOIN`` on SQLite); and forced into the order
+:func:`dognition.joinorder.plan` picks.  The last query is Exercise 7's
+golden retriever join with the FROM list written largest table first.  The
+results must agree; the estimated and counted rows of each planned step
+are printed after the times.
+"""
+
+from dognition.catalog import SchemaCatalog
+from dognition.db import dialect_of
+from dognition.joinorder import measure, plan
+from dognition.stats import StatsCatalog
+
+from .bench_topn import server
+from .common import open_database, parser, timed
+
+QUERIES = (
+    "SELECT DISTINCT d.user_guid AS UserID, u.membership_type, d.dog_guid AS DogId, d.breed "
+    "FROM dogs d, users u, complete_tests c "
+    "WHERE d.dog_guid=c.dog_guid AND d.user_guid=u.user_guid AND d.breed='Golden Retriever'",
+    "SELECT u.state AS State, d.breed AS Breed, COUNT(DISTINCT d.dog_guid) "
+    "FROM users u, dogs d WHERE d.user_guid=u.user_guid AND breed='Golden Retriever' "
+    "GROUP BY State HAVING state='NC'",
+    "SELECT d.dog_guid AS dogID, d.breed_type AS breed_type, COUNT(c.created_at) AS numtests "
+    "FROM dogs d, complete_tests c WHERE d.dog_guid=c.dog_guid AND d.breed_group='Toy' "
+    "GROUP BY dogID, breed_type",
+    "SELECT DISTINCT d.user_guid AS UserID, u.membership_type, d.dog_guid AS DogId, d.breed "
+    "FROM complete_tests c, dogs d, users u "
+    "WHERE d.dog_guid=c.dog_guid AND d.user_guid=u.user_guid AND d.breed='Golden Retriever'",
+)
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0], tables=("complete_tests",))
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args(argv)
+    conn = open_database(args)
+    catalog = SchemaCatalog.load(conn)
+    stats = StatsCatalog.load(conn)
+    dialect = dialect_of(conn)
+    print("%-48s %10s %10s %10s" % ("query", "server ms", "written ms", "planned ms"))
+    for sql in QUERIES:
+        written = plan(sql, stats, catalog, keep_order=True)
+        planned = plan(sql, stats, catalog)
+        server_s, expected = timed(server, conn, sql, repeat=args.repeat)
+        written_s, rows = timed(server, conn, written.sql(dialect), repeat=args.repeat)
+        assert sorted(map(repr, rows)) == sorted(map(repr, expected)), sql
+        planned_s, rows = timed(server, conn, planned.sql(dialect), repeat=args.repeat)
+        assert sorted(map(repr, rows)) == sorted(map(repr, expected)), sql
+        print("%-48s %10.1f %10.1f %10.1f" % (sql[:48], server_s * 1000, written_s * 1000,
+                                              planned_s * 1000))
+        for step, actual in zip(planned.steps, measure(conn, planned)):
+            print("    %-20s estimated %8d  actual %8d" % (
+                step.table.name, step.estimated, actual))
+
+
+if __name__ == "__main__":
+    main()
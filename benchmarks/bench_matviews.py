@@ -0,0 +1,91 @@
+"""Exercise 5 and 8 rating aggregates: grouping reviews vs the materialized views.
+
+Times the per-test average and the per-dog ``HAVING NumRatings >= 10 ORDER
+BY AvgRating DESC`` query over reviews against the same answers read from
+:mod:`dognition.matviews`, then adds 1% new reviews and changes the rating
+of a few old ones, and compares a :meth:`refresh` with a full rebuild,
+which must leave the same view contents.
+"""
+
+from decimal import Decimal
+
+from dognition import matviews
+
+from .bench_topn import server
+from .common import open_database, parser, timed
+
+TEST_RATINGS = "SELECT test_name, AVG(rating) AS AVG_Rating FROM reviews GROUP BY test_name"
+DOG_RATINGS = (
+    "SELECT d.dog_guid AS DogID, d.user_guid AS UserID, AVG(r.rating) AS AvgRating, "
+    "COUNT(r.rating) AS NumRatings, d.breed, d.breed_group, d.breed_type "
+    "FROM dogs d, reviews r WHERE d.dog_guid=r.dog_guid AND d.user_guid=r.user_guid "
+    "GROUP BY UserID, DogID, d.breed, d.breed_group, d.breed_type "
+    "HAVING NumRatings >= %d ORDER BY AvgRating DESC, DogID, UserID LIMIT 200")
+
+
+def _rows(rows):
+    return [tuple(round(float(v), 6) if isinstance(v, (float, Decimal)) else v for v in row)
+            for row in rows]
+
+
+def _contents(conn, view):
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM %s ORDER BY %s" % (view.name, ", ".join(view.keys)))
+    rows = cursor.fetchall()
+    cursor.close()
+    return _rows(rows)
+
+
+def add_reviews(conn, fraction=0.01, changed=20):
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*), MAX(created_at) FROM reviews")
+    total, latest = cursor.fetchone()
+    cursor.execute(
+        "INSERT INTO reviews (rating, created_at, updated_at, user_guid, dog_guid, "
+        "subcategory_name, test_name) SELECT rating, %s, %s, user_guid, dog_guid, "
+        "subcategory_name, test_name FROM reviews LIMIT %d"
+        % ("'9999-01-01 00:00:00'", "'9999-01-01 00:00:00'", max(1, int(total * fraction))))
+    cursor.execute(
+        "UPDATE reviews SET rating = 0, updated_at = '9999-01-02 00:00:00' "
+        "WHERE created_at <= '%s' AND dog_guid IN "
+        "(SELECT dog_guid FROM (SELECT dog_guid FROM reviews LIMIT %d) picked)"
+        % (latest, changed))
+    cursor.close()
+    conn.commit()
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0], tables=("dogs", "reviews"))
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--min-ratings", type=int, default=3,
+                   help="HAVING threshold (the exercise uses 10)")
+    args = p.parse_args(argv)
+    conn = open_database(args)
+    for view in matviews.VIEWS:
+        view.drop(conn)
+    create_s, _ = timed(matviews.refresh_all, conn)
+    print("created both views in %.2fs" % create_s)
+
+    direct_s, expected = timed(server, conn, TEST_RATINGS, repeat=args.repeat)
+    view_s, (_, found) = timed(matviews.test_ratings, conn, repeat=args.repeat)
+    assert len(expected) == len(found)
+    print("per-test average:   reviews %8.1fms   view %8.1fms" % (direct_s * 1000, view_s * 1000))
+    sql = DOG_RATINGS % args.min_ratings
+    direct_s, expected = timed(server, conn, sql, repeat=args.repeat)
+    view_s, (_, found) = timed(matviews.dog_ratings, conn, args.min_ratings,
+                               repeat=args.repeat)
+    assert _rows(expected) == _rows(found)
+    print("per-dog HAVING:     reviews %8.1fms   view %8.1fms" % (direct_s * 1000, view_s * 1000))
+
+    add_reviews(conn)
+    refresh_s, deltas = timed(matviews.refresh_all, conn)
+    refreshed = [_contents(conn, v) for v in matviews.VIEWS]
+    rebuild_s, _ = timed(lambda: [v.rebuild(conn) for v in matviews.VIEWS])
+    assert refreshed == [_contents(conn, v) for v in matviews.VIEWS]
+    for name, delta in sorted(deltas.items()):
+        print("%s: %d new rows, %d groups recomputed" % (name, delta.inserted, delta.updated))
+    print("refresh %.3fs vs rebuild %.3fs" % (refresh_s, rebuild_s))
+
+
+if __name__ == "__main__":
+    main()
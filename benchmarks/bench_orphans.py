@@ -0,0 +1,86 @@
+"""Exercise 8 and 9 orphan checks: server anti-joins vs dognition.bloom.
+
+For each of :data:`dognition.bloom.ORPHAN_CHECKS` counts the orphaned rows
+with ``LEFT JOIN ... IS NULL`` and with ``NOT EXISTS`` on the server, and
+with :func:`dognition.bloom.orphans` streaming the key column past a
+:class:`~dognition.bloom.KeySet` of the reference column (built once per
+reference table, timed as "build"), both row by row ("stream") and counted
+per key on the server ("grouped").  The four counts must agree.  The
+"probe" column times :meth:`KeySet.contains` alone on keys already in
+memory, next to a plain list comprehension over a Python ``set`` of the
+same keys; the operator must not be slower than that, which a Bloom filter
+in front of the set was.
+"""
+
+import os
+import tempfile
+
+from dognition import db, synthetic
+from dognition.bloom import ORPHAN_CHECKS, KeySet, orphans
+from dognition.streaming import stream
+
+from .bench_topn import server
+from .common import parser, timed
+
+LEFT_JOIN = ("SELECT COUNT(*) FROM %(table)s c LEFT JOIN %(ref_table)s r "
+             "ON c.%(column)s = r.%(ref_column)s "
+             "WHERE r.%(ref_column)s IS NULL AND c.%(column)s IS NOT NULL")
+NOT_EXISTS = ("SELECT COUNT(*) FROM %(table)s c WHERE c.%(column)s IS NOT NULL AND NOT EXISTS "
+              "(SELECT 1 FROM %(ref_table)s r WHERE r.%(ref_column)s = c.%(column)s)")
+
+
+def _keys(conn, table, column):
+    with stream(conn, "SELECT %s FROM %s" % (column, table), batch_size=50000) as rows:
+        return [row[0] for row in rows]
+
+
+def run(conn, repeat):
+    print("  %-28s %8s %8s %9s %9s %9s %8s %8s %7s" % (
+        "check", "build ms", "join ms", "exists ms", "stream ms", "grouped ms", "probe ms",
+        "set ms", "orphans"))
+    keysets = {}
+    for check in ORPHAN_CHECKS:
+        ref = (check.ref_table, check.ref_column)
+        build_s = 0.0
+        if ref not in keysets:
+            build_s, keysets[ref] = timed(KeySet.load, conn, *ref)
+        keys = keysets[ref]
+        params = check._asdict()
+        join_s, joined = timed(server, conn, LEFT_JOIN % params, repeat=repeat)
+        exists_s, existing = timed(server, conn, NOT_EXISTS % params, repeat=repeat)
+        stream_s, streamed = timed(orphans, conn, check.table, check.column, keys,
+                                   grouped=False, repeat=repeat)
+        grouped_s, found = timed(orphans, conn, check.table, check.column, keys, repeat=repeat)
+        assert joined[0][0] == existing[0][0] == streamed.count == found.count, check
+        assert streamed[:-1] == found[:-1], check
+        probe = _keys(conn, check.table, check.column)
+        # sub-millisecond timings: best of more calls than the server queries get
+        probe_s, _ = timed(keys.contains, probe, repeat=repeat * 10)
+        exact = set(keys.keys)
+        set_s, _ = timed(lambda: [k in exact for k in probe], repeat=repeat * 10)
+        assert probe_s <= set_s * 1.25 + 0.001, (check, probe_s, set_s)
+        print("  %-28s %8.1f %8.1f %9.1f %9.1f %9.1f %8.1f %8.1f %7d" % (
+            "%s.%s" % (check.table, check.column), build_s * 1000, join_s * 1000,
+            exists_s * 1000, stream_s * 1000, grouped_s * 1000, probe_s * 1000,
+            set_s * 1000, found.count))
+        print("  %-28s %.1fM keys/s probed" % ("", len(probe) / max(probe_s, 1e-9) / 1e6))
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0],
+               tables=("reviews", "complete_tests", "site_activities", "exam_answers"))
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args(argv)
+    if args.url:
+        run(db.connect(args.url), args.repeat)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        conn = synthetic.create(os.path.join(directory, "dognition.db"), scale=args.scale,
+                                seed=args.seed, tables=args.tables)
+        print("scale %g" % args.scale)
+        run(conn, args.repeat)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
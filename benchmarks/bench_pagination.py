@@ -0,0 +1,63 @@
+"""Page latency of keyset pagination vs LIMIT/OFFSET on site_activities.
+
+Walks every page of the table with :class:`dognition.KeysetPaginator` and
+samples the same page positions with ``LIMIT offset, n``.  Keyset latency
+should stay flat out to the last page while OFFSET latency grows with the
+page number.
+"""
+
+import time
+
+from dognition.db import quote
+from dognition.pagination import KeysetPaginator
+
+from .common import open_database, parser
+
+
+def offset_page(conn, pager, offset):
+    order = ", ".join(quote(c) for c in pager.key)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM %s ORDER BY %s LIMIT %d, %d"
+                   % (quote(pager.table), order, offset, pager.page_size))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0], tables=("site_activities",))
+    p.add_argument("--table", default="site_activities")
+    p.add_argument("--page-size", type=int, default=10)
+    p.add_argument("--samples", type=int, default=10)
+    p.add_argument("--create-index", action="store_true",
+                   help="create the keyset index before measuring")
+    args = p.parse_args(argv)
+    conn = open_database(args)
+    pager = KeysetPaginator(conn, args.table, page_size=args.page_size)
+    if args.create_index or not args.url:
+        conn.cursor().execute(pager.index_ddl())
+
+    keyset_ms = []
+    token = None
+    while True:
+        started = time.perf_counter()
+        page = pager.fetch(token)
+        keyset_ms.append((time.perf_counter() - started) * 1000)
+        if page.next_token is None:
+            break
+        token = page.next_token
+
+    pages = len(keyset_ms)
+    step = max(1, (pages - 1) // max(1, args.samples - 1))
+    sampled = sorted(set(list(range(0, pages, step)) + [pages - 1]))
+    print("%s: %d pages of %d rows" % (args.table, pages, args.page_size))
+    print("%10s %12s %12s" % ("page", "keyset ms", "offset ms"))
+    for index in sampled:
+        started = time.perf_counter()
+        offset_page(conn, pager, index * args.page_size)
+        offset_ms = (time.perf_counter() - started) * 1000
+        print("%10d %12.3f %12.3f" % (index + 1, keyset_ms[index], offset_ms))
+
+
+if __name__ == "__main__":
+    main()
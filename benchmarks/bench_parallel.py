@@ -0,0 +1,75 @@
+"""Exercise 5, 7 and 8 GROUP BYs: one server thread vs dognition.parallel.
+
+Runs each query on the server, then through :func:`dognition.parallel.execute`
+with 1, 2, 4, ... worker processes (up to the CPU count), checks that the
+rows agree and prints the time and speedup over one worker.  Workers open
+their own connections, so without ``--url`` the synthetic copy is written to
+a temporary file instead of memory.
+"""
+
+import os
+import tempfile
+
+from dognition import db, parallel, synthetic
+
+from .bench_topn import server
+from .common import parser, timed
+
+QUERIES = (
+    "SELECT state, zip, COUNT(DISTINCT user_guid) FROM users WHERE country='US' "
+    "GROUP BY state, zip HAVING COUNT(DISTINCT user_guid) >= 2 ORDER BY state, zip",
+    "SELECT dog_guid, COUNT(*) AS tests, COUNT(DISTINCT test_name) AS kinds, "
+    "MIN(created_at), MAX(created_at) FROM complete_tests GROUP BY dog_guid "
+    "HAVING tests >= 10 ORDER BY tests DESC, dog_guid LIMIT 100",
+    "SELECT d.dog_guid AS DogID, d.user_guid AS UserID, AVG(r.rating) AS AvgRating, "
+    "COUNT(r.rating) AS NumRatings, d.breed FROM dogs d, reviews r "
+    "WHERE d.dog_guid=r.dog_guid AND d.user_guid=r.user_guid "
+    "GROUP BY UserID, DogID, d.breed HAVING NumRatings >= 3 ORDER BY AvgRating DESC, DogID",
+    "SELECT user_guid, COUNT(*), SUM(test_number) FROM site_activities GROUP BY user_guid",
+)
+
+
+def _rows(rows):
+    return sorted((tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+                   for row in rows), key=repr)
+
+
+def run(url, conn, counts, repeat):
+    print("%-50s %10s %s" % ("query", "server ms",
+                             " ".join("%12s" % ("%d worker(s)" % n) for n in counts)))
+    for sql in QUERIES:
+        server_s, expected = timed(server, conn, sql, repeat=repeat)
+        times = []
+        for workers in counts:
+            seconds, (_, found) = timed(parallel.execute, url, sql, workers=workers,
+                                        repeat=repeat)
+            assert _rows(expected) == _rows(found), (sql, workers)
+            times.append(seconds)
+        print("%-50s %10.1f %s" % (sql[:50], server_s * 1000, " ".join(
+            "%7.1f %3.1fx" % (s * 1000, times[0] / s) for s in times)))
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0],
+               tables=("complete_tests", "reviews", "site_activities"))
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                   help="largest worker count to try")
+    args = p.parse_args(argv)
+    counts = [1]
+    while counts[-1] * 2 <= args.workers:
+        counts.append(counts[-1] * 2)
+    if args.url:
+        run(args.url, db.connect(args.url), counts, args.repeat)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "dognition.db")
+        conn = synthetic.create(path, scale=args.scale, seed=args.seed, tables=args.tables)
+        conn.commit()
+        print("built synthetic dognitiondb (scale %g) at %s" % (args.scale, path))
+        run("sqlite:///" + path, conn, counts, args.repeat)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
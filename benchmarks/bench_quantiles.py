@@ -0,0 +1,73 @@
+"""Per-test and per-breed-group duration quantiles: sorting vs t-digests.
+
+The exact answer needs every duration of a group in order, so the query
+sorts the whole column (``ORDER BY test_name, duration``) and picks the
+ranks out of the result.  :class:`dognition.tdigest.DigestStore` scans the
+table once into monthly digests and then answers from those; the build is
+timed separately from the query.  Reports how far, in rank, the estimated
+median/p90/p99 are from the exact ones.
+"""
+
+import tempfile
+from bisect import bisect_left, bisect_right
+
+from dognition.tdigest import QUANTILES, DigestStore
+
+from .bench_durations import duration_sql
+from .common import open_database, parser, timed
+
+
+def exact(conn):
+    """``{test_name: sorted durations}`` by sorting on the server."""
+    minutes = duration_sql(conn, "minute")
+    cursor = conn.cursor()
+    cursor.execute("SELECT test_name, %s AS minutes FROM exam_answers WHERE %s IS NOT NULL "
+                   "ORDER BY test_name, minutes" % (minutes, minutes))
+    groups = {}
+    for name, value in cursor:
+        groups.setdefault(name.casefold(), []).append(value)
+    cursor.close()
+    return groups
+
+
+def picked(groups, qs=QUANTILES):
+    return {name: [values[min(len(values) - 1, int(q * len(values)))] for q in qs]
+            for name, values in groups.items()}
+
+
+def rank_error(values, estimate, q):
+    """How far ``q`` lies outside the ranks ``estimate`` occupies in ``values``."""
+    low = bisect_left(values, estimate) / len(values)
+    high = bisect_right(values, estimate) / len(values)
+    return max(0.0, low - q, q - high)
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0], tables=("exam_answers",), scale=0.2)
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args(argv)
+    conn = open_database(args)
+    sort_s, groups = timed(exact, conn)
+    answers = picked(groups)
+    with tempfile.TemporaryDirectory() as directory:
+        store = DigestStore(directory + "/digests.json")
+        build_s, _ = timed(store.build, conn, "duration")
+        store.save()
+        load_s, store = timed(DigestStore.load, path=store.path)
+    query_s, found = timed(store.quantiles, "duration", "test_name", repeat=args.repeat)
+    breed_s, _ = timed(store.quantiles, "duration", "breed_group", repeat=args.repeat)
+    worst = [max(rank_error(groups[name.casefold()], values[i], q)
+                 for name, values in found.items())
+             for i, q in enumerate(QUANTILES)]
+    print("sort and pick:      %8.2fs" % sort_s)
+    print("digest build:       %8.2fs (once), load %.3fs" % (build_s, load_s))
+    print("per test_name:      %8.1fms, per breed_group %.1fms" % (query_s * 1000, breed_s * 1000))
+    print("worst rank error:   %s" % ", ".join(
+        "p%g %.3f%%" % (q * 100, e * 100) for q, e in zip(QUANTILES, worst)))
+    for name in sorted(found)[:5]:
+        print("  %-30s exact %s  digest %s" % (
+            name, answers[name.casefold()], ["%.1f" % v for v in found[name]]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Exercise 2 and 5 time groupings: full scans vs the rollup cube.
+
+Runs the monthly and per-test counts of complete_tests on the server and
+through :meth:`dognition.rollup.Rollup.answer`, after timing the cube's
+build and an incremental refresh that finds no new rows.  Both paths must
+return the same groups and counts; distinct-dog counts, which the cube
+estimates from sketches, must come within four standard errors of the
+server's.  A second cube built with ``exact=True`` must match the server
+exactly, and the size of each cache file is printed next to the other.
+"""
+
+import os
+import tempfile
+
+from dognition.hll import HyperLogLog
+from dognition.rollup import PRECISION, Rollup
+
+from .bench_topn import server
+from .common import open_database, parser, timed
+
+QUERIES = (
+    "SELECT test_name, MONTH(created_at) AS Month, COUNT(created_at) AS Num_Completed_Tests "
+    "FROM complete_tests GROUP BY test_name, MONTH(created_at)",
+    "SELECT MONTH(created_at) AS Month, COUNT(*) FROM complete_tests "
+    "WHERE YEAR(created_at) = 2014 GROUP BY Month ORDER BY Month",
+    "SELECT DISTINCT test_name, subcategory_name FROM complete_tests",
+    "SELECT YEAR(created_at), COUNT(DISTINCT dog_guid) FROM complete_tests GROUP BY 1",
+    "SELECT DAYOFWEEK(created_at) AS Day, COUNT(*) FROM complete_tests "
+    "WHERE created_at >= '2014-03-15' AND created_at < '2014-06-01' GROUP BY Day",
+    "SELECT test_name, COUNT(DISTINCT dog_guid) FROM complete_tests "
+    "WHERE created_at >= '2014-03-15' AND created_at < '2014-06-01' GROUP BY test_name",
+)
+
+
+def _close(expected, found, error):
+    """Whether the rows agree, integers within ``error`` of each other relatively."""
+    if len(expected) != len(found):
+        return False
+    for want, got in zip(expected, found):
+        for a, b in zip(want, got):
+            if isinstance(a, int) and isinstance(b, int):
+                if abs(a - b) > max(2, error * a):
+                    return False
+            elif a != b:
+                return False
+    return True
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0], tables=("complete_tests",))
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args(argv)
+    conn = open_database(args)
+    with tempfile.TemporaryDirectory() as directory:
+        cube = Rollup("complete_tests", path=directory + "/rollup.json")
+        build_s, _ = timed(cube.build, conn)
+        refresh_s, _ = timed(cube.refresh, conn)
+        cube.save()
+        load_s, cube = timed(Rollup.load, conn, "complete_tests", cube.path, refresh=False)
+        exact = Rollup("complete_tests", path=directory + "/exact.json", exact=True)
+        exact.build(conn)
+        exact.save()
+        sizes = os.path.getsize(cube.path), os.path.getsize(exact.path)
+    print("build %.2fs, empty refresh %.3fs, load %.2fs: %d rows in %d day cells"
+          % (build_s, refresh_s, load_s, cube.rows, len(cube.cells)))
+    print("cache %.0f kB with sketches, %.0f kB with exact dog hashes"
+          % (sizes[0] / 1e3, sizes[1] / 1e3))
+    cube.answer(QUERIES[0])  # works out the per-day parts once
+    exact.answer(QUERIES[0])
+    error = 4 * HyperLogLog(PRECISION).error
+    print("%-60s %10s %10s %10s" % ("query", "server ms", "cube ms", "exact ms"))
+    for sql in QUERIES:
+        server_s, expected = timed(server, conn, sql, repeat=args.repeat)
+        expected = sorted(map(tuple, expected), key=repr)
+        cube_s, (_, found) = timed(cube.answer, sql, repeat=args.repeat)
+        assert _close(expected, sorted(found, key=repr), error), sql
+        exact_s, (_, found) = timed(exact.answer, sql, exact=True, repeat=args.repeat)
+        assert expected == sorted(found, key=repr), sql
+        print("%-60s %10.1f %10.1f %10.1f" % (sql[:60], server_s * 1000, cube_s * 1000,
+                                              exact_s * 1000))
+
+
+if __name__ == "__main__":
+    main()
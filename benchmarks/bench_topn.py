@@ -0,0 +1,79 @@
+"""``ORDER BY ... LIMIT k``: server sort vs the local top-N heap.
+
+Runs the Exercise 3 and Exercise 7 top-N queries three ways: on the
+server (a filesort, or SQLite's sorter), through
+:func:`dognition.topn.execute` on a streamed result, and with
+:func:`dognition.topn.top_n` over a cached copy of the rows compared with
+sorting that copy in full.  All paths must return the same rows.
+"""
+
+from dognition.topn import execute, plan, top_n
+
+from .common import open_database, parser, timed
+
+# each ORDER BY ends in enough columns to break ties, so that every path
+# has only one right answer at the LIMIT
+QUERIES = (
+    "SELECT user_guid, dog_guid, test_name FROM complete_tests "
+    "ORDER BY created_at, user_guid, dog_guid, test_name LIMIT 10",
+    "SELECT user_guid, dog_guid, test_name, created_at FROM complete_tests "
+    "ORDER BY created_at DESC, test_name, user_guid, dog_guid LIMIT 100",
+    "SELECT d.breed, COUNT(s.script_detail_id) AS activity "
+    "FROM dogs d, site_activities s "
+    "WHERE d.dog_guid=s.dog_guid AND s.script_detail_id IS NOT NULL "
+    "GROUP BY breed ORDER BY activity DESC, breed LIMIT 3",
+)
+
+
+def server(conn, sql):
+    cursor = conn.cursor()
+    cursor.execute(sql)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def snapshot(conn, sql):
+    """Rows and sort order of the un-ordered query, held in memory."""
+    found = plan(sql)
+    cursor = conn.cursor()
+    cursor.execute(found.inner)
+    rows = cursor.fetchall()
+    order = found.order([d[0] for d in cursor.description])
+    cursor.close()
+    return found, rows, order
+
+
+def full_sort(rows, found, order):
+    ordered = rows
+    for index, descending in reversed(order):
+        ordered = sorted(ordered, key=lambda r: (r[index] is not None, r[index]),
+                         reverse=descending)
+    return ordered[found.offset:found.offset + found.limit]
+
+
+def main(argv=None):
+    p = parser(__doc__.splitlines()[0],
+               tables=("complete_tests", "site_activities"))
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args(argv)
+    conn = open_database(args)
+    print("%-48s %10s %10s %12s %12s" % (
+        "query", "server ms", "stream ms", "cached heap", "cached sort"))
+    for sql in QUERIES:
+        server_s, expected = timed(server, conn, sql, repeat=args.repeat)
+        stream_s, (_, rows) = timed(execute, conn, sql, repeat=args.repeat)
+        found, cached, order = snapshot(conn, sql)
+        heap_s, heap_rows = timed(top_n, cached, found.limit, order, found.offset,
+                                  repeat=args.repeat)
+        sort_s, sort_rows = timed(full_sort, cached, found, order, repeat=args.repeat)
+        width = len(expected[0]) if expected else 0
+        assert [r[:width] for r in heap_rows] == [r[:width] for r in sort_rows]
+        assert sorted(map(repr, rows)) == sorted(map(repr, expected)), sql
+        print("%-48s %10.1f %10.1f %12.1f %12.1f" % (
+            " ".join(sql.split())[:48], server_s * 1000, stream_s * 1000,
+            heap_s * 1000, sort_s * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Shared command-line plumbing for the benchmark scripts."""
+
+import argparse
+import time
+
+from dognition import db, synthetic
+
+
+def parser(description, tables=None, scale=1.0):
+    """Return an argument parser with the ``--url``/``--scale`` options.
+
+    Without ``--url`` the benchmark runs against a synthetic SQLite copy of
+    dognitiondb built with :func:`dognition.synthetic.create`.
+    """
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument("--url", help="database URL (default: synthetic SQLite copy)")
+    p.add_argument("--scale", type=float, default=scale,
+                   help="row-count multiplier for the synthetic copy")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(tables=tables)
+    return p
+
+
+def open_database(args):
+    if args.url:
+        return db.connect(args.url)
+    started = time.perf_counter()
+    conn = synthetic.create(scale=args.scale, seed=args.seed, tables=args.tables)
+    print("built synthetic dognitiondb (scale %g) in %.1fs"
+          % (args.scale, time.perf_counter() - started))
+    return conn
+
+
+def timed(func, *args, repeat=1, **kwargs):
+    """Return ``(best seconds, result)`` over ``repeat`` calls."""
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
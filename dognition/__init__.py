@@ -0,0 +1,24 @@
+"""Helpers for working with the Dognition database outside the notebooks."""
+
+from .breedsearch import LikeIndex
+from .catalog import SchemaCatalog
+from .db import DEFAULT_URL, TABLES, connect
+from .export import export
+from .pagination import KeysetPaginator, Page
+from .pool import ConnectionPool, get_pool
+from .streaming import StreamingResult, stream
+
+__all__ = [
+    "ConnectionPool",
+    "DEFAULT_URL",
+    "KeysetPaginator",
+    "LikeIndex",
+    "Page",
+    "SchemaCatalog",
+    "StreamingResult",
+    "TABLES",
+    "connect",
+    "export",
+    "get_pool",
+    "stream",
+]
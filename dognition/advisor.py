@@ -0,0 +1,343 @@
+"""Index advisor driven by the exercise workload.
+
+The exercises filter, join and group on the same few columns over and over
+(``users.free_start_user``, ``dogs.dna_tested``, ``users.state IN (...)``,
+``complete_tests.created_at``, ``(dog_guid, user_guid)`` between dogs and
+reviews, ``exam_answers.test_name`` ...).  :func:`advise` reads every query
+in the exercise scripts, works out which columns each one filters, joins,
+groups and sorts on per table, and proposes composite indexes (covering
+ones when the query touches few enough columns).  :func:`estimate` then
+measures each proposal on a *local* copy of dognitiondb by creating the
+index, comparing plans and costs, and dropping it again::
+
+    python -m dognition.advisor                       # synthetic SQLite copy
+    python -m dognition.advisor --url mysql://root@localhost/dognition_copy
+
+On MySQL the cost is the optimizer's ``query_cost`` from ``EXPLAIN
+FORMAT=JSON``; SQLite has no cost model, so there the cost is the measured
+run time.  Queries are analysed after :func:`dognition.sargable.rewrite_dates`,
+as the runner would send them.
+"""
+
+import argparse
+import json
+import time
+from collections import OrderedDict, namedtuple
+
+from .catalog import SchemaCatalog
+from .db import connect, dialect_of, explain, quote
+from .sargable import rewrite_dates
+from .sqlquery import ParseError, parse
+from .workload import extract
+
+MAX_INDEX_COLUMNS = 4
+
+Candidate = namedtuple("Candidate", "table columns covering queries")
+# ``error`` is the server's message when it refused to create the index;
+# the other measurements are then ``None``
+Estimate = namedtuple("Estimate",
+                      "candidate query before after plan_before plan_after unit error")
+
+_EQUALITY = {"eq", "in", "null"}
+_RANGE = {"range", "notnull"}
+
+
+class _Access:
+    """How one query touches one table."""
+
+    def __init__(self):
+        self.eq, self.join, self.range, self.group, self.order = [], [], [], [], []
+        self.used = set()
+        self.star = False
+
+    @staticmethod
+    def add(columns, name):
+        if name not in columns:
+            columns.append(name)
+
+
+def _item_columns(query, item):
+    """Columns of a GROUP BY / ORDER BY item, following positions and aliases."""
+    if item.position is not None:
+        return query.select[item.position - 1].columns
+    if len(item.columns) == 1 and item.columns[0].qualifier is None:
+        alias = query.select_aliases.get(item.columns[0].name.lower())
+        if alias is not None:
+            return alias.columns
+    return item.columns
+
+
+def table_access(query, schema):
+    """Return ``{table: _Access}`` for the base tables of one query block."""
+    access = OrderedDict()
+    for table in query.tables:
+        if table.name:
+            access.setdefault(table.name, _Access())
+
+    def owner(ref):
+        table = query.resolve(ref, schema)
+        return access.get(table) if table else None
+
+    def use(refs):
+        for ref in refs:
+            target = owner(ref)
+            if target is not None:
+                target.used.add(ref.name.lower())
+
+    for item in query.select:
+        use(item.columns)
+        if item.text == "*":
+            for target in access.values():
+                target.star = True
+        elif item.text.endswith(".*"):
+            target = access.get((query.aliases.get(item.text[:-2].lower()) or
+                                 query.tables[0]).name)
+            if target is not None:
+                target.star = True
+    for predicate in query.predicates():
+        use(predicate.columns)
+        if predicate.kind == "join":
+            for ref in predicate.columns:
+                target = owner(ref)
+                if target is not None:
+                    target.add(target.join, ref.name.lower())
+            continue
+        if len(predicate.columns) != 1:
+            continue
+        target = owner(predicate.columns[0])
+        if target is None:
+            continue
+        name = predicate.columns[0].name.lower()
+        if predicate.kind in _EQUALITY:
+            target.add(target.eq, name)
+        elif predicate.kind in _RANGE or (
+                predicate.kind == "like" and isinstance(predicate.value, str)
+                and predicate.value[:1] not in ("%", "_", "")):
+            target.add(target.range, name)
+    for item in query.group_by:
+        columns = _item_columns(query, item)
+        use(columns)
+        for ref in columns:
+            target = owner(ref)
+            if target is not None:
+                target.add(target.group, ref.name.lower())
+    for item in query.order_by:
+        columns = _item_columns(query, item)
+        use(columns)
+        for ref in columns:
+            target = owner(ref)
+            if target is not None:
+                target.add(target.order, ref.name.lower())
+    return access
+
+
+def _key_columns(access, single_table):
+    columns = []
+    for name in access.eq + access.join:
+        access.add(columns, name)
+    if access.group:
+        for name in access.group:
+            access.add(columns, name)
+    elif access.range:
+        access.add(columns, access.range[0])
+    elif access.order and single_table:
+        for name in access.order:
+            access.add(columns, name)
+    return columns[:MAX_INDEX_COLUMNS]
+
+
+def query_candidates(sql, schema):
+    """Index candidates for one SQL statement (``[]`` if it does not parse)."""
+    try:
+        parsed = parse(sql)
+    except ParseError:
+        return []
+    found = []
+    for block in parsed.walk():
+        single = len(block.tables) == 1
+        for table, access in table_access(block, schema).items():
+            key = _key_columns(access, single)
+            if not key:
+                continue
+            extra = sorted(access.used - set(key))
+            if not access.star and len(key) + len(extra) <= MAX_INDEX_COLUMNS:
+                found.append(Candidate(table, tuple(key + extra), True, [sql]))
+            else:
+                found.append(Candidate(table, tuple(key), False, [sql]))
+    return found
+
+
+def _existing_prefixes(catalog):
+    prefixes = set()
+    if catalog is None:
+        return prefixes
+    for table in catalog.tables.values():
+        for index in table.indexes:
+            columns = tuple(c.lower() for c in index.columns)
+            for n in range(1, len(columns) + 1):
+                prefixes.add((table.name.lower(), columns[:n]))
+    return prefixes
+
+
+def advise(queries, schema, catalog=None):
+    """Merge per-query candidates into a ranked list of index proposals.
+
+    A candidate whose columns are a prefix of another's is folded into the
+    longer one, and candidates already served by an existing index in
+    ``catalog`` are dropped.  The result is ordered by how many workload
+    queries each index serves.
+    """
+    merged = OrderedDict()
+    for sql in queries:
+        for candidate in query_candidates(sql, schema):
+            key = (candidate.table, candidate.columns)
+            if key in merged:
+                if sql not in merged[key].queries:
+                    merged[key].queries.append(sql)
+            else:
+                merged[key] = candidate
+    ranked = sorted(merged.values(), key=lambda c: -len(c.columns))
+    kept = []
+    for candidate in ranked:
+        wider = next((k for k in kept if k.table == candidate.table
+                      and k.columns[:len(candidate.columns)] == candidate.columns),
+                     None)
+        if wider is not None:
+            wider.queries.extend(q for q in candidate.queries if q not in wider.queries)
+        else:
+            kept.append(candidate)
+    existing = _existing_prefixes(catalog)
+    kept = [c for c in kept if (c.table.lower(), c.columns) not in existing]
+    kept.sort(key=lambda c: (-len(c.queries), c.table, c.columns))
+    return kept
+
+
+def index_name(candidate):
+    return ("ix_%s_%s" % (candidate.table, "_".join(candidate.columns)))[:64]
+
+
+def index_ddl(candidate):
+    return "CREATE INDEX %s ON %s (%s)" % (
+        quote(index_name(candidate)), quote(candidate.table),
+        ", ".join(quote(c) for c in candidate.columns))
+
+
+def query_cost(conn, sql, budget=5.0):
+    """``(cost, unit)`` for ``sql``: optimizer cost on MySQL, run time on SQLite.
+
+    A SQLite query still running after ``budget`` seconds is interrupted
+    and reported with the budget as its (lower-bound) cost.
+    """
+    if dialect_of(conn) == "mysql":
+        cursor = conn.cursor()
+        try:
+            cursor.execute("EXPLAIN FORMAT=JSON " + sql)
+            plan = json.loads(cursor.fetchone()[0])
+        finally:
+            cursor.close()
+        return float(plan["query_block"]["cost_info"]["query_cost"]), "cost"
+    deadline = time.perf_counter() + budget
+    conn.set_progress_handler(lambda: time.perf_counter() > deadline, 10000)
+    started = time.perf_counter()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql)
+        cursor.fetchall()
+        cursor.close()
+        return (time.perf_counter() - started) * 1000, "ms"
+    except Exception as exc:
+        if "interrupted" in str(exc):
+            return budget * 1000, "ms"
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+def estimate(conn, candidates, budget=5.0):
+    """Create each candidate index in turn and measure its queries.
+
+    Run this only against a copy of dognitiondb: indexes are created and
+    dropped on ``conn``.  Queries the local engine cannot run are skipped,
+    and a candidate the server will not create (MySQL's "Specified key was
+    too long", say) gets a single :class:`Estimate` carrying the error.
+    """
+    results = []
+    for candidate in candidates:
+        baseline = []
+        for sql in candidate.queries:
+            try:
+                baseline.append((sql, query_cost(conn, sql, budget), explain(conn, sql)))
+            except Exception:
+                continue
+        if not baseline:
+            continue
+        cursor = conn.cursor()
+        try:
+            cursor.execute(index_ddl(candidate))
+        except Exception as exc:
+            cursor.close()
+            results.append(Estimate(candidate, None, None, None, None, None, None, str(exc)))
+            continue
+        try:
+            for sql, (before, unit), plan_before in baseline:
+                after, _ = query_cost(conn, sql, budget)
+                results.append(Estimate(candidate, sql, before, after, plan_before,
+                                        explain(conn, sql), unit, None))
+        finally:
+            cursor.execute("DROP INDEX %s%s" % (
+                quote(index_name(candidate)),
+                "" if dialect_of(conn) == "sqlite" else " ON " + quote(candidate.table)))
+            cursor.close()
+    return results
+
+
+def report(candidates, estimates):
+    lines = []
+    by_candidate = OrderedDict((id(c), []) for c in candidates)
+    for e in estimates:
+        by_candidate[id(e.candidate)].append(e)
+    for candidate in candidates:
+        found = by_candidate[id(candidate)]
+        lines.append("%s;%s" % (index_ddl(candidate),
+                                "  -- covering" if candidate.covering else ""))
+        lines.append("    serves %d workload quer%s" % (
+            len(candidate.queries), "y" if len(candidate.queries) == 1 else "ies"))
+        if found and found[0].error is not None:
+            lines.append("    not applicable: %s" % found[0].error)
+        elif found:
+            before = sum(e.before for e in found)
+            after = sum(e.after for e in found)
+            lines.append("    measured on %d: %.1f -> %.1f %s (%.1fx)" % (
+                len(found), before, after, found[0].unit,
+                before / after if after else float("inf")))
+            for e in found:
+                if e.plan_before != e.plan_after:
+                    lines.append("      %s" % " ".join(e.query.split())[:90])
+                    lines.append("        before: %s" % " | ".join(e.plan_before))
+                    lines.append("        after:  %s" % " | ".join(e.plan_after))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("scripts", nargs="*")
+    p.add_argument("--url", help="local copy of dognitiondb (default: synthetic)")
+    p.add_argument("--scale", type=float, default=0.2)
+    p.add_argument("--budget", type=float, default=5.0,
+                   help="seconds before a SQLite query is interrupted")
+    args = p.parse_args(argv)
+    if args.url:
+        conn = connect(args.url)
+    else:
+        from .synthetic import create
+
+        conn = create(scale=args.scale)
+    catalog = SchemaCatalog.fetch(conn)
+    schema = {t.name: t.column_names for t in catalog.tables.values()}
+    queries = [rewrite_dates(q.sql) for q in extract(args.scripts or None)]
+    candidates = advise(queries, schema, catalog)
+    print(report(candidates, estimate(conn, candidates, args.budget)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Answer ``LIKE '%terrier'`` breed searches from an in-process index.
+
+A pattern with a leading wildcard cannot use a B-tree, so Exercise 2's
+``WHERE breed LIKE("%terrier")`` reads every row of ``dogs``.  The breed
+column, however, holds only a few hundred distinct values.
+:class:`LikeIndex` loads those values once and keeps three structures over
+them:
+
+* a sorted list, for prefix patterns (``'s%'``) by binary search;
+* a sorted list of the *reversed* values, for suffix patterns
+  (``'%terrier'``) the same way;
+* a trigram posting list, for everything else (``'%bull%'``,
+  ``'%shep%dog'``): candidates share every trigram of the pattern's
+  literal runs and are then checked against the full pattern.
+
+The matching values then go to the server as ``breed IN (...)``, which an
+index on ``breed`` answers directly::
+
+    >>> index = LikeIndex(conn)
+    >>> index.where("%terrier")
+    ('`breed` IN (%s, %s, ...)', ['Bull Terrier', 'Rat Terrier', ...])
+    >>> index.select("%terrier", ["user_guid", "gender", "breed"],
+    ...              where="gender=%s", params=("female",))
+
+Matching is case-insensitive, like ``LIKE`` under MySQL's default
+collation and SQLite's default ``LIKE``.  The index reflects the table
+when it was built; call :meth:`LikeIndex.refresh` after loading new dogs.
+"""
+
+import bisect
+import re
+
+from .db import placeholder, quote
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def like_regex(pattern, escape="\\"):
+    """Compile a SQL ``LIKE`` pattern into a case-insensitive regex."""
+    parts, chars = [], iter(pattern)
+    for char in chars:
+        if char == escape:
+            parts.append(re.escape(next(chars, escape)))
+        elif char == "%":
+            parts.append(".*")
+        elif char == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(char))
+    return re.compile("".join(parts), re.I | re.S)
+
+
+def _literal_runs(pattern, escape="\\"):
+    """Lower-cased runs of literal characters between the wildcards."""
+    runs, current, chars = [], [], iter(pattern)
+    for char in chars:
+        if char == escape:
+            current.append(next(chars, escape))
+        elif char in "%_":
+            runs.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    runs.append("".join(current))
+    return [r.lower() for r in runs]
+
+
+class SubstringIndex:
+    """Prefix, suffix and trigram lookups over a set of distinct strings."""
+
+    def __init__(self, values=()):
+        self.values = []
+        self._forward = []
+        self._backward = []
+        self._grams = {}
+        self._ids = {}
+        for value in values:
+            self.add(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value):
+        if value is None or value in self._ids:
+            return
+        ident = self._ids[value] = len(self.values)
+        folded = value.lower()
+        self.values.append(value)
+        bisect.insort(self._forward, (folded, ident))
+        bisect.insort(self._backward, (folded[::-1], ident))
+        for gram in _trigrams(folded):
+            self._grams.setdefault(gram, set()).add(ident)
+
+    @staticmethod
+    def _range(ordered, text):
+        low = bisect.bisect_left(ordered, (text,))
+        high = bisect.bisect_left(ordered, (text + "\U0010ffff",))
+        return [ident for _, ident in ordered[low:high]]
+
+    def startswith(self, text):
+        return [self.values[i] for i in sorted(self._range(self._forward, text.lower()))]
+
+    def endswith(self, text):
+        return [self.values[i]
+                for i in sorted(self._range(self._backward, text.lower()[::-1]))]
+
+    def contains(self, text):
+        return self.like("%" + text.replace("\\", "\\\\").replace("%", "\\%")
+                         .replace("_", "\\_") + "%")
+
+    def like(self, pattern, escape="\\"):
+        """Values matching the ``LIKE`` pattern, in insertion order."""
+        runs = _literal_runs(pattern, escape)
+        wildcards = len(runs) - 1
+        if wildcards == 1 and pattern.endswith("%") and not pattern.endswith(escape + "%"):
+            return self.startswith(runs[0])
+        if wildcards == 1 and pattern.startswith("%"):
+            return self.endswith(runs[1])
+        candidates = None
+        for gram in set().union(*(_trigrams(r) for r in runs)):
+            posting = self._grams.get(gram, set())
+            candidates = posting if candidates is None else candidates & posting
+            if not candidates:
+                return []
+        if candidates is None:
+            candidates = range(len(self.values))
+        regex = like_regex(pattern, escape)
+        return [self.values[i] for i in sorted(candidates)
+                if regex.fullmatch(self.values[i])]
+
+
+class LikeIndex:
+    """A :class:`SubstringIndex` over the distinct values of one column.
+
+    ``where(pattern)`` and ``select(pattern, ...)`` turn a ``LIKE`` pattern
+    into an ``IN`` list of the values that match it.
+    """
+
+    def __init__(self, conn, table="dogs", column="breed"):
+        self.conn = conn
+        self.table = table
+        self.column = column
+        self.refresh()
+
+    def refresh(self):
+        """Reload the distinct values from the table."""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT DISTINCT %s FROM %s" % (quote(self.column),
+                                                           quote(self.table)))
+            self.index = SubstringIndex(row[0] for row in cursor.fetchall())
+        finally:
+            cursor.close()
+
+    def index_ddl(self):
+        """``CREATE INDEX`` for the column, so the ``IN`` list is a seek."""
+        return "CREATE INDEX %s ON %s (%s)" % (
+            quote(("ix_%s_%s" % (self.table, self.column))[:64]),
+            quote(self.table), quote(self.column))
+
+    def matching(self, pattern):
+        return self.index.like(pattern)
+
+    def where(self, pattern):
+        """``(sql, params)`` selecting the rows whose column is ``LIKE pattern``."""
+        values = self.matching(pattern)
+        if not values:
+            return "1 = 0", []
+        mark = placeholder(self.conn)
+        return "%s IN (%s)" % (quote(self.column), ", ".join([mark] * len(values))), values
+
+    def select(self, pattern, columns=None, where=None, params=()):
+        """Fetch ``columns`` of the rows matching ``pattern`` (and ``where``)."""
+        predicate, values = self.where(pattern)
+        sql = "SELECT %s FROM %s WHERE %s" % (
+            ", ".join(quote(c) for c in columns) if columns else "*",
+            quote(self.table), predicate)
+        if where:
+            sql += " AND (%s)" % where
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(sql, list(values) + list(params))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
@@ -0,0 +1,259 @@
+"""Stop accidental cross joins before they reach the server.
+
+The first query of Exercise 7 lists two tables without a join condition::
+
+    SELECT dogs.dog_guid AS DogID, dogs.user_guid AS UserID,
+           AVG(reviews.rating) AS AvgRating, COUNT(reviews.rating) AS NumRatings
+    FROM dogs, reviews
+    GROUP BY dogs.user_guid, dogs.dog_guid ...
+
+and so pairs every dog with every review, |dogs| x |reviews| rows that the
+server has to build before it can group them.  :func:`cross_joins` splits
+the FROM list of each query block into groups of tables connected by a
+condition (a WHERE conjunct or ON clause that uses columns of both, or
+USING/NATURAL) and reports every block with more than one group, whether
+written as a comma list, ``CROSS JOIN`` or ``JOIN ... ON`` with a
+condition that does not link the two sides.  The row count comes from
+:func:`dognition.preflight.estimate` when statistics have been collected,
+and from the catalog's row counts otherwise.
+
+:func:`guard` is the runner preprocessor.  A cross join estimated to
+produce more than ``max_rows`` rows raises :class:`CartesianError`,
+naming the tables, their sizes and a likely join column::
+
+    guard(sql, stats=StatsCatalog.load(conn), catalog=SchemaCatalog.load(conn))
+    # CartesianError: dogs (35,050 rows) and reviews (17,986 rows) are not joined:
+    # about 630,409,300 rows before GROUP BY (budget 10,000,000);
+    # join them with e.g. dogs.dog_guid = reviews.dog_guid
+
+With ``action="limit"``, a plain SELECT (no aggregate, DISTINCT or ORDER
+BY, all of which need the whole product) gets ``LIMIT max_rows`` instead,
+so the server stops early.  A query that already has such a LIMIT within
+the budget is let through, as is a cross join whose size cannot be
+estimated (no statistics and no row counts in the catalog).
+"""
+
+import argparse
+from collections import namedtuple
+
+from .catalog import SchemaCatalog
+from .db import connect
+from .preflight import PreflightError, estimate
+from .sqlquery import ParseError, parse
+from .sqltext import significant, tokenize, untokenize
+from .stats import StatsCatalog
+from .workload import extract
+
+DEFAULT_MAX_ROWS = 10000000
+
+CrossJoin = namedtuple("CrossJoin", "query groups sizes rows suggestions")
+
+
+class CartesianError(PreflightError):
+    """A query :func:`guard` refused; ``joins`` holds the :class:`CrossJoin` found."""
+
+    def __init__(self, joins, message):
+        super().__init__(None, message)
+        self.joins = joins
+
+
+def _schema(catalog):
+    if catalog is None:
+        return None
+    return {name: table.column_names for name, table in catalog.tables.items()}
+
+
+def owner(query, ref, schema):
+    """Index in ``query.tables`` of the table ``ref`` belongs to, or ``None``."""
+    if ref.qualifier is not None:
+        for i, table in enumerate(query.tables):
+            if (table.alias or table.name or "").lower() == ref.qualifier.lower():
+                return i
+        return None
+    if schema is None:
+        return 0 if len(query.tables) == 1 else None
+    owners = [i for i, table in enumerate(query.tables)
+              if table.name and ref.name.lower()
+              in {c.lower() for c in schema.get(table.name, ())}]
+    return owners[0] if len(owners) == 1 else None
+
+
+def groups(query, schema=None):
+    """The FROM items of one block split into connected groups of indexes."""
+    parent = list(range(len(query.tables)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def link(indexes):
+        indexes = [i for i in indexes if i is not None]
+        for i in indexes[1:]:
+            parent[root(i)] = root(indexes[0])
+
+    for i, table in enumerate(query.tables):
+        if table.using or table.natural:
+            link([i, i - 1] if i else [i])
+    for predicate in query.predicates():
+        link([owner(query, ref, schema) for ref in predicate.columns])
+    found = {}
+    for i in range(len(query.tables)):
+        found.setdefault(root(i), []).append(i)
+    return list(found.values())
+
+
+def _label(table):
+    return table.name or table.alias
+
+
+def _size(query, index, stats, catalog, schema):
+    """Estimated rows of one FROM item after its own filters, or ``None``."""
+    table = query.tables[index]
+    if table.subquery is not None:
+        cost = estimate(table.subquery, stats, catalog) if stats is not None else None
+        return cost.rows if cost is not None else None
+    if stats is not None and stats.rows(table.name) is not None:
+        local = [p for p in query.predicates() if p.kind != "join" and p.columns
+                 and all(owner(query, ref, schema) == index for ref in p.columns)]
+        return int(round(stats.estimate_rows(table.name, local)))
+    found = catalog.table(table.name) if catalog is not None else None
+    return found.rows if found is not None else None
+
+
+def _suggestions(query, parts, catalog):
+    """``a.col = b.col`` conditions on column names two unlinked groups share."""
+    if catalog is None:
+        return []
+    found = []
+    for left in parts[0]:
+        for other in parts[1:]:
+            for right in other:
+                a, b = query.tables[left], query.tables[right]
+                ta = catalog.table(a.name) if a.name else None
+                tb = catalog.table(b.name) if b.name else None
+                if ta is None or tb is None:
+                    continue
+                shared = [c for c in ta.column_names
+                          if c.lower() in {n.lower() for n in tb.column_names}
+                          and c.lower().endswith(("_guid", "_id"))]
+                found += ["%s.%s = %s.%s" % (a.alias or a.name, c, b.alias or b.name, c)
+                          for c in shared]
+    return found
+
+
+def cross_joins(query, stats=None, catalog=None):
+    """A :class:`CrossJoin` for every block of ``query`` with unlinked tables."""
+    schema = _schema(catalog)
+    found = []
+    for block in query.walk():
+        parts = groups(block, schema)
+        if len(parts) < 2:
+            continue
+        sizes = [_size(block, i, stats, catalog, schema) for i in range(len(block.tables))]
+        rows = None
+        if stats is not None:
+            try:
+                cost = estimate(block, stats, catalog)
+            except KeyError:
+                cost = None
+            rows = cost.joined if cost is not None else None
+        if rows is None and None not in sizes:
+            rows = 1
+            for size in sizes:
+                rows *= size
+        found.append(CrossJoin(block, [[_label(block.tables[i]) for i in part] for part in parts],
+                               sizes, rows, _suggestions(block, parts, catalog)))
+    return found
+
+
+def explain(join, max_rows=DEFAULT_MAX_ROWS):
+    """A sentence saying what is unlinked, how big it gets and how to fix it."""
+    names = join.query.tables
+    described = []
+    for group in join.groups:
+        parts = []
+        for name in group:
+            index = next(i for i, t in enumerate(names) if _label(t) == name)
+            size = join.sizes[index]
+            parts.append("%s (%s rows)" % (name, "{:,}".format(size) if size is not None
+                                           else "unknown"))
+        described.append(" + ".join(parts))
+    stage = "before GROUP BY" if join.query.group_by else "before the rest of the query"
+    text = "%s are not joined: " % " and ".join(described)
+    if join.rows is None:
+        text += "the product has an unknown size"
+    else:
+        text += "about {:,} rows {} (budget {:,})".format(join.rows, stage, max_rows)
+    if join.suggestions:
+        text += "; join them with e.g. %s" % join.suggestions[0]
+    return text
+
+
+def _limitable(query):
+    """Whether a LIMIT lets the server stop before building the whole product."""
+    return not (query.is_aggregate or query.distinct or query.order_by or query.unions)
+
+
+def _add_limit(sql, max_rows):
+    tokens = tokenize(sql)
+    sig = significant(tokens)
+    if sig and sig[-1][1].text == ";":
+        sig.pop()
+    return "%s LIMIT %d" % (untokenize(tokens[:sig[-1][0] + 1]), max_rows)
+
+
+def guard(sql, stats=None, catalog=None, max_rows=DEFAULT_MAX_ROWS, action="block"):
+    """Return ``sql`` if it has no cross join above ``max_rows``, else refuse or limit it.
+
+    ``action`` is ``"block"`` (raise :class:`CartesianError`) or
+    ``"limit"`` (add ``LIMIT max_rows`` where that bounds the work, and
+    raise otherwise).
+    """
+    if action not in ("block", "limit"):
+        raise ValueError("action must be 'block' or 'limit', not %r" % (action,))
+    try:
+        query = parse(sql)
+    except ParseError:
+        return sql
+    joins = [j for j in cross_joins(query, stats, catalog)
+             if j.rows is not None and j.rows > max_rows]
+    if not joins:
+        return sql
+    top = all(j.query is query for j in joins) and _limitable(query)
+    if top and query.limit is not None and query.limit + (query.offset or 0) <= max_rows:
+        return sql
+    if top and action == "limit" and query.limit is None:
+        return _add_limit(sql, max_rows)
+    raise CartesianError(joins, "; ".join(explain(j, max_rows) for j in joins))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="List cross joins in the exercise queries.")
+    p.add_argument("sql", nargs="*", help="statements (default: every exercise query)")
+    p.add_argument("--url", default=None,
+                   help="database to read the schema and statistics of (default: none)")
+    p.add_argument("--max-rows", type=int, default=DEFAULT_MAX_ROWS)
+    args = p.parse_args(argv)
+    catalog = stats = None
+    if args.url:
+        conn = connect(args.url)
+        try:
+            catalog = SchemaCatalog.load(conn)
+            stats = StatsCatalog.load(conn)
+        finally:
+            conn.close()
+    for script, line, sql in [("", 0, s) for s in args.sql] or extract():
+        try:
+            joins = cross_joins(parse(sql), stats, catalog)
+        except ParseError:
+            continue
+        for join in joins:
+            over = join.rows is not None and join.rows > args.max_rows
+            print("%s:%d %s %s" % (script, line, "BLOCK" if over else "ok   ",
+                                   explain(join, args.max_rows)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""Cached schema catalog for dognitiondb.
+
+Exercise 1 learns the schema with ``SHOW tables`` followed by one
+``DESCRIBE`` per table, a round trip each.  :class:`SchemaCatalog` loads
+every table, column, type, index and row estimate with a single
+information_schema query and keeps the result in a JSON file, so later
+sessions (and autocomplete) read metadata from disk::
+
+    catalog = SchemaCatalog.load(conn)
+    catalog.show_tables()
+    catalog.describe("reviews")
+
+The cache is keyed by a schema fingerprint.  ``load`` checks it with one
+small query and only reloads when the schema has changed; pass
+``validate=False`` to skip even that and never contact the server while a
+cache file exists.  In-memory SQLite databases are not cached.  Row counts are estimates taken when the catalog was
+loaded and are not part of the fingerprint.
+"""
+
+import json
+import os
+import zlib
+from collections import OrderedDict, namedtuple
+
+from .db import dialect_of
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "dognition")
+
+Column = namedtuple("Column", "name type nullable key default extra")
+Index = namedtuple("Index", "name columns unique")
+
+_MYSQL_FINGERPRINT = """
+SELECT CONCAT(
+  (SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS('|',
+          TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, COLUMN_TYPE,
+          IS_NULLABLE, COLUMN_KEY))), 0))
+   FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()),
+  '/',
+  (SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS('|',
+          TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX, COLUMN_NAME, NON_UNIQUE))), 0))
+   FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE()))
+"""
+
+_MYSQL_CATALOG = """
+SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE = 'YES',
+       c.COLUMN_KEY, c.COLUMN_DEFAULT, c.EXTRA, t.TABLE_ROWS,
+       s.INDEX_NAME, s.SEQ_IN_INDEX, s.NON_UNIQUE = 0, (%s) AS fingerprint
+FROM information_schema.COLUMNS c
+JOIN information_schema.TABLES t
+  ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+LEFT JOIN information_schema.STATISTICS s
+  ON s.TABLE_SCHEMA = c.TABLE_SCHEMA AND s.TABLE_NAME = c.TABLE_NAME
+ AND s.COLUMN_NAME = c.COLUMN_NAME
+WHERE c.TABLE_SCHEMA = DATABASE()
+ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION, s.INDEX_NAME
+""" % _MYSQL_FINGERPRINT.strip()
+
+# every CREATE statement, so two files with the same schema_version but
+# different tables or columns do not look alike
+_SQLITE_FINGERPRINT = """
+SELECT (SELECT schema_version FROM pragma_schema_version) || '/' ||
+       COALESCE((SELECT group_concat(entry, ';') FROM (
+           SELECT type || ':' || name || ':' || COALESCE(sql, '') AS entry
+           FROM sqlite_master ORDER BY type, name)), '')
+"""
+
+_SQLITE_CATALOG = """
+SELECT m.name, c.name, c.type, c."notnull" = 0,
+       CASE WHEN c.pk > 0 THEN 'PRI' ELSE '' END, c.dflt_value,
+       CASE c.hidden WHEN 2 THEN 'VIRTUAL GENERATED'
+                     WHEN 3 THEN 'STORED GENERATED' ELSE '' END, NULL,
+       il.name, ii.seqno + 1, il."unique" = 1, (%s) AS fingerprint
+FROM sqlite_master m
+JOIN pragma_table_xinfo(m.name) c
+LEFT JOIN pragma_index_list(m.name) il
+LEFT JOIN pragma_index_info(il.name) ii ON ii.name = c.name
+WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%%' AND c.hidden != 1
+ORDER BY m.name, c.cid, il.name
+""" % _SQLITE_FINGERPRINT.strip()
+
+
+class Table:
+    """Columns, indexes and estimated row count of one table."""
+
+    def __init__(self, name, columns=(), indexes=(), rows=None):
+        self.name = name
+        self.columns = list(columns)
+        self.indexes = list(indexes)
+        self.rows = rows
+
+    @property
+    def column_names(self):
+        return [c.name for c in self.columns]
+
+    def column(self, name):
+        for column in self.columns:
+            if column.name.lower() == name.lower():
+                return column
+        raise KeyError(name)
+
+    def indexed_prefixes(self):
+        """Return the leading column of every index, lower-cased."""
+        return {ix.columns[0].lower() for ix in self.indexes if ix.columns}
+
+    def __repr__(self):
+        return "<Table %s columns=%d indexes=%d rows=%s>" % (
+            self.name, len(self.columns), len(self.indexes), self.rows)
+
+
+class SchemaCatalog:
+    """Every table of a database, loaded in one round trip."""
+
+    def __init__(self, tables, fingerprint):
+        self.tables = OrderedDict((t.name, t) for t in tables)
+        self.fingerprint = fingerprint
+
+    def __contains__(self, table):
+        return self.table(table, None) is not None
+
+    def __getitem__(self, table):
+        found = self.table(table, None)
+        if found is None:
+            raise KeyError(table)
+        return found
+
+    def table(self, name, default=None):
+        for table in self.tables.values():
+            if table.name.lower() == name.lower():
+                return table
+        return default
+
+    def show_tables(self):
+        """The table names, as ``SHOW tables`` would list them."""
+        return list(self.tables)
+
+    def describe(self, table):
+        """Rows shaped like ``DESCRIBE table``: Field, Type, Null, Key, Default, Extra."""
+        return [
+            (c.name, c.type, "YES" if c.nullable else "NO", c.key, c.default,
+             c.extra)
+            for c in self[table].columns
+        ]
+
+    def completions(self, prefix=""):
+        """Table names and ``table.column`` names that start with ``prefix``."""
+        prefix = prefix.lower()
+        names = []
+        for table in self.tables.values():
+            names.append(table.name)
+            names.extend("%s.%s" % (table.name, c) for c in table.column_names)
+        return sorted(n for n in names if n.lower().startswith(prefix))
+
+    @classmethod
+    def fetch(cls, conn):
+        """Load the catalog from the server with one query."""
+        sql = _SQLITE_CATALOG if dialect_of(conn) == "sqlite" else _MYSQL_CATALOG
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        return cls.from_rows(rows)
+
+    @classmethod
+    def from_rows(cls, rows):
+        tables = OrderedDict()
+        seen = set()
+        index_columns = OrderedDict()
+        fingerprint = None
+        for (table_name, name, type_, nullable, key, default, extra, estimate,
+             index_name, seq, unique, fingerprint) in rows:
+            table = tables.get(table_name)
+            if table is None:
+                table = tables[table_name] = Table(table_name, rows=estimate)
+            if (table_name, name) not in seen:
+                seen.add((table_name, name))
+                table.columns.append(Column(name, type_, bool(nullable), key,
+                                            default, extra))
+            if index_name is not None and seq is not None:
+                entry = index_columns.setdefault(
+                    (table_name, index_name), [bool(unique), {}])
+                entry[1][int(seq)] = name
+        for (table_name, index_name), (unique, columns) in index_columns.items():
+            ordered = tuple(columns[i] for i in sorted(columns))
+            tables[table_name].indexes.append(Index(index_name, ordered, unique))
+        return cls(tables.values(), _digest(fingerprint))
+
+    @staticmethod
+    def current_fingerprint(conn):
+        """Ask the server for the schema fingerprint (one small query)."""
+        sql = (_SQLITE_FINGERPRINT if dialect_of(conn) == "sqlite"
+               else _MYSQL_FINGERPRINT)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+            return _digest(cursor.fetchone()[0])
+        finally:
+            cursor.close()
+
+    @classmethod
+    def load(cls, conn, path=None, validate=True):
+        """Return the cached catalog, reloading it if the schema changed.
+
+        ``path`` defaults to a file under ``~/.cache/dognition`` named after
+        the connected database.
+        """
+        path = path or default_cache_path(conn)
+        cached = None
+        if path is not None and os.path.exists(path):
+            try:
+                cached = cls.read(path)
+            except (ValueError, KeyError, TypeError):
+                cached = None
+        if cached is not None:
+            if not validate:
+                return cached
+            if cls.current_fingerprint(conn) == cached.fingerprint:
+                return cached
+        catalog = cls.fetch(conn)
+        if path is not None:
+            catalog.save(path)
+        return catalog
+
+    def to_dict(self):
+        return {
+            "fingerprint": self.fingerprint,
+            "tables": [
+                {
+                    "name": t.name,
+                    "rows": t.rows,
+                    "columns": [list(c) for c in t.columns],
+                    "indexes": [[ix.name, list(ix.columns), ix.unique]
+                                for ix in t.indexes],
+                }
+                for t in self.tables.values()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        tables = [
+            Table(
+                t["name"],
+                [Column(*c) for c in t["columns"]],
+                [Index(name, tuple(cols), unique)
+                 for name, cols, unique in t["indexes"]],
+                t["rows"],
+            )
+            for t in data["tables"]
+        ]
+        return cls(tables, data["fingerprint"])
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.to_dict(), f, default=str)
+        os.replace(tmp, path)
+
+    @classmethod
+    def read(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def _digest(fingerprint):
+    """A short stand-in for the fingerprint text the server returns."""
+    text = str(fingerprint).encode("utf-8")
+    return "%08x:%d" % (zlib.crc32(text), len(text))
+
+
+def default_cache_path(conn, kind="schema"):
+    """Cache file of ``kind`` for the database ``conn`` is connected to.
+
+    ``None`` for an in-memory SQLite database: every one of them would get
+    the same file, so their caches are not kept on disk.
+    """
+    if dialect_of(conn) == "sqlite":
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA database_list")
+        filename = cursor.fetchone()[2]
+        cursor.close()
+        if not filename:
+            return None
+        name = "sqlite-%08x" % zlib.crc32(filename.encode("utf-8"))
+    else:
+        host = getattr(conn, "host", "localhost")
+        db = getattr(conn, "db", b"dognitiondb")
+        if isinstance(db, bytes):
+            db = db.decode("utf-8")
+        name = "mysql-%s-%s" % (host, db)
+    return os.path.join(CACHE_DIR, "%s-%s.json" % (kind, name))
@@ -0,0 +1,289 @@
+"""Indexed, generated "cleaned" columns and a rewrite that uses them.
+
+Exercise 3 cleans the breed names three ways, ``REPLACE(breed,'-','')``,
+``TRIM(LEADING '-' FROM breed)`` and ``UPPER(breed)``, and then sorts or
+de-duplicates on the result.  Each run evaluates the function on every row
+of ``dogs`` and sorts the output in a temporary file.  :func:`install`
+adds each cleaned value as a generated column with an index on
+``(cleaned, source)``, and the database keeps it in sync on every write::
+
+    ALTER TABLE dogs ADD COLUMN breed_trimmed varchar(255)
+        AS (TRIM(LEADING '-' FROM breed)) STORED INVISIBLE
+    CREATE INDEX ix_dogs_breed_trimmed ON dogs (breed_trimmed, breed)
+
+:func:`rewrite_cleaned` then replaces the expressions in queries with the
+columns, so ``SELECT DISTINCT breed, TRIM(LEADING '-' FROM breed) AS
+breed_fixed FROM dogs ORDER BY breed_fixed`` reads the index in order
+instead of sorting.  The runner applies it automatically once the columns
+exist.  To add or remove the columns::
+
+    python -m dognition.cleaned install --url mysql://root@localhost/dognitiondb
+    python -m dognition.cleaned uninstall --url ...
+
+The MySQL columns are ``INVISIBLE`` (MySQL 8.0.23 and later; pass
+``invisible=False`` for older servers), so ``SELECT *`` and the exercise
+output are unchanged.  SQLite has no invisible columns; there the columns
+are ``VIRTUAL`` and do appear in ``SELECT *``.
+"""
+
+import argparse
+from collections import namedtuple
+
+from .catalog import SchemaCatalog
+from .db import DEFAULT_URL, connect, dialect_of, quote
+from .sqlquery import ParseError, parse
+from .sqltext import depths, identifier, is_significant, keyword, string_value, tokenize
+
+CleanedColumn = namedtuple("CleanedColumn", "table name source expression sqlite_expression")
+
+BREED_COLUMNS = (
+    CleanedColumn("dogs", "breed_trimmed", "breed",
+                  "TRIM(LEADING '-' FROM breed)", "LTRIM(breed, '-')"),
+    CleanedColumn("dogs", "breed_nodash", "breed",
+                  "REPLACE(breed, '-', '')", "REPLACE(breed, '-', '')"),
+    CleanedColumn("dogs", "breed_upper", "breed",
+                  "UPPER(breed)", "UPPER(breed)"),
+)
+
+
+def index_name(column):
+    return ("ix_%s_%s" % (column.table, column.name))[:64]
+
+
+def install_ddl(column, dialect="mysql", type_="varchar(255)", invisible=True):
+    """The statements that add ``column`` and its index."""
+    if dialect == "sqlite":
+        add = "ALTER TABLE %s ADD COLUMN %s TEXT AS (%s) VIRTUAL" % (
+            quote(column.table), quote(column.name), column.sqlite_expression)
+    else:
+        add = "ALTER TABLE %s ADD COLUMN %s %s AS (%s) STORED%s" % (
+            quote(column.table), quote(column.name), type_, column.expression,
+            " INVISIBLE" if invisible else "")
+    return [add, "CREATE INDEX %s ON %s (%s, %s)" % (
+        quote(index_name(column)), quote(column.table), quote(column.name),
+        quote(column.source))]
+
+
+def installed(catalog, columns=BREED_COLUMNS):
+    """The members of ``columns`` that already exist according to ``catalog``."""
+    found = []
+    for column in columns:
+        table = catalog.tables.get(column.table)
+        if table is not None and column.name.lower() in (
+                n.lower() for n in table.column_names):
+            found.append(column)
+    return found
+
+
+def install(conn, columns=BREED_COLUMNS, invisible=True):
+    """Add the missing cleaned columns and their indexes; return those added."""
+    catalog = SchemaCatalog.fetch(conn)
+    present = installed(catalog, columns)
+    dialect = dialect_of(conn)
+    added = []
+    cursor = conn.cursor()
+    try:
+        for column in columns:
+            if column in present or column.table not in catalog.tables:
+                continue
+            source = catalog.tables[column.table].column(column.source)
+            for statement in install_ddl(column, dialect, source.type, invisible):
+                cursor.execute(statement)
+            added.append(column)
+    finally:
+        cursor.close()
+    conn.commit()
+    return added
+
+
+def uninstall(conn, columns=BREED_COLUMNS):
+    """Drop the cleaned columns (and with them their indexes)."""
+    present = installed(SchemaCatalog.fetch(conn), columns)
+    sqlite = dialect_of(conn) == "sqlite"
+    cursor = conn.cursor()
+    try:
+        for column in present:
+            cursor.execute("DROP INDEX %s%s" % (
+                quote(index_name(column)),
+                "" if sqlite else " ON " + quote(column.table)))
+            cursor.execute("ALTER TABLE %s DROP COLUMN %s"
+                           % (quote(column.table), quote(column.name)))
+    finally:
+        cursor.close()
+    conn.commit()
+    return present
+
+
+def _shape(token):
+    """A comparison key under which equivalent spellings are equal."""
+    if token.kind == "string":
+        return ("string", string_value(token))
+    if token.kind in ("name", "quoted"):
+        return ("name", (identifier(token) or token.text).upper())
+    return (token.kind, token.text.upper())
+
+
+def _pattern(column):
+    tokens = [t for t in tokenize(column.expression) if is_significant(t)]
+    return [None if keyword(t) == column.source.upper() else _shape(t) for t in tokens]
+
+
+def _blocks(tokens, depth):
+    """``(start, end)`` token ranges of every SELECT block, UNION arms apart."""
+    spans = []
+
+    def add(start, end, level):
+        for i in range(start, end):
+            if depth[i] == level and keyword(tokens[i]) == "UNION":
+                spans.append((start, i))
+                start = i + 1
+        spans.append((start, end))
+
+    add(0, len(tokens), 0)
+    for i, token in enumerate(tokens):
+        if token.text != "(":
+            continue
+        inner = next((t for t in tokens[i + 1:] if is_significant(t)), None)
+        if inner is None or keyword(inner) != "SELECT":
+            continue
+        close = next((j for j in range(i + 1, len(tokens))
+                      if tokens[j].text == ")" and depth[j] == depth[i]), len(tokens))
+        add(i + 1, close, depth[i] + 1)
+    return spans
+
+
+def _scopes(tokens, depth, table):
+    """``(start, end, names)`` per SELECT block: the names that refer to
+    ``table`` in the block's own FROM clause (empty if it does not read it)."""
+    scopes = []
+    for start, end in _blocks(tokens, depth):
+        names = set()
+        try:
+            block = parse("".join(t.text for t in tokens[start:end]))
+        except ParseError:
+            block = None
+        for ref in block.tables if block is not None else ():
+            if ref.name and ref.name.lower() == table:
+                names.add((ref.alias or ref.name).lower())
+        scopes.append((start, end, names))
+    return scopes
+
+
+def _in_scope(scopes, position, qualifier):
+    """Whether the column at token ``position`` belongs to the cleaned table.
+
+    A bare name must sit in a block that reads the table itself (a derived
+    table over it has no cleaned columns); a qualified one may also name
+    the table in an enclosing block, as a correlated subquery does.
+    """
+    around = [s for s in scopes if s[0] <= position < s[1]]
+    if not around:
+        return False
+    if qualifier is None:
+        return bool(min(around, key=lambda s: s[1] - s[0])[2])
+    return any(qualifier.lower() in names for _, _, names in around)
+
+
+def _match(sig, start, pattern, column):
+    """Index just past a match of ``pattern`` at ``sig[start]``, and the qualifier."""
+    pos, qualifier = start, None
+    for want in pattern:
+        if pos >= len(sig):
+            return None, None
+        token = sig[pos][1]
+        if want is not None:
+            if _shape(token) != want:
+                return None, None
+            pos += 1
+            continue
+        if (pos + 2 < len(sig) and sig[pos + 1][1].text == "."
+                and identifier(token) is not None):
+            qualifier = identifier(token)
+            token = sig[pos + 2][1]
+            pos += 2
+        if (identifier(token) or "").lower() != column.source.lower():
+            return None, None
+        pos += 1
+    return pos, qualifier
+
+
+_CLAUSES = {"SELECT", "FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT",
+            "ON", "USING", "SET", "VALUES", "JOIN", "UNION"}
+
+
+def _select_item_alone(sig, depth, first, after):
+    """Whether the match is a whole SELECT item with no alias of its own."""
+    before = sig[first - 1][1] if first > 0 else None
+    if before is None or not (before.text == "," or keyword(before) in ("SELECT", "DISTINCT")):
+        return False
+    if after < len(sig) and not (sig[after][1].text == ","
+                                 or keyword(sig[after][1]) == "FROM"):
+        return False
+    level = depth[sig[first][0]]
+    for i, token in reversed(sig[:first]):
+        if depth[i] < level:
+            return False
+        if depth[i] == level and keyword(token) in _CLAUSES:
+            return keyword(token) == "SELECT"
+    return False
+
+
+def rewrite(sql, columns=BREED_COLUMNS):
+    """Return ``(new_sql, changes)`` with cleaning expressions replaced."""
+    tokens = tokenize(sql)
+    depth = depths(tokens)
+    edits, changes = [], []
+    for column in columns:
+        scopes = _scopes(tokens, depth, column.table)
+        if not any(names for _, _, names in scopes):
+            continue
+        pattern = _pattern(column)
+        sig = [(i, t) for i, t in enumerate(tokens) if is_significant(t)]
+        start = 0
+        while start < len(sig):
+            after, qualifier = _match(sig, start, pattern, column)
+            if after is None or not _in_scope(scopes, sig[start][0], qualifier):
+                start += 1
+                continue
+            first, last = sig[start][0], sig[after - 1][0]
+            original = "".join(t.text for t in tokens[first:last + 1])
+            text = quote(column.name)
+            if qualifier is not None:
+                text = "%s.%s" % (qualifier, text)
+            if _select_item_alone(sig, depth, start, after):
+                # keep the result column heading the notebook showed before
+                text += " AS %s" % quote(" ".join(original.split()))
+            edits.append((first, last, text))
+            changes.append("%s -> %s" % (" ".join(original.split()), text))
+            start = after
+    for first, last, text in sorted(edits, reverse=True):
+        tokens[first:last + 1] = [tokens[first]._replace(kind="name", text=text)]
+    return "".join(t.text for t in tokens), changes
+
+
+def rewrite_cleaned(sql, columns=BREED_COLUMNS):
+    """Return ``sql`` reading the cleaned columns instead of computing them."""
+    return rewrite(sql, columns)[0]
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Add or drop the cleaned breed columns.")
+    p.add_argument("action", choices=("install", "uninstall"))
+    p.add_argument("--url", default=DEFAULT_URL)
+    p.add_argument("--visible", action="store_true",
+                   help="add visible columns (MySQL before 8.0.23)")
+    args = p.parse_args(argv)
+    conn = connect(args.url)
+    try:
+        if args.action == "install":
+            changed = install(conn, invisible=not args.visible)
+        else:
+            changed = uninstall(conn)
+    finally:
+        conn.close()
+    for column in changed:
+        print("%sed %s.%s" % (args.action, column.table, column.name))
+
+
+if __name__ == "__main__":
+    main()
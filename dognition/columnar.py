@@ -0,0 +1,246 @@
+"""Dictionary-encoded in-memory cache of the categorical columns.
+
+``breed``, ``breed_group``, ``breed_type``, ``gender``, ``test_name``,
+``subcategory_name``, ``state`` and ``country`` have between two and a few
+hundred distinct values each, yet every DISTINCT, IN list and GROUP BY on
+them compares full strings row by row.  :class:`ColumnarCache` loads such
+columns once and stores each as a :class:`Categorical`: a sorted list of
+the distinct values plus a NumPy array of small integer codes, one per row
+(code 0 is NULL).  Filters, distinct values and group counts then work on
+the codes::
+
+    cache = ColumnarCache(conn)
+    dogs = cache.table("dogs")
+    dogs["breed"].distinct()                                 # SELECT DISTINCT breed
+    mask = dogs["breed"].isin(["golden retriever", "poodle"])
+    dogs.group_count(["breed_type", "gender"], mask)          # GROUP BY breed_type, gender
+
+A filter is evaluated once per distinct value and then spread over the
+rows with one array lookup, so ``breed LIKE '%terrier'`` costs a few
+hundred regex matches however many dogs there are.  Comparisons ignore
+case, as MySQL's default collation does: values that differ only in case
+are one category, under the spelling seen first, so counts, distinct
+values and groups agree with the server's GROUP BY as well as filters.  A column takes one or two bytes
+per row instead of a Python string reference per row.  Requires NumPy.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .breedsearch import like_regex
+from .db import quote
+from .streaming import stream
+
+CATEGORICAL_COLUMNS = {
+    "dogs": ("breed", "breed_group", "breed_type", "gender"),
+    "complete_tests": ("test_name", "subcategory_name"),
+    "reviews": ("test_name", "subcategory_name"),
+    "exam_answers": ("test_name", "subcategory_name"),
+    "users": ("state", "country"),
+}
+
+
+def require_numpy():
+    if numpy is None:
+        raise ImportError("the columnar cache requires numpy")
+
+
+def _fold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+class Categorical:
+    """One column as ``categories`` plus an integer ``codes`` array.
+
+    ``categories[0]`` is ``None`` (NULL) and the rest are the distinct
+    values in sorted order, so ``categories[codes[i]]`` is row ``i`` (up to
+    case).
+    """
+
+    def __init__(self, categories, codes):
+        require_numpy()
+        self.categories = list(categories)
+        self.codes = codes
+
+    @classmethod
+    def from_values(cls, values):
+        encoder = Encoder()
+        encoder.extend(values)
+        return encoder.finish()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        categories = self.categories
+        return (categories[c] for c in self.codes.tolist())
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    def _table(self, predicate):
+        """Boolean lookup table over the categories; NULL never matches."""
+        table = numpy.zeros(len(self.categories), dtype=bool)
+        for code, value in enumerate(self.categories[1:], 1):
+            table[code] = predicate(value)
+        return table
+
+    def _mask(self, table, where):
+        mask = table[self.codes]
+        return mask if where is None else mask & where
+
+    def isin(self, values, where=None):
+        """Row mask for ``column IN (values)``."""
+        wanted = {_fold(v) for v in values if v is not None}
+        return self._mask(self._table(lambda v: _fold(v) in wanted), where)
+
+    def eq(self, value, where=None):
+        return self.isin([value], where)
+
+    def like(self, pattern, where=None):
+        """Row mask for ``column LIKE pattern``."""
+        regex = like_regex(pattern)
+        return self._mask(self._table(lambda v: bool(regex.fullmatch(str(v)))), where)
+
+    def isnull(self, where=None):
+        mask = self.codes == 0
+        return mask if where is None else mask & where
+
+    def counts(self, where=None):
+        """``{value: rows}`` for the rows in ``where`` (NULL included)."""
+        codes = self.codes if where is None else self.codes[where]
+        tally = numpy.bincount(codes, minlength=len(self.categories))
+        return {self.categories[code]: int(tally[code])
+                for code in numpy.flatnonzero(tally)}
+
+    def distinct(self, where=None, include_null=True):
+        """Distinct values in sorted order, NULL first as in ``ORDER BY``."""
+        return [value for value in self.counts(where)
+                if include_null or value is not None]
+
+    def count_distinct(self, where=None):
+        """``COUNT(DISTINCT column)``, which ignores NULL."""
+        return len(self.distinct(where, include_null=False))
+
+
+class Encoder:
+    """Builds a :class:`Categorical` from values arriving in batches.
+
+    Values equal but for case share a code, under the spelling seen first.
+    """
+
+    def __init__(self):
+        require_numpy()
+        self.lookup = {}
+        self.folded = {}
+        self.chunks = []
+
+    def _code(self, value):
+        """The code of a value not yet in ``lookup``."""
+        code = self.folded.setdefault(_fold(value), len(self.folded) + 1)
+        self.lookup[value] = code
+        return code
+
+    def extend(self, values):
+        get = self.lookup.get
+        codes = [0 if v is None else get(v) or self._code(v) for v in values]
+        self.chunks.append(numpy.array(codes, dtype=numpy.uint32))
+
+    def finish(self):
+        spelling = {}
+        for value, code in self.lookup.items():
+            spelling.setdefault(code, value)
+        first = [spelling[code] for code in range(1, len(self.folded) + 1)]
+        order = sorted(range(len(first)),
+                       key=lambda i: (type(first[i]).__name__, _fold(first[i])))
+        remap = numpy.zeros(len(first) + 1, dtype=numpy.uint32)
+        for new, old in enumerate(order, 1):
+            remap[old + 1] = new
+        dtype = numpy.min_scalar_type(len(first))
+        codes = (remap[numpy.concatenate(self.chunks)] if self.chunks
+                 else numpy.zeros(0, dtype=numpy.uint32))
+        return Categorical([None] + [first[i] for i in order], codes.astype(dtype))
+
+
+class CachedTable:
+    """The cached categorical columns of one table, row-aligned."""
+
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = columns
+        self.rows = len(next(iter(columns.values()))) if columns else 0
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    @property
+    def nbytes(self):
+        return sum(c.nbytes for c in self.columns.values())
+
+    def group_count(self, by, where=None):
+        """``{(v1, v2, ...): rows}`` like ``SELECT by..., COUNT(*) GROUP BY by...``."""
+        if isinstance(by, str):
+            by = [by]
+        key = numpy.zeros(self.rows, dtype=numpy.int64)
+        for column in by:
+            categorical = self.columns[column]
+            key = key * len(categorical.categories) + categorical.codes
+        if where is not None:
+            key = key[where]
+        groups, tally = numpy.unique(key, return_counts=True)
+        result = {}
+        for group, count in zip(groups.tolist(), tally.tolist()):
+            values = []
+            for column in reversed(by):
+                categories = self.columns[column].categories
+                group, code = divmod(group, len(categories))
+                values.append(categories[code])
+            result[tuple(reversed(values))] = count
+        return result
+
+
+class ColumnarCache:
+    """Categorical columns of dognitiondb, loaded on first use."""
+
+    def __init__(self, conn, columns=None, batch_size=50000):
+        require_numpy()
+        self.conn = conn
+        self.wanted = dict(CATEGORICAL_COLUMNS if columns is None else columns)
+        self.batch_size = batch_size
+        self.tables = {}
+
+    def table(self, name):
+        if name not in self.tables:
+            self.tables[name] = self.load(name, self.wanted[name])
+        return self.tables[name]
+
+    def load(self, table, columns):
+        """Stream ``columns`` of ``table`` and encode them batch by batch."""
+        encoders = [Encoder() for _ in columns]
+        sql = "SELECT %s FROM %s" % (", ".join(quote(c) for c in columns), quote(table))
+        with stream(self.conn, sql, batch_size=self.batch_size) as rows:
+            while True:
+                batch = rows.head(self.batch_size)
+                if not batch:
+                    break
+                for encoder, values in zip(encoders, zip(*batch)):
+                    encoder.extend(values)
+        return CachedTable(table, {column: encoder.finish()
+                                   for column, encoder in zip(columns, encoders)})
+
+    def invalidate(self, table=None):
+        """Forget one cached table (or all of them) so it reloads on next use."""
+        if table is None:
+            self.tables.clear()
+        else:
+            self.tables.pop(table, None)
+
+    @property
+    def nbytes(self):
+        return sum(t.nbytes for t in self.tables.values())
@@ -0,0 +1,206 @@
+"""Export query results to CSV, gzip-compressed CSV or Parquet in batches.
+
+``breed_list.csv('breed_list.csv')`` in Exercise 3 writes a result that
+``%sql`` has already pulled into memory in full; for ``exam_answers``
+(2.4 million rows) that is more than a notebook kernel should hold.
+:func:`export` streams the rows from a server-side cursor
+(:func:`dognition.streaming.stream`) and writes each batch before fetching
+the next, so memory is bounded by ``batch_size`` rather than the table::
+
+    report = export(conn, "SELECT * FROM exam_answers", "exam_answers.csv.gz",
+                    progress=lambda rows, nbytes: print(rows, end="\\r"))
+    print(report)    # "<rows> rows, <size> MB in <t>s (<rows/s> rows/s, <MB/s> MB/s)"
+
+The format follows the file name (``.csv``, ``.csv.gz``, ``.parquet``) or
+the ``format`` argument.  Parquet needs ``pyarrow``; each batch becomes one
+row group.  From the command line::
+
+    python -m dognition.export "SELECT * FROM site_activities" site_activities.parquet
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import os
+import time
+
+from .db import DEFAULT_URL, connect
+from .streaming import stream
+
+FORMATS = ("csv", "csv.gz", "parquet")
+
+
+class ExportReport:
+    """Rows and bytes written by one export, and how long it took."""
+
+    def __init__(self, path, format, rows, nbytes, seconds):
+        self.path = path
+        self.format = format
+        self.rows = rows
+        self.bytes = nbytes
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else float("inf")
+
+    @property
+    def mb_per_second(self):
+        return self.bytes / 1e6 / self.seconds if self.seconds else float("inf")
+
+    def __repr__(self):
+        return "<ExportReport %s>" % self
+
+    def __str__(self):
+        return "%d rows, %.1f MB in %.1fs (%s rows/s, %.1f MB/s)" % (
+            self.rows, self.bytes / 1e6, self.seconds,
+            format(int(self.rows_per_second), ",") if self.seconds else "inf",
+            self.mb_per_second)
+
+
+def format_for(path):
+    """The export format implied by ``path``'s extension."""
+    name = path.lower()
+    if name.endswith((".csv.gz", ".tsv.gz")):
+        return "csv.gz"
+    if name.endswith((".parquet", ".pq")):
+        return "parquet"
+    return "csv"
+
+
+class _CsvWriter:
+    def __init__(self, path, columns, compress):
+        self.raw = open(path, "wb")
+        stream = gzip.GzipFile(fileobj=self.raw, mode="wb") if compress else self.raw
+        self.gzip = stream if compress else None
+        self.text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        self.writer = csv.writer(self.text)
+        self.writer.writerow(columns)
+
+    def write(self, batch):
+        self.writer.writerows(batch)
+        self.text.flush()
+        return self.raw.tell()
+
+    def close(self):
+        self.text.close()
+        if self.gzip is not None:
+            self.raw.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet export requires pyarrow") from None
+
+        self.pa = pyarrow
+        self.path = path
+        self.columns = columns
+        self.schema = None
+        self.writer = None
+        self._open = pyarrow.parquet.ParquetWriter
+
+    def _arrays(self, batch):
+        values = list(zip(*batch)) if batch else [()] * len(self.columns)
+        if self.schema is None:
+            fields = []
+            for name, column in zip(self.columns, values):
+                kind = self.pa.array(column).type
+                # an all-NULL first batch says nothing about the type
+                fields.append(self.pa.field(name, self.pa.string()
+                                            if self.pa.types.is_null(kind) else kind))
+            self.schema = self.pa.schema(fields)
+            self.writer = self._open(self.path, self.schema)
+        arrays = []
+        for field, column in zip(self.schema, values):
+            if self.pa.types.is_string(field.type):
+                column = [None if v is None else str(v) for v in column]
+            arrays.append(self.pa.array(column, type=field.type))
+        return arrays
+
+    def write(self, batch):
+        arrays = self._arrays(batch)
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+        return os.path.getsize(self.path)
+
+    def close(self):
+        if self.writer is None:
+            self._arrays([])
+        self.writer.close()
+
+
+def _writer(path, columns, format):
+    if format == "parquet":
+        return _ParquetWriter(path, columns)
+    if format in ("csv", "csv.gz"):
+        return _CsvWriter(path, columns, compress=format == "csv.gz")
+    raise ValueError("unknown export format %r (expected one of %s)"
+                     % (format, ", ".join(FORMATS)))
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_rows(rows, columns, path, format=None, batch_size=10000, progress=None):
+    """Write an iterable of ``rows`` to ``path``; return an :class:`ExportReport`.
+
+    ``progress(rows, nbytes)`` is called after each batch with the running
+    totals.
+    """
+    format = format or format_for(path)
+    started = time.perf_counter()
+    writer = _writer(path, list(columns), format)
+    count = nbytes = 0
+    try:
+        for batch in _batches(rows, batch_size):
+            nbytes = writer.write(batch)
+            count += len(batch)
+            if progress is not None:
+                progress(count, nbytes)
+    finally:
+        writer.close()
+    return ExportReport(path, format, count, os.path.getsize(path),
+                        time.perf_counter() - started)
+
+
+def export(conn, sql, path, params=(), format=None, batch_size=10000, progress=None):
+    """Stream the result of ``sql`` into ``path``; return an :class:`ExportReport`."""
+    with stream(conn, sql, params, batch_size) as rows:
+        return export_rows(rows, rows.columns, path, format, batch_size, progress)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Export a query result to a file.")
+    p.add_argument("sql")
+    p.add_argument("path")
+    p.add_argument("--url", default=DEFAULT_URL)
+    p.add_argument("--format", choices=FORMATS)
+    p.add_argument("--batch-size", type=int, default=10000)
+    args = p.parse_args(argv)
+
+    def progress(rows, nbytes):
+        print("\r%12d rows %10.1f MB" % (rows, nbytes / 1e6), end="", flush=True)
+
+    conn = connect(args.url)
+    try:
+        report = export(conn, args.sql, args.path, format=args.format,
+                        batch_size=args.batch_size, progress=progress)
+    finally:
+        conn.close()
+    print("\r%s -> %s" % (report, report.path))
+
+
+if __name__ == "__main__":
+    main()
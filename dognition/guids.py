@@ -0,0 +1,400 @@
+"""Store the GUID keys as 16 time-ordered bytes instead of 36 characters.
+
+Every ``dog_guid`` and ``user_guid`` is a version-1 UUID string such as
+``'ce225842-7144-11e5-ba71-058fbc01cf0b'``, and nearly every exercise
+joins, groups or de-duplicates on one.  :func:`migrate` converts the
+columns in place to ``BINARY(16)`` holding MySQL 8's
+``UUID_TO_BIN(guid, 1)``, which moves the timestamp's high and middle
+groups in front of the low one, so keys created later sort later and new
+rows are appended at the right edge of the index rather than scattered
+through it::
+
+    ce225842-7144-11e5-ba71-058fbc01cf0b  ->  0x11e57144ce225842ba71058fbc01cf0b
+
+The indexes on the columns are dropped and rebuilt on the new values, and
+the tables re-analyzed so the planner sees the new indexes.
+Values that are not UUIDs (``IS_UUID`` false) stop the migration before
+anything is changed.  :func:`restore` converts back to text.
+
+Queries keep working through two conversions at the boundary:
+
+* :func:`rewrite_guids` changes the SQL.  Joins, ``GROUP BY``, ``COUNT``
+  and plain output columns use the binary values directly; a literal
+  compared with ``=``, ``<>`` or ``IN`` becomes ``UUID_TO_BIN('...', 1)``
+  so the index is still used; anywhere the text matters (``ORDER BY``,
+  ``LIKE``, ``MIN``, string functions) the column is read as
+  ``BIN_TO_UUID(col, 1)``.
+* :func:`decode_rows` turns 16-byte values in a result back into the UUID
+  text, so ``SELECT *`` and ``SELECT d.dog_guid`` look as they did.
+
+The runner applies both once the columns are binary::
+
+    python -m dognition.guids migrate --url mysql://root@localhost/dognitiondb
+    python -m dognition.guids restore --url ...
+
+``UUID_TO_BIN`` needs MySQL 8.0; :func:`dognition.db.register_mysql_functions`
+provides it on SQLite.  SQLite cannot add a column at a given position, so
+there the converted columns move to the end of ``SELECT *``.
+"""
+
+import argparse
+from collections import namedtuple
+
+from .catalog import SchemaCatalog
+from .db import DEFAULT_URL, bin_to_uuid, connect, dialect_of, quote
+from .sqltext import depths, identifier, keyword, significant, string_value, tokenize
+
+GUID_COLUMNS = ("dog_guid", "user_guid")
+
+GuidColumn = namedtuple("GuidColumn", "table name nullable indexes")
+
+
+class GuidError(ValueError):
+    """A column holds values that are not UUIDs and cannot be converted."""
+
+
+def _binary(type_):
+    return type_.lower().startswith(("binary", "varbinary", "blob"))
+
+
+def guid_columns(catalog, names=GUID_COLUMNS, binary=False):
+    """The GUID columns of ``catalog`` stored as text (or, with ``binary``, as bytes)."""
+    found = []
+    for table in catalog.tables.values():
+        for column in table.columns:
+            if column.name.lower() not in names or _binary(column.type) != binary:
+                continue
+            indexes = [index for index in table.indexes
+                       if column.name.lower() in (c.lower() for c in index.columns)]
+            found.append(GuidColumn(table.name, column.name, column.nullable, indexes))
+    return found
+
+
+def migrated(catalog, names=GUID_COLUMNS):
+    """Names of the GUID columns already stored as binary."""
+    return sorted({c.name.lower() for c in guid_columns(catalog, names, binary=True)})
+
+
+def _invalid(cursor, column):
+    cursor.execute("SELECT COUNT(*) FROM %s WHERE %s IS NOT NULL AND NOT IS_UUID(%s)" % (
+        quote(column.table), quote(column.name), quote(column.name)))
+    return cursor.fetchone()[0]
+
+
+def _convert(cursor, column, dialect, type_, expression):
+    """Replace ``column`` with a ``type_`` column holding ``expression`` of it."""
+    table, name = quote(column.table), quote(column.name)
+    temporary = quote(column.name + "__new")
+    for index in column.indexes:
+        cursor.execute("DROP INDEX %s%s" % (
+            quote(index.name), "" if dialect == "sqlite" else " ON " + table))
+    cursor.execute("ALTER TABLE %s ADD COLUMN %s %s%s" % (
+        table, temporary, type_, "" if dialect == "sqlite" else " AFTER " + name))
+    cursor.execute("UPDATE %s SET %s = %s" % (table, temporary, expression % name))
+    cursor.execute("ALTER TABLE %s DROP COLUMN %s" % (table, name))
+    cursor.execute("ALTER TABLE %s RENAME COLUMN %s TO %s" % (table, temporary, name))
+    if dialect != "sqlite" and not column.nullable:
+        cursor.execute("ALTER TABLE %s MODIFY %s %s NOT NULL" % (table, name, type_))
+    for index in column.indexes:
+        cursor.execute("CREATE %sINDEX %s ON %s (%s)" % (
+            "UNIQUE " if index.unique else "", quote(index.name), table,
+            ", ".join(quote(c) for c in index.columns)))
+
+
+def analyze(cursor, tables, dialect):
+    """Refresh the planner statistics of ``tables`` after their indexes were rebuilt."""
+    for table in sorted(set(tables)):
+        cursor.execute("ANALYZE %s%s" % ("" if dialect == "sqlite" else "TABLE ", quote(table)))
+        if cursor.description:
+            cursor.fetchall()
+
+
+def migrate(conn, names=GUID_COLUMNS):
+    """Convert the text GUID columns to swapped ``BINARY(16)``; return them.
+
+    Raises :class:`GuidError` if any column holds a value that is not a
+    UUID; nothing is converted then.
+    """
+    columns = guid_columns(SchemaCatalog.fetch(conn), names)
+    if any(index.name.upper() == "PRIMARY" for c in columns for index in c.indexes):
+        raise GuidError("GUID columns in a PRIMARY KEY are not converted")
+    dialect = dialect_of(conn)
+    cursor = conn.cursor()
+    try:
+        bad = ["%s.%s (%d rows)" % (c.table, c.name, n)
+               for c in columns for n in [_invalid(cursor, c)] if n]
+        if bad:
+            raise GuidError("values that are not UUIDs in %s" % ", ".join(bad))
+        type_ = "BLOB" if dialect == "sqlite" else "BINARY(16)"
+        for column in columns:
+            _convert(cursor, column, dialect, type_, "UUID_TO_BIN(%s, 1)")
+        analyze(cursor, [c.table for c in columns], dialect)
+    finally:
+        cursor.close()
+    conn.commit()
+    return columns
+
+
+def restore(conn, names=GUID_COLUMNS, type_="varchar(60)"):
+    """Convert binary GUID columns back to ``type_`` text; return them."""
+    columns = guid_columns(SchemaCatalog.fetch(conn), names, binary=True)
+    dialect = dialect_of(conn)
+    cursor = conn.cursor()
+    try:
+        for column in columns:
+            _convert(cursor, column, dialect, "TEXT" if dialect == "sqlite" else type_,
+                     "BIN_TO_UUID(%s, 1)")
+        analyze(cursor, [c.table for c in columns], dialect)
+    finally:
+        cursor.close()
+    conn.commit()
+    return columns
+
+
+def decode_rows(rows):
+    """``rows`` with every 16-byte binary value turned back into UUID text."""
+    decoded = []
+    for row in rows:
+        if any(isinstance(v, (bytes, bytearray)) and len(v) == 16 for v in row):
+            row = tuple(bin_to_uuid(v, 1) if isinstance(v, (bytes, bytearray))
+                        and len(v) == 16 else v for v in row)
+        decoded.append(row)
+    return decoded
+
+
+_EQUALITY = ("=", "<>", "!=", "<=>")
+# words that end an operand on its left or right
+_EDGES = {"SELECT", "WHERE", "ON", "AND", "OR", "XOR", "NOT", "WHEN", "THEN", "ELSE",
+          "END", "HAVING", "FROM", "GROUP", "ORDER", "LIMIT", "JOIN", "INNER", "LEFT",
+          "RIGHT", "CROSS", "NATURAL", "STRAIGHT_JOIN", "USING", "UNION", "AS", "ASC",
+          "DESC"}
+_CLAUSES = {"SELECT", "FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "ON",
+            "USING", "UNION"}
+
+
+def _clauses(sig, depth):
+    """The clause keyword each significant token sits in, at its own depth."""
+    current, found, level = {}, [], 0
+    for i, token in sig:
+        if depth[i] > level:
+            current[depth[i]] = None
+        level = depth[i]
+        word = keyword(token)
+        if word in _CLAUSES:
+            current[level] = word
+        found.append(current.get(level))
+    return found
+
+
+def _enclosing(sig, depth, pos):
+    """The word before the parenthesis enclosing ``sig[pos]``, or ``None``."""
+    level = depth[sig[pos][0]]
+    for back in range(pos - 1, -1, -1):
+        if depth[sig[back][0]] < level:
+            return keyword(sig[back - 1][1]) if back and sig[back][1].text == "(" else None
+    return None
+
+
+def _refs(sig, names):
+    """``(first, last)`` positions in ``sig`` of column references to ``names``."""
+    found = []
+    for pos, (_, token) in enumerate(sig):
+        if (identifier(token) or "").lower() not in names:
+            continue
+        if pos + 1 < len(sig) and sig[pos + 1][1].text in (".", "("):
+            continue
+        if pos and keyword(sig[pos - 1][1]) == "AS":
+            continue
+        first = pos
+        if pos >= 2 and sig[pos - 1][1].text == "." and identifier(sig[pos - 2][1]):
+            first = pos - 2
+        found.append((first, pos))
+    return found
+
+
+def _edge(sig, pos):
+    """Whether ``sig[pos]`` (possibly past either end) bounds an operand."""
+    if pos < 0 or pos >= len(sig):
+        return True
+    token = sig[pos][1]
+    return token.text in ("(", ")", ",", ";") or keyword(token) in _EDGES
+
+
+def _operand(sig, depth, refs, eq, step):
+    """What stands alone on one side of the comparison at ``sig[eq]``.
+
+    ``step`` is -1 for the left side and 1 for the right.  Returns
+    ``("literal", pos)`` for a GUID string, ``("ref", pos)`` for a column
+    reference to a GUID column and ``("subquery", pos)`` for ``(SELECT
+    ...)``, each possibly in redundant parentheses; ``None`` for anything
+    else, such as ``LOWER(r.dog_guid)`` or ``d.dog_guid || ''``.
+    """
+    opening, closing = ("(", ")") if step > 0 else (")", "(")
+    pos, wrapped = eq + step, 0
+    while 0 <= pos < len(sig) and sig[pos][1].text == opening:
+        pos, wrapped = pos + step, wrapped + 1
+    if not 0 <= pos < len(sig):
+        return None
+    if wrapped and step > 0 and keyword(sig[pos][1]) == "SELECT":
+        return "subquery", pos
+    if wrapped and step < 0:
+        # (SELECT ...) = column: find the parenthesis that opens it
+        level = depth[sig[eq - 1][0]]
+        back = eq - 2
+        while back >= 0 and not (depth[sig[back][0]] == level
+                                 and sig[back][1].text == "("):
+            back -= 1
+        if back >= 0 and back + 1 < len(sig) and keyword(sig[back + 1][1]) == "SELECT":
+            return "subquery", back + 1
+    if _is_guid_string(sig[pos][1]):
+        kind, far = "literal", pos
+    else:
+        span = refs.get(pos)
+        if span is None:
+            return None
+        kind, far = "ref", span
+    for _ in range(wrapped):
+        far += step
+        if not 0 <= far < len(sig) or sig[far][1].text != closing:
+            return None
+    if not _edge(sig, far + step):
+        return None
+    return kind, pos
+
+
+def _comparison(sig, first, last):
+    """``(equality position, side)`` if ``sig[first:last + 1]`` is a whole
+    operand of ``=``/``<>``/``!=``/``<=>``, else ``None``; ``side`` is the
+    step towards the other operand."""
+    wrapped = 0
+    while (first - wrapped - 1 >= 0 and last + wrapped + 1 < len(sig)
+           and sig[first - wrapped - 1][1].text == "("
+           and sig[last + wrapped + 1][1].text == ")"):
+        wrapped += 1
+    # ``(a.dog_guid = b.dog_guid)``: the parentheses belong to the comparison
+    for inner in range(wrapped, -1, -1):
+        left, right = first - inner - 1, last + inner + 1
+        if right < len(sig) and sig[right][1].text in _EQUALITY and _edge(sig, left):
+            return right, 1
+        if left >= 0 and sig[left][1].text in _EQUALITY and _edge(sig, right):
+            return left, -1
+    return None
+
+
+def _is_guid_string(token):
+    return token.kind == "string" and len(string_value(token)) == 36 and \
+        string_value(token).count("-") == 4
+
+
+def rewrite(sql, names=GUID_COLUMNS):
+    """Return ``(new_sql, changes)`` for a database with binary ``names`` columns."""
+    tokens = tokenize(sql)
+    sig = significant(tokens)
+    if not sig or keyword(sig[0][1]) not in ("SELECT", "WITH") and sig[0][1].text != "(":
+        return sql, []
+    names = {n.lower() for n in names}
+    depth = depths(tokens)
+    clauses = _clauses(sig, depth)
+    refs = _refs(sig, names)
+    starts = {first for first, _ in refs}
+    ends = {last for _, last in refs}
+    # a reference seen from either end: the position of its other end
+    spans = dict(refs)
+    spans.update((last, first) for first, last in refs)
+    edits = {}
+    aliases = {}
+
+    def text(first, last):
+        return "".join(t.text for t in tokens[sig[first][0]:sig[last][0] + 1])
+
+    def wrap_string(pos):
+        edits[(pos, pos)] = "UUID_TO_BIN(%s, 1)" % sig[pos][1].text
+
+    for first, last in refs:
+        before = sig[first - 1][1] if first else None
+        after = sig[last + 1][1] if last + 1 < len(sig) else None
+        clause = clauses[first]
+        raw = False
+        enclosing = _enclosing(sig, depth, first)
+        if clause == "GROUP" or after is not None and keyword(after) == "IS":
+            raw = True
+        elif enclosing == "USING" or enclosing == "COUNT" and (
+                before.text == "(" or keyword(before) == "DISTINCT") and after.text == ")":
+            raw = True
+        elif _comparison(sig, first, last) is not None:
+            # compare bytes with bytes only when the other side is a GUID
+            # literal, another GUID column or a subquery; anything else is text
+            other = _operand(sig, depth, spans, *_comparison(sig, first, last))
+            if other is not None and other[0] == "literal":
+                wrap_string(other[1])
+            raw = other is not None
+        elif after is not None and keyword(after) in ("IN", "NOT"):
+            at = last + 1 if keyword(after) == "IN" else last + 2
+            if at + 1 < len(sig) and keyword(sig[at][1]) == "IN" and sig[at + 1][1].text == "(":
+                if keyword(sig[at + 2][1]) == "SELECT":
+                    raw = True
+                else:
+                    items, pos = [], at + 2
+                    while pos < len(sig) and sig[pos][1].text != ")":
+                        if sig[pos][1].text != ",":
+                            items.append(pos)
+                        pos += 1
+                    if all(_is_guid_string(sig[p][1]) for p in items):
+                        for p in items:
+                            wrap_string(p)
+                        raw = True
+        elif clause == "SELECT" and before is not None and (
+                before.text == "," or keyword(before) in ("SELECT", "DISTINCT")) and (
+                after is None or after.text in (",", ")") or keyword(after) in ("FROM", "AS")
+                or after.kind in ("name", "quoted")):
+            raw = True
+            alias = None
+            if after is not None and keyword(after) == "AS":
+                alias = identifier(sig[last + 2][1])
+            elif after is not None and keyword(after) != "FROM" and after.kind in ("name", "quoted"):
+                alias = identifier(after)
+            aliases[(alias or identifier(sig[last][1])).lower()] = text(first, last)
+        if not raw:
+            edits[(first, last)] = "BIN_TO_UUID(%s, 1)" % text(first, last)
+
+    # ORDER BY an alias of a GUID output column sorts on the text form too
+    for pos, (_, token) in enumerate(sig):
+        if clauses[pos] != "ORDER" or pos in starts or pos in ends:
+            continue
+        name = (identifier(token) or "").lower()
+        before = sig[pos - 1][1]
+        after = sig[pos + 1][1] if pos + 1 < len(sig) else None
+        if name in aliases and (before.text == "," or keyword(before) == "BY") and (
+                after is None or after.text in (",", ")", ";")
+                or keyword(after) in ("ASC", "DESC", "LIMIT")):
+            edits[(pos, pos)] = "BIN_TO_UUID(%s, 1)" % aliases[name]
+
+    changes = []
+    for (first, last), replacement in sorted(edits.items(), reverse=True):
+        changes.append("%s -> %s" % (text(first, last), replacement))
+        tokens[sig[first][0]:sig[last][0] + 1] = [
+            tokens[sig[first][0]]._replace(kind="name", text=replacement)]
+    return "".join(t.text for t in tokens), changes[::-1]
+
+
+def rewrite_guids(sql, names=GUID_COLUMNS):
+    """Return ``sql`` rewritten for binary GUID columns."""
+    return rewrite(sql, names)[0]
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Convert the GUID columns to or from binary.")
+    p.add_argument("action", choices=("migrate", "restore"))
+    p.add_argument("--url", default=DEFAULT_URL)
+    args = p.parse_args(argv)
+    conn = connect(args.url)
+    try:
+        changed = migrate(conn) if args.action == "migrate" else restore(conn)
+    finally:
+        conn.close()
+    for column in changed:
+        print("%sd %s.%s" % (args.action, column.table, column.name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Hash joins on the client over cached or streamed table rows.
+
+Exercises 7 and 8 join dogs to reviews on both GUIDs::
+
+    SELECT d.dog_guid, d.user_guid, AVG(r.rating), COUNT(r.rating), d.breed
+    FROM dogs d, reviews r
+    WHERE d.dog_guid=r.dog_guid AND d.user_guid=r.user_guid
+    GROUP BY ...
+
+and the server matches 36-character strings for every pair, once per
+query.  :func:`hash_join` does it once per query too, but over rows the
+client already holds: it puts the smaller input in a dict keyed by the join
+columns and streams the larger one past it, ``batch_size`` rows at a time,
+so only the build side is kept in memory.  ``how`` is ``"inner"``,
+``"left"``, ``"right"`` or ``"anti"`` (rows of the left input with no match,
+the ``LEFT JOIN ... WHERE d.dog_guid IS NULL`` of Exercise 8).  A key with
+a NULL in it matches nothing, as with ``=`` in SQL.
+
+Inputs are :class:`Relation` objects: a :class:`TableCache` keeps the
+columns of a table it has read once, and :func:`scan` streams them without
+keeping them::
+
+    cache = TableCache(conn)
+    joined = join(cache.relation("dogs", ["dog_guid", "user_guid", "breed"]),
+                  cache.relation("reviews", ["dog_guid", "user_guid", "rating"]),
+                  on=[("dog_guid", "dog_guid"), ("user_guid", "user_guid")])
+    for dog_guid, user_guid, breed, _, _, rating in joined.rows:
+        ...
+
+Rows come out in no particular order.  Values compare as Python values:
+the GUIDs are lower-case hex in dognitiondb, so MySQL's case-insensitive
+collation makes no difference to them.
+"""
+
+import itertools
+from operator import itemgetter
+
+from .db import quote
+from .streaming import stream
+
+JOINS = ("inner", "left", "right", "anti")
+
+
+class Relation:
+    """Named columns and an iterable of row tuples.
+
+    ``rows`` is a list for cached tables and an iterator for streamed ones;
+    :func:`join` builds its hash table on the side whose size it knows to
+    be smaller.
+    """
+
+    def __init__(self, name, columns, rows):
+        self.name = name
+        self.columns = list(columns)
+        self.rows = rows
+
+    def __repr__(self):
+        return "Relation(%r, %r)" % (self.name, self.columns)
+
+    @property
+    def size(self):
+        """Number of rows, or ``None`` for a stream."""
+        return len(self.rows) if isinstance(self.rows, list) else None
+
+    def index(self, column):
+        lowered = [c.lower() for c in self.columns]
+        if column.lower() not in lowered:
+            raise ValueError("%s has no column %r" % (self.name, column))
+        return lowered.index(column.lower())
+
+
+def _key(indexes):
+    """``row -> key`` and ``key -> has NULL`` for the join columns ``indexes``."""
+    get = itemgetter(*indexes)
+    if len(indexes) == 1:
+        return get, lambda key: key is None
+    return get, lambda key: None in key
+
+
+def _batches(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def hash_join(left, right, left_keys, right_keys, how="inner", build="right",
+              widths=None, batch_size=10000):
+    """Yield the rows of ``left`` joined to ``right`` on equal key columns.
+
+    ``left`` and ``right`` are iterables of tuples and ``left_keys`` /
+    ``right_keys`` the positions of the join columns in them.  Output rows
+    are ``left_row + right_row``, padded with ``None`` for the missing side
+    of an outer join, whose two row widths ``widths`` must then give;
+    ``"anti"`` yields bare left rows.  ``build`` is the side held in the
+    hash table, ``"left"`` or ``"right"``; the other side is read
+    ``batch_size`` rows at a time.
+    """
+    if how not in JOINS:
+        raise ValueError("how must be one of %s, not %r" % (", ".join(JOINS), how))
+    if build not in ("left", "right"):
+        raise ValueError("build must be 'left' or 'right', not %r" % (build,))
+    if len(left_keys) != len(right_keys) or not left_keys:
+        raise ValueError("need the same, non-zero number of keys on both sides")
+    if how in ("left", "right") and widths is None:
+        raise ValueError("an outer join needs the row widths to pad with")
+    left_pad = right_pad = ()
+    if widths is not None:
+        left_pad, right_pad = (None,) * widths[0], (None,) * widths[1]
+
+    def unmatched(row, side):
+        if how == "anti":
+            return row
+        return row + right_pad if side == "left" else left_pad + row
+
+    probe = "left" if build == "right" else "right"
+    kept = {"inner": None, "left": "left", "right": "right", "anti": "left"}[how]
+    if build == "right":
+        build_rows, build_keys, probe_rows, probe_keys = right, right_keys, left, left_keys
+    else:
+        build_rows, build_keys, probe_rows, probe_keys = left, left_keys, right, right_keys
+    build_key, build_null = _key(build_keys)
+    probe_key, probe_null = _key(probe_keys)
+
+    table = {}
+    unmatchable = []
+    for row in build_rows:
+        key = build_key(row)
+        if build_null(key):
+            if kept == build:
+                unmatchable.append(row)
+            continue
+        found = table.get(key)
+        if found is None:
+            table[key] = [row]
+        else:
+            found.append(row)
+
+    matched = set()
+    for batch in _batches(probe_rows, batch_size):
+        for row in batch:
+            key = probe_key(row)
+            found = None if probe_null(key) else table.get(key)
+            if found is None:
+                if kept == probe:
+                    yield unmatched(row, probe)
+                continue
+            if kept == build:
+                matched.add(key)
+            if how == "anti":
+                continue
+            if probe == "left":
+                for other in found:
+                    yield row + other
+            else:
+                for other in found:
+                    yield other + row
+    if kept != build:
+        return
+    for key, rows in table.items():
+        if key not in matched:
+            for row in rows:
+                yield unmatched(row, build)
+    for row in unmatchable:
+        yield unmatched(row, build)
+
+
+def join(left, right, on, how="inner", batch_size=10000):
+    """Join two :class:`Relation` objects; return the joined :class:`Relation`.
+
+    ``on`` lists ``(left column, right column)`` pairs that must be equal.
+    The hash table is built on ``right`` unless ``left`` is known to be
+    smaller (a cached list against a stream, or a shorter list).  The
+    result's rows are a generator; its columns are ``left.columns +
+    right.columns``, or ``left.columns`` for ``"anti"``.
+    """
+    left_keys = [left.index(a) for a, _ in on]
+    right_keys = [right.index(b) for _, b in on]
+    build = "right"
+    if left.size is not None and (right.size is None or left.size < right.size):
+        build = "left"
+    rows = hash_join(left.rows, right.rows, left_keys, right_keys, how, build,
+                     (len(left.columns), len(right.columns)), batch_size)
+    columns = left.columns if how == "anti" else left.columns + right.columns
+    return Relation("%s_%s" % (left.name, right.name), columns, rows)
+
+
+def _select(table, columns, where=None):
+    sql = "SELECT %s FROM %s" % (", ".join(quote(c) for c in columns), quote(table))
+    return sql + (" WHERE %s" % where if where else "")
+
+
+def scan(conn, table, columns, where=None, batch_size=10000):
+    """A :class:`Relation` streaming ``columns`` of ``table`` from the server.
+
+    Close ``relation.rows`` (a :class:`dognition.streaming.StreamingResult`)
+    if it is not read to the end.
+    """
+    return Relation(table, columns, stream(conn, _select(table, columns, where),
+                                           batch_size=batch_size))
+
+
+class TableCache:
+    """Columns of dognitiondb tables read once and kept as lists of tuples.
+
+    A cached relation holds the columns asked for the first time; asking
+    for other columns of the same table reads it again.
+    """
+
+    def __init__(self, conn, batch_size=50000):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.tables = {}
+
+    def relation(self, table, columns, where=None):
+        key = (table, tuple(c.lower() for c in columns), where)
+        if key not in self.tables:
+            with stream(self.conn, _select(table, columns, where),
+                        batch_size=self.batch_size) as rows:
+                self.tables[key] = list(rows)
+        return Relation(table, columns, self.tables[key])
+
+    def invalidate(self, table=None):
+        """Forget one cached table (or all of them) so it reloads on next use."""
+        if table is None:
+            self.tables.clear()
+        else:
+            for key in [k for k in self.tables if k[0] == table]:
+                del self.tables[key]
+
+    @property
+    def rows(self):
+        return sum(len(rows) for rows in self.tables.values())
@@ -0,0 +1,268 @@
+"""Approximate ``COUNT(DISTINCT ...)`` from mergeable HyperLogLog sketches.
+
+``COUNT(DISTINCT dog_guid)`` over complete_tests has to remember every GUID
+it has seen.  A :class:`HyperLogLog` sketch answers the same question
+within a known relative error from a fixed few kilobytes of registers, and
+two sketches merge into the sketch of the union.  That makes it practical
+to keep one sketch per table, column and month::
+
+    store = SketchStore.load(conn)
+    store.build(conn, "complete_tests", "dog_guid")       # one scan, then cached
+    store.count_distinct("complete_tests", "dog_guid",
+                         start="2014-01-01", end="2014-07-01")
+    store.save()
+
+A date range is answered by merging the monthly sketches, so it is rounded
+out to whole months; rows with a NULL date only count when the range is
+unbounded.  With the default 2% standard error a sketch is 4 KB (2^12
+one-byte registers) and compresses well when a month is sparse.
+:meth:`SketchStore.build` with ``since`` rescans only the months from that
+date on, for refreshing after new rows arrive.
+"""
+
+import base64
+import hashlib
+import json
+import math
+import os
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .catalog import default_cache_path
+from .db import placeholder, quote
+from .streaming import stream
+
+DEFAULT_ERROR = 0.02
+DATE_COLUMNS = {"exam_answers": "start_time"}
+NO_DATE = "none"
+
+
+def precision_for(error):
+    """The smallest register-index width giving ``error`` standard error."""
+    if not 0 < error < 1:
+        raise ValueError("error must be between 0 and 1, not %r" % (error,))
+    return min(18, max(4, math.ceil(math.log2((1.04 / error) ** 2))))
+
+
+def hash64(value):
+    """The 64-bit hash the sketches use, for callers that keep hashes themselves."""
+    data = value if isinstance(value, bytes) else str(value).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def register_of(x, precision):
+    """The register index and rank a sketch of ``precision`` keeps for hash ``x``."""
+    width = 64 - precision
+    return x >> width, width - (x & ((1 << width) - 1)).bit_length() + 1
+
+
+def estimate(size, ranks):
+    """The distinct count from the non-zero register ``ranks`` of ``size`` registers.
+
+    Lets a sketch kept sparsely, as ``{index: rank}``, be counted without
+    filling in its empty registers.
+    """
+    ranks = list(ranks)
+    zeros = size - len(ranks)
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(size, 0.7213 / (1 + 1.079 / size))
+    value = alpha * size * size / (zeros + sum(2.0 ** -r for r in ranks))
+    if value <= 2.5 * size and zeros:
+        # linear counting is more accurate while most registers are empty
+        value = size * math.log(size / zeros)
+    return int(round(value))
+
+
+class HyperLogLog:
+    """A HyperLogLog sketch with ``2 ** precision`` registers."""
+
+    def __init__(self, precision=None, registers=None):
+        self.precision = precision or precision_for(DEFAULT_ERROR)
+        self.size = 1 << self.precision
+        self.registers = bytearray(registers or self.size)
+        if len(self.registers) != self.size:
+            raise ValueError("%d registers for precision %d"
+                             % (len(self.registers), self.precision))
+
+    @classmethod
+    def for_error(cls, error):
+        return cls(precision_for(error))
+
+    @property
+    def error(self):
+        """The relative standard error of :meth:`count`."""
+        return 1.04 / math.sqrt(self.size)
+
+    def add(self, value):
+        if value is not None:
+            self.add_hash(hash64(value))
+
+    def add_hash(self, x):
+        """Add a value by its :func:`hash64`."""
+        index, rank = register_of(x, self.precision)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """Fold ``other`` into this sketch (the sketch of the union)."""
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches of precision %d and %d"
+                             % (self.precision, other.precision))
+        if numpy is not None:
+            mine = numpy.frombuffer(self.registers, dtype=numpy.uint8)
+            numpy.maximum(mine, numpy.frombuffer(other.registers, dtype=numpy.uint8), out=mine)
+        else:
+            self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def copy(self):
+        return HyperLogLog(self.precision, self.registers)
+
+    def count(self):
+        return estimate(self.size, (r for r in self.registers if r))
+
+    def __len__(self):
+        return self.count()
+
+    def to_bytes(self):
+        return bytes([1, self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < 2 or data[0] != 1:
+            raise ValueError("not a serialized sketch")
+        return cls(data[1], zlib.decompress(data[2:]))
+
+
+def month_of(value):
+    """``'YYYY-MM'`` for a datetime or ISO timestamp string, else :data:`NO_DATE`."""
+    if value is None:
+        return NO_DATE
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m")
+    return str(value)[:7]
+
+
+class SketchStore:
+    """Monthly sketches for ``(table, column)`` pairs, persisted as JSON."""
+
+    def __init__(self, path=None, sketches=None):
+        self.path = path
+        self.sketches = sketches or {}
+
+    @classmethod
+    def load(cls, conn=None, path=None):
+        """Read the store at ``path`` (default: the cache file for ``conn``)."""
+        path = path or default_cache_path(conn, "sketches")
+        store = cls(path)
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            for key, months in data.items():
+                store.sketches[key] = {
+                    month: HyperLogLog.from_bytes(base64.b64decode(blob))
+                    for month, blob in months.items()}
+        return store
+
+    def save(self, path=None):
+        path = path or self.path
+        if path is None:
+            return  # an in-memory database: nothing to keep
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = {key: {month: base64.b64encode(sketch.to_bytes()).decode("ascii")
+                      for month, sketch in sorted(months.items())}
+                for key, months in self.sketches.items()}
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def key(table, column):
+        return "%s.%s" % (table, column)
+
+    def __contains__(self, pair):
+        return self.key(*pair) in self.sketches
+
+    def months(self, table, column):
+        return sorted(self.sketches.get(self.key(table, column), ()))
+
+    def build(self, conn, table, column, date_column=None, since=None,
+              error=DEFAULT_ERROR, batch_size=10000):
+        """Scan ``table`` and (re)build the monthly sketches of ``column``.
+
+        With ``since`` (a date string) only rows dated on or after it are
+        read and only their months are replaced; earlier months are kept.
+        """
+        date_column = date_column or DATE_COLUMNS.get(table, "created_at")
+        sql = "SELECT %s, %s FROM %s" % (quote(column), quote(date_column), quote(table))
+        params = ()
+        if since is not None:
+            sql += " WHERE %s >= %s" % (quote(date_column), placeholder(conn))
+            params = (since[:7] + "-01",)
+        fresh = {}
+        precision = precision_for(error)
+        with stream(conn, sql, params, batch_size) as rows:
+            for value, moment in rows:
+                month = month_of(moment)
+                sketch = fresh.get(month)
+                if sketch is None:
+                    sketch = fresh[month] = HyperLogLog(precision)
+                sketch.add(value)
+        months = self.sketches.setdefault(self.key(table, column), {})
+        if since is None:
+            months.clear()
+        months.update(fresh)
+        return len(fresh)
+
+    def sketch(self, table, column, start=None, end=None):
+        """The merged sketch for the months overlapping ``[start, end)``."""
+        try:
+            months = self.sketches[self.key(table, column)]
+        except KeyError:
+            raise KeyError("no sketches for %s.%s; build them first"
+                           % (table, column)) from None
+        unbounded = start is None and end is None
+        first = start[:7] if start else None
+        last = last_month(end) if end else None
+        merged = None
+        for month, sketch in months.items():
+            if month == NO_DATE:
+                if not unbounded:
+                    continue
+            elif (first and month < first) or (last and month > last):
+                continue
+            merged = sketch.copy() if merged is None else merged.merge(sketch)
+        return merged
+
+    def count_distinct(self, table, column, start=None, end=None):
+        """Approximate ``COUNT(DISTINCT column)`` for rows dated in ``[start, end)``."""
+        merged = self.sketch(table, column, start, end)
+        return merged.count() if merged is not None else 0
+
+
+def last_month(end):
+    """The last month an exclusive ``end`` date still reaches into."""
+    month, rest = end[:7], end[7:]
+    if rest == "" or (rest.startswith("-01") and not rest[3:].strip(" T0:")):
+        year, number = int(month[:4]), int(month[5:7])
+        return "%04d-12" % (year - 1) if number == 1 else "%04d-%02d" % (year, number - 1)
+    return month
+
+
+def approx_count_distinct(conn, table, column, start=None, end=None, store=None):
+    """``COUNT(DISTINCT column)`` from cached sketches, building them if needed."""
+    store = store or SketchStore.load(conn)
+    if (table, column) not in store:
+        store.build(conn, table, column)
+        store.save()
+    return store.count_distinct(table, column, start, end)
@@ -0,0 +1,122 @@
+"""Referential-integrity scan of every implied foreign key, over a process pool.
+
+dognitiondb declares no foreign keys, but every ``dog_guid`` column points
+at ``dogs`` and every ``user_guid`` column at ``users``; the outer-join
+exercises check those links one at a time.  :func:`implied_keys` lists all
+of them from the schema and :func:`scan` checks them at once, one
+relationship per worker process::
+
+    for report in scan("sqlite:///dognition.db"):
+        print(report.check.table, report.check.column, report.orphans, report.sample)
+
+Each worker opens its own connection, loads the parent column into a
+:class:`dognition.bloom.KeySet` and streams the child column past it with
+:func:`dognition.bloom.orphans`.  A :class:`Report` gives the orphaned rows
+and keys with a sample of the keys, the NULLs on both sides, and how many
+parent rows repeat a key (a parent with duplicates fans every join out).
+The checks are handed out largest child table first, so with as many
+workers as checks the scan takes about as long as its largest check.
+"""
+
+import argparse
+import concurrent.futures
+import os
+import time
+from collections import namedtuple
+
+from .bloom import Check, KeySet, orphans
+from .catalog import SchemaCatalog
+from .db import DEFAULT_URL, connect, parse_url
+
+# key column -> (parent table, parent column)
+PARENT_KEYS = {
+    "dog_guid": ("dogs", "dog_guid"),
+    "user_guid": ("users", "user_guid"),
+}
+
+Report = namedtuple("Report", "check rows nulls orphans orphan_keys sample "
+                              "ref_rows ref_nulls duplicates seconds")
+
+
+def implied_keys(catalog, parents=PARENT_KEYS):
+    """A :class:`dognition.bloom.Check` for every child column in ``catalog``."""
+    found = []
+    for table in catalog.tables.values():
+        for column in table.column_names:
+            ref_table, ref_column = parents.get(column.lower(), (None, None))
+            if ref_table is None or table.name.lower() == ref_table:
+                continue
+            if ref_table in catalog.tables:
+                found.append(Check(table.name, column, ref_table, ref_column))
+    return found
+
+
+def check(url, relationship, sample=5):
+    """Run one ``relationship`` check on its own connection; return a :class:`Report`."""
+    started = time.perf_counter()
+    conn = connect(url)
+    try:
+        keys = KeySet.load(conn, relationship.ref_table, relationship.ref_column)
+        found = orphans(conn, relationship.table, relationship.column, keys, sample=sample)
+    finally:
+        conn.close()
+    return Report(relationship, found.scanned, found.nulls, found.count, found.distinct,
+                  found.sample, keys.rows, keys.nulls, keys.duplicates,
+                  time.perf_counter() - started)
+
+
+def scan(url, checks=None, workers=None, sample=5, catalog=None):
+    """Check every relationship in ``checks`` (default: :func:`implied_keys`).
+
+    Returns the reports in the order of ``checks``.  ``url`` must name a
+    database each worker can open by itself; with one worker everything
+    runs in this process.
+    """
+    if parse_url(url)["database"] == ":memory:":
+        raise ValueError("workers cannot open an in-memory database; use a file")
+    if catalog is None or checks is None:
+        conn = connect(url)
+        try:
+            catalog = catalog or SchemaCatalog.fetch(conn)
+        finally:
+            conn.close()
+    checks = list(implied_keys(catalog) if checks is None else checks)
+    workers = min(workers or os.cpu_count() or 1, len(checks) or 1)
+    table = catalog.tables.get
+    order = sorted(range(len(checks)), reverse=True,
+                   key=lambda i: getattr(table(checks[i].table), "rows", None) or 0)
+    if workers == 1:
+        reports = {i: check(url, checks[i], sample) for i in order}
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = {i: pool.submit(check, url, checks[i], sample) for i in order}
+            reports = {i: future.result() for i, future in futures.items()}
+    return [reports[i] for i in range(len(checks))]
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Check every implied foreign key in dognitiondb.")
+    p.add_argument("--url", default=DEFAULT_URL)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--sample", type=int, default=3, help="orphaned keys to show per check")
+    args = p.parse_args(argv)
+    started = time.perf_counter()
+    reports = scan(args.url, workers=args.workers, sample=args.sample)
+    elapsed = time.perf_counter() - started
+    print("%-30s %-18s %10s %8s %8s %8s %10s %7s" % (
+        "relationship", "references", "rows", "NULL", "orphans", "keys", "duplicates", "s"))
+    for report in reports:
+        c = report.check
+        print("%-30s %-18s %10d %8d %8d %8d %10d %7.2f" % (
+            "%s.%s" % (c.table, c.column), "%s.%s" % (c.ref_table, c.ref_column),
+            report.rows, report.nulls, report.orphans, report.orphan_keys,
+            report.duplicates, report.seconds))
+        for key in report.sample:
+            print("    %s" % (key,))
+    print("%d checks in %.2fs (largest %.2fs, all together %.2fs)" % (
+        len(reports), elapsed, max([r.seconds for r in reports] or [0]),
+        sum(r.seconds for r in reports)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""Pick the join order of comma joins from table statistics.
+
+Exercise 7 lists three tables and leaves the order to the server::
+
+    SELECT DISTINCT d.user_guid AS UserID, u.membership_type, d.dog_guid AS DogId, d.breed
+    FROM dogs d, users u, complete_tests c
+    WHERE d.dog_guid=c.dog_guid AND d.user_guid=u.user_guid AND d.breed="golden retriever";
+
+Only a few hundred dogs are golden retrievers, so the query is cheap when
+the breed filter is applied to ``dogs`` before the fan-out into
+``complete_tests``, and expensive when the server starts from
+``complete_tests``.  :func:`plan` estimates each table's rows after its own
+filters (:class:`dognition.stats.StatsCatalog`), tries every left-deep
+order that never needs a cross product, and keeps the one whose
+intermediate results add up to the fewest rows.  :meth:`JoinPlan.sql`
+writes the query back in that order with explicit joins, each table's
+filters moved into the ``ON`` clause of the step that reads it::
+
+    SELECT DISTINCT d.user_guid AS UserID, u.membership_type, d.dog_guid AS DogId, d.breed
+    FROM dogs d
+    STRAIGHT_JOIN users u ON d.user_guid = u.user_guid
+    STRAIGHT_JOIN complete_tests c ON d.dog_guid = c.dog_guid
+    WHERE d.breed = "golden retriever"
+
+``STRAIGHT_JOIN`` makes MySQL keep the order; on SQLite the same is done
+with ``CROSS JOIN``, and ``force=False`` writes plain ``JOIN``.  A
+``HAVING`` condition on a grouped column (``GROUP BY State HAVING
+state="NC"``) is moved into the ``WHERE`` clause first, so it filters
+rows before they are joined.  :func:`measure` counts the rows after each
+step on a real connection, to set against the estimates::
+
+    python -m dognition.joinorder --url sqlite:///dognition.db
+
+Only inner and comma joins of base tables are reordered; a query with an
+outer join or a derived table raises ``ValueError``.
+"""
+
+import argparse
+import itertools
+from collections import namedtuple
+
+from .cartesian import owner
+from .catalog import SchemaCatalog
+from .db import connect, dialect_of
+from .sqlquery import ParseError, parse
+from .sqltext import depths, identifier, keyword, significant, tokenize
+from .stats import DEFAULT_OTHER, StatsCatalog
+from .workload import extract
+
+MAX_TABLES = 7
+
+JOIN_KEYWORDS = {"mysql": "STRAIGHT_JOIN", "sqlite": "CROSS JOIN"}
+
+Step = namedtuple("Step", "table filters joins estimated")
+
+
+def _text(predicate):
+    return "(%s)" % predicate.text if predicate.kind == "other" else predicate.text
+
+
+def _label(table):
+    return "%s %s" % (table.name, table.alias) if table.alias else table.name
+
+
+def _sections(sql):
+    """Top-level clause texts of ``sql``, keyed by their first keyword."""
+    tokens = tokenize(sql)
+    depth = depths(tokens)
+    sig = significant(tokens)
+    while sig and sig[-1][1].text == ";":
+        sig.pop()
+    starts = []
+    for pos, (i, token) in enumerate(sig):
+        word = keyword(token)
+        if depth[i] != 0 or word not in ("SELECT", "FROM", "WHERE", "GROUP", "HAVING",
+                                         "ORDER", "LIMIT"):
+            continue
+        if word in ("GROUP", "ORDER") and (pos + 1 >= len(sig)
+                                           or keyword(sig[pos + 1][1]) != "BY"):
+            continue
+        if word == "SELECT" and starts:
+            continue
+        starts.append((word, i))
+    end = sig[-1][0] + 1 if sig else 0
+    found = {}
+    for n, (word, start) in enumerate(starts):
+        stop = starts[n + 1][1] if n + 1 < len(starts) else end
+        found[word] = "".join(t.text for t in tokens[start:stop]).strip()
+    return found
+
+
+def _bare(item):
+    """The column a SELECT item is, if it is nothing but a column."""
+    if item.aggregate or len(item.columns) != 1:
+        return None
+    ref = item.columns[0]
+    text = "%s.%s" % (ref.qualifier, ref.name) if ref.qualifier else ref.name
+    return ref if item.text.lower() == text.lower() else None
+
+
+def _pushable_having(query, schema):
+    """Split HAVING into conjuncts on grouped columns (renamed to the column) and the rest."""
+    aliases = {item.alias.lower(): _bare(item) for item in query.select if item.alias}
+    grouped = set()
+    for item in query.group_by:
+        for ref in item.columns:
+            target = aliases.get(ref.name.lower()) if ref.qualifier is None else None
+            grouped.add((target or ref).name.lower())
+    moved, kept = [], []
+    for predicate in query.having:
+        ref = predicate.columns[0] if len(predicate.columns) == 1 else None
+        target = None
+        if ref is not None and predicate.kind != "other" and "(" not in predicate.text:
+            target = aliases.get(ref.name.lower()) if ref.qualifier is None else None
+            if target is None and owner(query, ref, schema) is not None:
+                target = ref
+        if target is None or target.name.lower() not in grouped:
+            kept.append(predicate)
+            continue
+        name = "%s.%s" % (target.qualifier, target.name) if target.qualifier else target.name
+        moved.append(predicate._replace(columns=(target,), text=_rename(predicate.text, ref, name)))
+    return moved, kept
+
+
+def _rename(text, ref, name):
+    """``text`` with the column ``ref`` written as ``name``, on whichever side
+    of the operator it stands (``"NC" = state`` as well as ``state = "NC"``)."""
+    tokens = tokenize(text)
+    sig = significant(tokens)
+    for pos, (i, token) in enumerate(sig):
+        if (identifier(token) or "").lower() != ref.name.lower():
+            continue
+        dotted = pos >= 2 and sig[pos - 1][1].text == "."
+        if ref.qualifier is None and not dotted:
+            start = i
+        elif ref.qualifier is not None and dotted and \
+                (identifier(sig[pos - 2][1]) or "").lower() == ref.qualifier.lower():
+            start = sig[pos - 2][0]
+        else:
+            continue
+        return "".join(t.text for t in tokens[:start]) + name + \
+            "".join(t.text for t in tokens[i + 1:])
+    return text
+
+
+class JoinPlan:
+    """A join order for one query: ``steps`` in the order to read the tables.
+
+    ``residual`` holds the WHERE conjuncts no single step can take
+    (subqueries, conditions over three tables, an ``OR`` across tables),
+    ``having`` the HAVING conjuncts left in place, and ``original`` the
+    estimated rows of each step in the order the query was written
+    (``None`` if that order needs a cross product).
+    """
+
+    def __init__(self, query, sql, steps, residual, having, original):
+        self.query = query
+        self.text = sql
+        self.steps = steps
+        self.residual = residual
+        self.having = having
+        self.original = original
+
+    @property
+    def cost(self):
+        return sum(step.estimated for step in self.steps)
+
+    @property
+    def original_cost(self):
+        return sum(self.original) if self.original is not None else None
+
+    def from_clause(self, count=None, dialect="mysql", force=True):
+        """``FROM ... JOIN ...`` for the first ``count`` steps, with its WHERE conjuncts."""
+        steps = self.steps[:count or len(self.steps)]
+        joiner = JOIN_KEYWORDS.get(dialect, "JOIN") if force else "JOIN"
+        lines = ["FROM %s" % _label(steps[0].table)]
+        where = [_text(p) for p in steps[0].filters]
+        present = {id(step.table) for step in steps}
+        for step in steps[1:]:
+            conditions = [_text(p) for p in step.joins + step.filters]
+            if conditions:
+                lines.append("%s %s ON %s" % (joiner, _label(step.table),
+                                              " AND ".join(conditions)))
+            else:
+                lines.append("%s %s" % (joiner, _label(step.table)))
+        for predicate, tables in self.residual:
+            if all(id(t) in present for t in tables):
+                where.append(_text(predicate))
+        return "\n".join(lines), where
+
+    def sql(self, dialect="mysql", force=True):
+        """The query with the tables joined in plan order."""
+        sections = _sections(self.text)
+        head, where = self.from_clause(dialect=dialect, force=force)
+        parts = [sections["SELECT"], head]
+        if where:
+            parts.append("WHERE " + " AND ".join(where))
+        if "GROUP" in sections:
+            parts.append(sections["GROUP"])
+        if self.having:
+            parts.append("HAVING " + " AND ".join(p.text for p in self.having))
+        for word in ("ORDER", "LIMIT"):
+            if word in sections:
+                parts.append(sections[word])
+        return "\n".join(parts)
+
+
+def plan(sql, stats, catalog=None, keep_order=False):
+    """Return the cheapest :class:`JoinPlan` for ``sql`` under ``stats``.
+
+    With ``keep_order`` the plan keeps the tables in the order they are
+    written, cross products included, for comparing against.
+    """
+    try:
+        query = parse(sql)
+    except ParseError as exc:
+        raise ValueError("cannot plan %r: %s" % (sql, exc))
+    tables = query.tables
+    if len(tables) < 2:
+        raise ValueError("nothing to reorder: fewer than two tables")
+    if len(tables) > MAX_TABLES:
+        raise ValueError("more than %d tables" % MAX_TABLES)
+    for table in tables:
+        if table.subquery is not None or table.join not in ("from", "comma", "inner", "cross") \
+                or table.using or table.natural:
+            raise ValueError("only inner joins of base tables are reordered")
+        if stats.rows(table.name) is None:
+            raise ValueError("no statistics for %s" % table.name)
+    schema = {name: t.column_names for name, t in catalog.tables.items()} if catalog else None
+    moved, having = _pushable_having(query, schema)
+
+    local = [[] for _ in tables]
+    joins, residual = [], []
+    for predicate in query.predicates() + moved:
+        owners = {owner(query, ref, schema) for ref in predicate.columns}
+        if not owners or None in owners or "SELECT" in predicate.text.upper():
+            residual.append((predicate, list(tables)))
+        elif len(owners) == 1:
+            local[owners.pop()].append(predicate)
+        elif len(owners) == 2 and predicate.kind == "join":
+            joins.append((predicate, tuple(sorted(owners))))
+        else:
+            residual.append((predicate, [tables[i] for i in owners]))
+    sizes = [stats.estimate_rows(t.name, local[i]) for i, t in enumerate(tables)]
+
+    def step_rows(order):
+        """Estimated rows after each step of ``order`` and whether one is a cross product."""
+        rows, found, seen, cross = None, [], [], False
+        for index in order:
+            if rows is None:
+                rows = sizes[index]
+            else:
+                options = []
+                for predicate, pair in joins:
+                    if index in pair and (pair[0] in seen or pair[1] in seen):
+                        mine = pair.index(index)
+                        refs = predicate.columns
+                        ours = [r for r in refs if owner(query, r, schema) == index][0]
+                        theirs = [r for r in refs if r is not ours][0]
+                        other = pair[1 - mine]
+                        try:
+                            options.append(stats.join_rows(
+                                tables[other].name, theirs.name, tables[index].name,
+                                ours.name, rows, sizes[index]))
+                        except KeyError:
+                            options.append(rows * sizes[index] * DEFAULT_OTHER)
+                cross = cross or not options
+                rows = min(options) if options else rows * sizes[index]
+            seen.append(index)
+            found.append(rows)
+        return found, cross
+
+    original, cross = step_rows(range(len(tables)))
+    if cross:
+        original = None
+    best = None
+    orders = [range(len(tables))] if keep_order else itertools.permutations(range(len(tables)))
+    for order in orders:
+        rows, cross = step_rows(order)
+        if (keep_order or not cross) and (best is None or sum(rows) < sum(best[1])):
+            best = (order, rows)
+    if best is None:
+        raise ValueError("the tables are not all joined; see dognition.cartesian")
+    order, rows = best
+    steps, seen = [], []
+    for index, estimated in zip(order, rows):
+        linking = [p for p, pair in joins if index in pair
+                   and (pair[0] in seen or pair[1] in seen)]
+        steps.append(Step(tables[index], local[index], linking, int(round(estimated))))
+        seen.append(index)
+    return JoinPlan(query, sql, steps, residual, having,
+                    [int(round(r)) for r in original] if original else None)
+
+
+def optimize(sql, stats, catalog=None, dialect="mysql", force=True):
+    """``sql`` rewritten in its cheapest join order (see :func:`plan`)."""
+    return plan(sql, stats, catalog).sql(dialect, force)
+
+
+def measure(conn, join_plan):
+    """Actual rows after each step of ``join_plan``, counted on ``conn``."""
+    dialect = dialect_of(conn)
+    found = []
+    cursor = conn.cursor()
+    try:
+        for count in range(1, len(join_plan.steps) + 1):
+            head, where = join_plan.from_clause(count, dialect)
+            sql = "SELECT COUNT(*) %s%s" % (head, " WHERE " + " AND ".join(where)
+                                            if where else "")
+            cursor.execute(sql)
+            found.append(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+    return found
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Reorder the joins of exercise queries.")
+    p.add_argument("sql", nargs="*", help="statements (default: every exercise join)")
+    p.add_argument("--url", required=True,
+                   help="database to read statistics from and count rows on")
+    p.add_argument("--no-measure", action="store_true",
+                   help="print the estimates only")
+    args = p.parse_args(argv)
+    conn = connect(args.url)
+    try:
+        catalog = SchemaCatalog.load(conn)
+        stats = StatsCatalog.load(conn)
+        queries = [("", 0, s) for s in args.sql] or extract()
+        for script, line, sql in queries:
+            try:
+                found = plan(sql, stats, catalog)
+            except ValueError:
+                if args.sql:
+                    raise
+                continue
+            written = found.original_cost
+            print("%s:%d estimated rows %s as written, %d reordered" % (
+                script, line, "(cross product)" if written is None else written, found.cost))
+            print("    " + found.sql(dialect_of(conn)).replace("\n", "\n    "))
+            actual = [None] * len(found.steps) if args.no_measure else measure(conn, found)
+            for step, rows in zip(found.steps, actual):
+                print("    %-24s estimated %10d  actual %s" % (
+                    _label(step.table), step.estimated, "-" if rows is None else rows))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
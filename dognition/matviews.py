@@ -0,0 +1,357 @@
+"""Incrementally maintained rating aggregates, stored as tables.
+
+Exercise 5's ``SELECT test_name, AVG(rating) FROM reviews GROUP BY
+test_name`` and the per-dog ``AVG(rating), COUNT(rating) ... HAVING
+NumRatings >= 10 ORDER BY AvgRating DESC`` of Exercises 7 and 8 aggregate
+all of reviews on every run.  A :class:`MaterializedView` keeps the
+aggregate state, ``SUM(rating)``, ``COUNT(rating)`` and ``COUNT(*)`` per
+group, in a small table next to reviews::
+
+    mv_test_ratings  (test_name, rating_sum, num_ratings, num_rows, avg_rating)
+    mv_dog_ratings   (user_guid, dog_guid, rating_sum, num_ratings, num_rows, avg_rating)
+
+and :meth:`MaterializedView.refresh` applies only what changed since the
+last refresh, found through a watermark on ``created_at``/``updated_at``
+(kept in ``mv_watermarks``):
+
+- rows created after the watermark are added to their group's sums with
+  one ``UPDATE`` (or ``INSERT``) per group;
+- rows created earlier but updated after it may have had their rating
+  changed, so each group they belong to is recomputed from reviews.
+
+Deleted reviews leave no trace to find; :meth:`MaterializedView.rebuild`
+recomputes the whole view.  Queries then read the view, a few thousand
+rows, instead of grouping reviews::
+
+    python -m dognition.matviews create --url mysql://root@localhost/dognitiondb
+    python -m dognition.matviews refresh --url ...
+
+    SELECT user_guid, dog_guid, avg_rating, num_ratings FROM mv_dog_ratings
+    WHERE num_ratings >= 10 ORDER BY avg_rating DESC
+
+:func:`test_ratings` and :func:`dog_ratings` run the exercise queries that
+way.  Creating the tables needs the CREATE privilege, as
+:mod:`dognition.cleaned` needs ALTER.  An index on ``reviews.updated_at``
+(see :meth:`MaterializedView.index_ddl`) keeps the refresh from reading
+the whole of reviews to find the changes.
+"""
+
+import argparse
+import datetime
+from collections import namedtuple
+
+from .catalog import SchemaCatalog
+from .db import DEFAULT_URL, connect, dialect_of, placeholder, quote
+
+WATERMARKS = "mv_watermarks"
+# above this many changed groups a full rebuild is cheaper than recomputing each
+MAX_CHANGED_GROUPS = 500
+
+Delta = namedtuple("Delta", "inserted updated groups rebuilt")
+
+
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _latest(*values):
+    found = [str(v) for v in values if v is not None]
+    return max(found) if found else None
+
+
+class MaterializedView:
+    """``SUM``/``COUNT`` state of ``measure`` per ``keys`` group of ``table``."""
+
+    def __init__(self, name, table, keys, measure="rating",
+                 created="created_at", updated="updated_at"):
+        self.name = name
+        self.table = table
+        self.keys = tuple(keys)
+        self.measure = measure
+        self.created = created
+        self.updated = updated
+
+    def __repr__(self):
+        return "MaterializedView(%r, %r, %r)" % (self.name, self.table, self.keys)
+
+    @property
+    def columns(self):
+        return self.keys + ("rating_sum", "num_ratings", "num_rows", "avg_rating")
+
+    def ddl(self, dialect="mysql", types=None):
+        """``CREATE TABLE`` and ``CREATE INDEX`` for the view table."""
+        types = types or {}
+        number, real = ("INTEGER", "REAL") if dialect == "sqlite" else ("BIGINT", "DOUBLE")
+        default = "TEXT" if dialect == "sqlite" else "varchar(255)"
+        columns = ["%s %s" % (quote(k), types.get(k, default)) for k in self.keys]
+        columns += ["rating_sum %s" % real, "num_ratings %s NOT NULL" % number,
+                    "num_rows %s NOT NULL" % number, "avg_rating %s" % real]
+        return [
+            "CREATE TABLE %s (%s)" % (quote(self.name), ", ".join(columns)),
+            "CREATE INDEX %s ON %s (%s)" % (
+                quote(("ix_%s_keys" % self.name)[:64]), quote(self.name),
+                ", ".join(quote(k) for k in self.keys)),
+        ]
+
+    def index_ddl(self):
+        """Suggested index that lets :meth:`refresh` find changed rows quickly."""
+        return "CREATE INDEX %s ON %s (%s)" % (
+            quote(("ix_%s_%s" % (self.table, self.updated))[:64]),
+            quote(self.table), quote(self.updated))
+
+    def _aggregate_sql(self, where=""):
+        keys = ", ".join(quote(k) for k in self.keys)
+        measure = quote(self.measure)
+        return ("INSERT INTO %s (%s, rating_sum, num_ratings, num_rows, avg_rating) "
+                "SELECT %s, SUM(%s), COUNT(%s), COUNT(*), 1.0 * SUM(%s) / NULLIF(COUNT(%s), 0) "
+                "FROM %s%s GROUP BY %s" % (
+                    quote(self.name), keys, keys, measure, measure, measure, measure,
+                    quote(self.table), where, keys))
+
+    def _match(self, conn):
+        """``WHERE`` clause matching one group, NULL keys included."""
+        same = "IS" if dialect_of(conn) == "sqlite" else "<=>"
+        mark = placeholder(conn)
+        return " WHERE " + " AND ".join("%s %s %s" % (quote(k), same, mark)
+                                        for k in self.keys)
+
+    def exists(self, conn, catalog=None):
+        catalog = catalog or SchemaCatalog.fetch(conn)
+        return self.name in catalog.tables
+
+    def watermark(self, conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT watermark FROM %s WHERE view_name = %s"
+                           % (quote(WATERMARKS), placeholder(conn)), (self.name,))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        return row[0] if row else None
+
+    def _set_watermark(self, cursor, conn, watermark):
+        mark = placeholder(conn)
+        cursor.execute("DELETE FROM %s WHERE view_name = %s" % (quote(WATERMARKS), mark),
+                       (self.name,))
+        cursor.execute("INSERT INTO %s (view_name, watermark, refreshed_at) "
+                       "VALUES (%s, %s, %s)" % (quote(WATERMARKS), mark, mark, mark),
+                       (self.name, watermark, _now()))
+
+    def create(self, conn):
+        """Create the view table (and ``mv_watermarks``) and fill it."""
+        catalog = SchemaCatalog.fetch(conn)
+        dialect = dialect_of(conn)
+        source = catalog.tables[self.table]
+        types = {k: source.column(k).type for k in self.keys}
+        cursor = conn.cursor()
+        try:
+            if WATERMARKS not in catalog.tables:
+                cursor.execute("CREATE TABLE %s (view_name varchar(64) PRIMARY KEY, "
+                               "watermark varchar(32), refreshed_at varchar(32))"
+                               % quote(WATERMARKS))
+            for statement in self.ddl(dialect, types):
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+        conn.commit()
+        return self.rebuild(conn)
+
+    def drop(self, conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DROP TABLE IF EXISTS %s" % quote(self.name))
+            if WATERMARKS in SchemaCatalog.fetch(conn).tables:
+                cursor.execute("DELETE FROM %s WHERE view_name = %s"
+                               % (quote(WATERMARKS), placeholder(conn)), (self.name,))
+        finally:
+            cursor.close()
+        conn.commit()
+
+    def rebuild(self, conn):
+        """Recompute every group from scratch."""
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT MAX(%s), MAX(%s) FROM %s" % (
+                quote(self.created), quote(self.updated), quote(self.table)))
+            watermark = _latest(*cursor.fetchone())
+            cursor.execute("DELETE FROM %s" % quote(self.name))
+            cursor.execute(self._aggregate_sql())
+            groups = cursor.rowcount
+            self._set_watermark(cursor, conn, watermark)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        return Delta(None, None, groups, True)
+
+    def _changes(self, conn, since):
+        """Rows created or updated after ``since``: ``(inserted, updated, watermark)``.
+
+        ``inserted`` maps a group to ``[sum, ratings, rows]`` of its new rows,
+        ``updated`` is the set of groups with a row changed in place.
+        """
+        width = len(self.keys)
+        mark = placeholder(conn)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT %s, %s, %s, %s FROM %s WHERE %s > %s OR %s > %s" % (
+                ", ".join(quote(k) for k in self.keys), quote(self.measure),
+                quote(self.created), quote(self.updated), quote(self.table),
+                quote(self.created), mark, quote(self.updated), mark), (since, since))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        inserted, updated, watermark, count = {}, set(), since, 0
+        for row in rows:
+            key = tuple(row[:width])
+            value, created, changed = row[width:width + 3]
+            watermark = _latest(watermark, created, changed)
+            if created is not None and str(created) > since:
+                state = inserted.setdefault(key, [0, 0, 0])
+                if value is not None:
+                    state[0] += value
+                    state[1] += 1
+                state[2] += 1
+                count += 1
+            else:
+                updated.add(key)
+        return inserted, updated, watermark, count
+
+    def refresh(self, conn, max_changed=MAX_CHANGED_GROUPS):
+        """Apply the rows created or updated since the last refresh.
+
+        Returns a :class:`Delta`: the number of new rows and of groups
+        recomputed because a row changed, and how many groups were written.
+        """
+        since = self.watermark(conn)
+        if since is None:
+            return self.rebuild(conn)
+        inserted, updated, watermark, count = self._changes(conn, since)
+        if len(updated) > max_changed:
+            return self.rebuild(conn)
+        match = self._match(conn)
+        mark = placeholder(conn)
+        cursor = conn.cursor()
+        try:
+            for key in updated:
+                cursor.execute("DELETE FROM %s%s" % (quote(self.name), match), key)
+                cursor.execute(self._aggregate_sql(match), key)
+            for key, (total, ratings, rows) in inserted.items():
+                if key in updated:
+                    continue
+                if ratings:
+                    # avg_rating first: MySQL applies SET assignments left to right
+                    cursor.execute(
+                        "UPDATE %s SET avg_rating = 1.0 * (COALESCE(rating_sum, 0) + %s)"
+                        " / NULLIF(num_ratings + %s, 0), rating_sum = COALESCE(rating_sum, 0)"
+                        " + %s, num_ratings = num_ratings + %s, num_rows = num_rows + %s%s"
+                        % (quote(self.name), mark, mark, mark, mark, mark, match),
+                        (total, ratings, total, ratings, rows) + key)
+                else:
+                    # only NULL ratings: SUM stays NULL, as a rebuild leaves it
+                    cursor.execute("UPDATE %s SET num_rows = num_rows + %s%s"
+                                   % (quote(self.name), mark, match), (rows,) + key)
+                if cursor.rowcount == 0:
+                    cursor.execute(
+                        "INSERT INTO %s (%s) VALUES (%s)" % (
+                            quote(self.name), ", ".join(quote(c) for c in self.columns),
+                            ", ".join([mark] * len(self.columns))),
+                        key + (total if ratings else None, ratings, rows,
+                               float(total) / ratings if ratings else None))
+            self._set_watermark(cursor, conn, watermark)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        return Delta(count, len(updated), len(updated | set(inserted)), False)
+
+
+VIEWS = (
+    MaterializedView("mv_test_ratings", "reviews", ("test_name",)),
+    MaterializedView("mv_dog_ratings", "reviews", ("user_guid", "dog_guid")),
+)
+
+
+def view(name):
+    for found in VIEWS:
+        if found.name == name:
+            return found
+    raise KeyError("no materialized view %r (expected one of %s)"
+                   % (name, ", ".join(v.name for v in VIEWS)))
+
+
+def refresh_all(conn, views=VIEWS):
+    """Create missing views and refresh the rest; ``{name: Delta}``."""
+    catalog = SchemaCatalog.fetch(conn)
+    return {v.name: (v.refresh(conn) if v.exists(conn, catalog) else v.create(conn))
+            for v in views}
+
+
+def _fetch(conn, sql, params=()):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        return [d[0] for d in cursor.description], cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def test_ratings(conn):
+    """``SELECT test_name, AVG(rating) AS AVG_Rating FROM reviews GROUP BY test_name``."""
+    return _fetch(conn, "SELECT test_name, avg_rating AS AVG_Rating FROM mv_test_ratings "
+                        "ORDER BY test_name")
+
+
+def dog_ratings(conn, min_ratings=10, limit=200):
+    """Exercise 8's best-rated dogs with at least ``min_ratings`` ratings.
+
+    The view is joined to dogs for the breed columns before the LIMIT, so
+    groups with no row in dogs do not take up places, as in the exercise
+    query; ties on the average are broken by dog and user.
+    """
+    mark = placeholder(conn)
+    return _fetch(conn, (
+        "SELECT d.dog_guid AS DogID, d.user_guid AS UserID, v.avg_rating AS AvgRating, "
+        "v.num_ratings AS NumRatings, d.breed, d.breed_group, d.breed_type "
+        "FROM mv_dog_ratings v "
+        "JOIN dogs d ON d.dog_guid = v.dog_guid AND d.user_guid = v.user_guid "
+        "WHERE v.num_ratings >= %s "
+        "ORDER BY v.avg_rating DESC, v.dog_guid, v.user_guid LIMIT %d") % (mark, limit),
+        (min_ratings,))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Maintain the rating materialized views.")
+    p.add_argument("action", choices=("create", "refresh", "rebuild", "drop"))
+    p.add_argument("views", nargs="*", help="view names (default: all)")
+    p.add_argument("--url", default=DEFAULT_URL)
+    args = p.parse_args(argv)
+    views = [view(name) for name in args.views] or list(VIEWS)
+    conn = connect(args.url)
+    try:
+        for found in views:
+            if args.action == "drop":
+                found.drop(conn)
+                print("dropped %s" % found.name)
+                continue
+            if args.action == "refresh":
+                delta = found.refresh(conn)
+            elif args.action == "rebuild":
+                delta = found.rebuild(conn)
+            else:
+                delta = found.create(conn)
+            if delta.rebuilt:
+                print("%s: rebuilt, %d groups" % (found.name, delta.groups))
+            else:
+                print("%s: %d new rows, %d groups recomputed, %d groups written"
+                      % (found.name, delta.inserted, delta.updated, delta.groups))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Keyset (seek) pagination over dognitiondb tables.
+
+``LIMIT 1999, 20`` makes the server read and discard 1999 rows before it
+returns the page, so walking a table page by page costs O(N) per page.  A
+keyset paginator instead remembers the key of the last row it returned and
+asks for rows *after* that key, which an index on the key columns answers
+with a single seek no matter how deep the page is.
+
+The position is handed out as an opaque cursor token, so a notebook can
+keep the token from one cell and continue from it in another::
+
+    pager = KeysetPaginator(conn, "site_activities",
+                            columns=("activity_type", "created_at"))
+    page = pager.fetch()
+    page = pager.fetch(page.next_token)
+
+None of the dognitiondb tables declare a primary key, so the default key
+columns are the GUID/timestamp combinations that come closest to
+identifying a row.  Rows whose key values are fully identical are treated
+as one position: a page never ends inside such a group, so it can come
+back longer than ``page_size``; pass a longer ``key`` if that matters.
+NULL key values are handled explicitly and sort
+first, matching both MySQL and SQLite.  Binary key values (GUID columns
+after :mod:`dognition.guids` migrates them) round-trip through the token
+as bytes, so they compare as bytes again on the next page.
+"""
+
+import base64
+import json
+import zlib
+
+from .db import placeholder, quote
+
+DEFAULT_KEYS = {
+    "complete_tests": ("user_guid", "dog_guid", "created_at"),
+    "dogs": ("user_guid", "dog_guid"),
+    "exam_answers": ("dog_guid", "start_time", "script_detail_id"),
+    "reviews": ("user_guid", "dog_guid", "created_at"),
+    "site_activities": ("user_guid", "dog_guid", "created_at"),
+    "users": ("user_guid", "created_at"),
+}
+
+
+def _encode_value(value):
+    """JSON for a key value json cannot write: bytes (the binary GUIDs of
+    :mod:`dognition.guids`) as tagged hex, anything else as its string."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"x": bytes(value).hex()}
+    return str(value)
+
+
+def _decode_value(obj):
+    if set(obj) == {"x"}:
+        return bytes.fromhex(obj["x"])
+    return obj
+
+
+class Page:
+    """One page of rows plus the token for the page that follows it.
+
+    ``next_token`` is ``None`` on the last page.
+    """
+
+    def __init__(self, rows, next_token):
+        self.rows = rows
+        self.next_token = next_token
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __repr__(self):
+        return "<Page rows=%d last=%s>" % (len(self.rows), self.next_token is None)
+
+
+class KeysetPaginator:
+    """Walk ``table`` in key order, ``page_size`` rows at a time.
+
+    ``columns`` are the columns returned for each row (all columns when
+    omitted).  ``where`` is an optional SQL filter with ``params`` bound to
+    it, written with the connection's placeholder style.
+    """
+
+    def __init__(self, conn, table, columns=None, key=None, page_size=10,
+                 where=None, params=()):
+        if page_size < 1:
+            raise ValueError("page_size must be positive")
+        self.conn = conn
+        self.table = table
+        self.columns = tuple(columns) if columns else None
+        self.key = tuple(key or DEFAULT_KEYS.get(table, ()))
+        if not self.key:
+            raise ValueError("no default key for table %r; pass key=" % table)
+        self.page_size = page_size
+        self.where = where
+        self.params = tuple(params)
+        shape = "|".join((table, ",".join(self.key), where or ""))
+        self._shape = zlib.crc32(shape.encode("utf-8"))
+
+    def index_ddl(self):
+        """Return the CREATE INDEX statement that makes each page one seek."""
+        return "CREATE INDEX %s ON %s (%s)" % (
+            quote(("keyset_" + "_".join(self.key))[:64]),
+            quote(self.table),
+            ", ".join(quote(c) for c in self.key),
+        )
+
+    def encode_token(self, key_values):
+        payload = json.dumps({"s": self._shape, "k": list(key_values)},
+                             default=_encode_value, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+    def decode_token(self, token):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode("ascii")),
+                                 object_hook=_decode_value)
+            shape, values = payload["s"], payload["k"]
+        except (ValueError, KeyError, TypeError):
+            raise ValueError("malformed pagination token") from None
+        if shape != self._shape or len(values) != len(self.key):
+            raise ValueError("pagination token belongs to a different query")
+        return values
+
+    def _seek(self, values, upto=False):
+        """Build ``key > values`` (or ``key <= values``) in lexicographic order
+        with NULLs first."""
+        mark = placeholder(self.conn)
+
+        def after(column, value):
+            if value is None:
+                return "%s IS NOT NULL" % column, []
+            return "%s > %s" % (column, mark), [value]
+
+        def before(column, value, inclusive):
+            if value is None:
+                return ("%s IS NULL" % column if inclusive else "1 = 0"), []
+            return "(%s %s %s OR %s IS NULL)" % (
+                column, "<=" if inclusive else "<", mark, column), [value]
+
+        def equal(column, value):
+            if value is None:
+                return "%s IS NULL" % column, []
+            return "%s = %s" % (column, mark), [value]
+
+        # a > x OR (a = x AND (b > y OR (b = y AND c > z)))
+        columns = [quote(c) for c in self.key]
+        clause, params = None, []
+        for column, value in reversed(list(zip(columns, values))):
+            if upto:
+                gt_sql, gt_params = before(column, value, clause is None)
+            else:
+                gt_sql, gt_params = after(column, value)
+            if clause is None:
+                clause, params = gt_sql, gt_params
+                continue
+            eq_sql, eq_params = equal(column, value)
+            clause = "%s OR (%s AND (%s))" % (gt_sql, eq_sql, clause)
+            params = gt_params + eq_params + params
+        if values[0] is not None and len(columns) > 1:
+            # the redundant leading bound gives the optimizer a range to seek
+            if upto:
+                bound = "(%s <= %s OR %s IS NULL)" % (columns[0], mark, columns[0])
+            else:
+                bound = "%s >= %s" % (columns[0], mark)
+            clause = "%s AND (%s)" % (bound, clause)
+            params = [values[0]] + params
+        return clause, params
+
+    def _query(self, token, last=None):
+        """The rows after ``token``: up to ``page_size`` of them, or with
+        ``last`` every row up to and including the key ``last``."""
+        selected = self.key + (self.columns or ())
+        projection = ", ".join(quote(c) for c in selected)
+        if not self.columns:
+            projection += ", " + quote(self.table) + ".*"
+        conditions, params = [], []
+        if self.where:
+            conditions.append("(%s)" % self.where)
+            params.extend(self.params)
+        if token is not None:
+            clause, seek_params = self._seek(self.decode_token(token))
+            conditions.append("(%s)" % clause)
+            params.extend(seek_params)
+        if last is not None:
+            clause, seek_params = self._seek(last, upto=True)
+            conditions.append("(%s)" % clause)
+            params.extend(seek_params)
+        sql = "SELECT %s FROM %s" % (projection, quote(self.table))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY %s" % ", ".join(quote(c) for c in self.key)
+        if last is None:
+            sql += " LIMIT %d" % self.page_size
+        return sql, params
+
+    def _execute(self, sql, params):
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def fetch(self, token=None):
+        """Return the page after ``token`` (the first page when ``None``)."""
+        raw = self._execute(*self._query(token))
+        width = len(self.key)
+        next_token = None
+        if len(raw) == self.page_size:
+            # rows sharing the last key may continue past the LIMIT; the
+            # next page seeks past that key, so finish the group here
+            last = raw[-1][:width]
+            raw = self._execute(*self._query(token, last))
+            next_token = self.encode_token(last)
+        rows = [tuple(row[width:]) for row in raw]
+        return Page(rows, next_token)
+
+    def pages(self, token=None):
+        """Yield pages from ``token`` until the table is exhausted."""
+        while True:
+            page = self.fetch(token)
+            if page.rows:
+                yield page
+            if page.next_token is None:
+                return
+            token = page.next_token
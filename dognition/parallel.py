@@ -0,0 +1,449 @@
+"""Partitioned GROUP BY over a process pool.
+
+``SELECT state, zip, COUNT(DISTINCT user_guid) FROM users GROUP BY state,
+zip`` (Exercise 5) and the per-dog GROUP BYs of Exercises 7 and 8 have tens
+of thousands of groups, and the server builds each hash table on one core.
+:func:`execute` spreads the aggregation over ``workers`` processes::
+
+    columns, rows = execute("sqlite:///dognition.db",
+                            "SELECT dog_guid, COUNT(*) AS tests, COUNT(DISTINCT test_name) "
+                            "FROM complete_tests GROUP BY dog_guid "
+                            "HAVING tests >= 10 ORDER BY tests DESC", workers=4)
+
+The first table of the FROM clause is cut into ``n`` disjoint ranges of
+its rowid (SQLite) or integer primary key (MySQL), and each worker reads
+only its own range.  The server aggregates that range itself: the worker
+query groups by the keys (and by every ``COUNT(DISTINCT x)`` argument) and
+returns partial states, ``COUNT(*)``, ``SUM(x)``, ``MIN(x)``, ``MAX(x)``
+and ``SUM(x), COUNT(x)`` for ``AVG``, along with the distinct values of
+``x``.  The worker folds those rows into one state per group, and the
+parent merges the states of all workers: counts and sums add, MIN and MAX
+combine, AVG divides the merged sum by the merged count and COUNT
+DISTINCT unions its sets.  HAVING, ORDER BY and LIMIT are applied to the
+merged groups.  Every row is read once, by one worker, so the scan and the
+aggregation both divide by the number of workers; what grows with them is
+the merge, one state per group from each worker.  A MySQL table without an
+integer primary key (the dognitiondb tables declare none) cannot be split
+and runs as one worker.
+
+Supported: a single SELECT (joins included) whose items are GROUP BY
+expressions, other columns (MySQL returns any value of the group for
+those) or one of ``COUNT(*)``, ``COUNT([DISTINCT] x)``, ``SUM``, ``AVG``,
+``MIN`` and ``MAX``; HAVING conditions ``expression op constant`` joined
+by AND; ORDER BY and LIMIT on the output.  Text keys and DISTINCT values
+compare without regard to case, as in MySQL.  Anything else raises
+:class:`ValueError` from :func:`plan`.
+"""
+
+import argparse
+import concurrent.futures
+import operator
+import os
+
+from .db import DEFAULT_URL, connect, dialect_of, parse_url, quote
+from .sqlquery import AGGREGATES, ParseError, parse
+from .sqltext import depths, identifier, keyword, significant, string_value, tokenize
+
+FUNCTIONS = ("COUNT", "SUM", "AVG", "MIN", "MAX")
+# operator functions rather than lambdas: plans are pickled to the workers
+_COMPARE = {
+    "=": operator.eq, "<>": operator.ne, "!=": operator.ne,
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+}
+
+
+def _fold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+def _normal(text):
+    return " ".join(text.split()).lower()
+
+
+class Plan:
+    """A GROUP BY query split into partial aggregation and a merge.
+
+    ``keys`` are the GROUP BY expressions and ``aggregates`` ``(function,
+    distinct, expression)`` triples, ``function`` being one of
+    :data:`FUNCTIONS` or ``"ANY"``; :meth:`partial_sql` selects the keys
+    followed by the partial state of every aggregate.  ``outputs`` maps
+    each select item to ``("key", i)`` or ``("aggregate", j)``; ``having``
+    holds ``(output, operator, constant)`` tests, where outputs past the
+    select list are aggregates used only by HAVING.  ``table`` is the
+    table the workers split into key ranges, ``None`` if it cannot be split.
+    """
+
+    def __init__(self, columns, keys, aggregates, outputs, having, order, limit, offset,
+                 source, table, alias, where):
+        self.columns = columns
+        self.keys = keys
+        self.aggregates = aggregates
+        self.outputs = outputs
+        self.having = having
+        self.order = order
+        self.limit = limit
+        self.offset = offset
+        self.source = source
+        self.table = table
+        self.alias = alias
+        self.where = where
+
+    def partial_sql(self, condition=None):
+        """The per-worker query, with ``condition`` ANDed to its WHERE clause."""
+        fields, group = list(self.keys), list(self.keys)
+        for function, distinct, expression in self.aggregates:
+            if function == "COUNT" and distinct:
+                fields.append(expression)
+                if expression not in group:
+                    group.append(expression)
+            elif function == "COUNT":
+                fields.append("COUNT(%s)" % (expression or "*"))
+            elif function == "AVG":
+                fields.extend(("SUM(%s)" % expression, "COUNT(%s)" % expression))
+            else:
+                fields.append("%s(%s)" % ("MIN" if function == "ANY" else function,
+                                          expression))
+        where = [w for w in (self.where, condition) if w]
+        return "SELECT %s %s%s GROUP BY %s" % (
+            ", ".join(fields), self.source,
+            " WHERE " + " AND ".join("(%s)" % w for w in where) if where else "",
+            ", ".join(group))
+
+    def partial(self, rows):
+        """``{folded key: state}`` for an iterable of :meth:`partial_sql` rows."""
+        width = len(self.keys)
+        kinds = [(f, d) for f, d, _ in self.aggregates]
+        groups = {}
+        for row in rows:
+            key = tuple(map(_fold, row[:width]))
+            state = groups.get(key)
+            if state is None:
+                state = groups[key] = [row[:width]] + [_start(f, d) for f, d in kinds]
+            column = width
+            for slot, (function, distinct) in enumerate(kinds, 1):
+                value = row[column]
+                column += 1
+                if function == "COUNT" and distinct:
+                    if value is not None:
+                        state[slot].add(_fold(value))
+                elif function == "AVG":
+                    if row[column]:
+                        state[slot][0] += value
+                        state[slot][1] += row[column]
+                    column += 1
+                else:
+                    state[slot] = _combine(function, state[slot], value)
+        return groups
+
+    def merge(self, groups, other):
+        """Merge the states of ``other`` into ``groups`` (both from :meth:`partial`)."""
+        kinds = [(f, d) for f, d, _ in self.aggregates]
+        for key, theirs in other.items():
+            ours = groups.get(key)
+            if ours is None:
+                groups[key] = theirs
+                continue
+            for slot, (function, distinct) in enumerate(kinds, 1):
+                if function == "COUNT" and distinct:
+                    ours[slot] |= theirs[slot]
+                elif function == "AVG":
+                    ours[slot][0] += theirs[slot][0]
+                    ours[slot][1] += theirs[slot][1]
+                else:
+                    ours[slot] = _combine(function, ours[slot], theirs[slot])
+        return groups
+
+    def finish(self, groups):
+        """Output rows (select list only) of the groups that pass HAVING."""
+        rows = []
+        kinds = [(f, d) for f, d, _ in self.aggregates]
+        for state in groups.values():
+            values = [_result(f, d, s) for (f, d), s in zip(kinds, state[1:])]
+            row = [state[0][i] if kind == "key" else values[i] for kind, i in self.outputs]
+            if all(row[i] is not None and test(row[i], constant)
+                   for i, test, constant in self.having):
+                rows.append(tuple(row[:len(self.columns)]))
+        return rows
+
+    def arrange(self, rows):
+        """Apply ORDER BY and LIMIT to the finished rows."""
+        for index, descending in reversed(self.order):
+            rows.sort(key=lambda r: (r[index] is not None, _fold(r[index])),
+                      reverse=descending)
+        if self.limit is not None:
+            return rows[self.offset:self.offset + self.limit]
+        return rows[self.offset:]
+
+
+def _start(function, distinct):
+    if function == "COUNT":
+        return set() if distinct else 0
+    if function == "AVG":
+        return [0, 0]
+    return None
+
+
+def _combine(function, state, value):
+    """Fold a partial ``value`` of a non-distinct COUNT, SUM, MIN, MAX or ANY."""
+    if value is None:
+        return state
+    if state is None:
+        return value
+    if function in ("COUNT", "SUM"):
+        return state + value
+    if function == "MIN":
+        return value if value < state else state
+    if function == "MAX":
+        return value if value > state else state
+    return state
+
+
+def _result(function, distinct, state):
+    if function == "COUNT":
+        return len(state) if distinct else state
+    if function == "AVG":
+        return state[0] / state[1] if state[1] else None
+    return state
+
+
+def _call(text):
+    """``(function, distinct, argument)`` if ``text`` is one aggregate call."""
+    tokens = tokenize(text)
+    sig = significant(tokens)
+    if (len(sig) < 4 or keyword(sig[0][1]) not in FUNCTIONS + ("ANY_VALUE",)
+            or sig[1][1].text != "(" or sig[-1][1].text != ")"):
+        return None
+    level = depths(tokens)
+    if any(level[i] == level[sig[1][0]] and t.text == ")" for i, t in sig[2:-1]):
+        return None  # e.g. COUNT(a) + COUNT(b)
+    function = keyword(sig[0][1])
+    inner = sig[2:-1]
+    distinct = keyword(inner[0][1]) == "DISTINCT"
+    if distinct:
+        inner = inner[1:]
+    if not inner:
+        return None
+    if len(inner) == 1 and inner[0][1].text == "*":
+        return (function, False, None) if function == "COUNT" and not distinct else None
+    if distinct and function != "COUNT":
+        return None
+    argument = "".join(t.text for t in tokens[inner[0][0]:inner[-1][0] + 1])
+    if function == "ANY_VALUE":
+        function = "ANY"
+    return function, distinct, argument
+
+
+def _constant(text):
+    tokens = [t for _, t in significant(tokenize(text))]
+    negative = len(tokens) == 2 and tokens[0].text == "-"
+    if negative:
+        tokens = tokens[1:]
+    if len(tokens) != 1 or tokens[0].kind not in ("string", "number"):
+        raise ValueError("HAVING needs a constant on the right, not %r" % text)
+    if tokens[0].kind == "string":
+        return string_value(tokens[0])
+    value = float(tokens[0].text) if "." in tokens[0].text or "e" in tokens[0].text.lower() \
+        else int(tokens[0].text)
+    return -value if negative else value
+
+
+def _clauses(sql):
+    """``(FROM ... text, WHERE condition text or None)`` up to GROUP BY."""
+    tokens = tokenize(sql)
+    level = depths(tokens)
+    sig = significant(tokens)
+    marks = {}
+    for pos, (i, token) in enumerate(sig):
+        word = keyword(token)
+        if level[i] != 0 or word not in ("FROM", "WHERE", "GROUP") or word in marks:
+            continue
+        if word == "GROUP" and not (pos + 1 < len(sig) and keyword(sig[pos + 1][1]) == "BY"):
+            continue
+        marks[word] = i
+    if "FROM" not in marks or "GROUP" not in marks:
+        return None, None
+    end = marks["GROUP"]
+    if "WHERE" in marks:
+        return ("".join(t.text for t in tokens[marks["FROM"]:marks["WHERE"]]).strip(),
+                "".join(t.text for t in tokens[marks["WHERE"] + 1:end]).strip())
+    return "".join(t.text for t in tokens[marks["FROM"]:end]).strip(), None
+
+
+def plan(sql):
+    """Return the :class:`Plan` for ``sql``; raise ``ValueError`` if unsupported."""
+    try:
+        query = parse(sql)
+    except ParseError as e:
+        raise ValueError(str(e)) from None
+    if not query.group_by or query.distinct or query.unions:
+        raise ValueError("not a single GROUP BY query without DISTINCT or UNION")
+    first = query.tables[0]
+    if first.name is None:
+        raise ValueError("the first FROM item must be a table")
+    # a RIGHT JOIN keeps rows with no row of the first table, which no range holds
+    split = None if any(t.join == "right" for t in query.tables) else first.name
+    source, where = _clauses(sql)
+    if source is None:
+        raise ValueError("no FROM ... GROUP BY found")
+
+    aliases = {item.alias.lower(): item for item in query.select if item.alias}
+    keys = []
+    for item in query.group_by:
+        if item.position is not None:
+            if not 1 <= item.position <= len(query.select):
+                raise ValueError("GROUP BY position %d is out of range" % item.position)
+            text = query.select[item.position - 1].text
+        else:
+            bare = _normal(item.text)
+            text = aliases[bare].text if bare in aliases else item.text
+        if _call(text) is not None:
+            raise ValueError("cannot group by an aggregate: %s" % item.text)
+        keys.append(text)
+    normal_keys = [_normal(k) for k in keys]
+
+    aggregates, outputs, columns = [], [], []
+
+    def output_for(text):
+        if _normal(text) in normal_keys:
+            return ("key", normal_keys.index(_normal(text)))
+        call = _call(text)
+        if call is None:
+            words = [keyword(t) for _, t in significant(tokenize(text))]
+            if AGGREGATES.intersection(words):
+                raise ValueError("only a single %s call is supported: %s"
+                                 % ("/".join(FUNCTIONS), text))
+            call = ("ANY", False, text)
+        aggregates.append(call)
+        return ("aggregate", len(aggregates) - 1)
+
+    for item in query.select:
+        if item.text == "*" or item.text.endswith(".*"):
+            raise ValueError("SELECT * cannot be grouped")
+        outputs.append(output_for(item.text))
+        columns.append(item.alias or item.text)
+
+    names = [_normal(c) for c in columns]
+    having = []
+    for predicate in query.having:
+        tokens = tokenize(predicate.text)
+        level = depths(tokens)
+        cut = [i for i, t in enumerate(tokens) if level[i] == 0 and t.text in _COMPARE]
+        if predicate.kind not in ("eq", "ne", "range", "other") or len(cut) != 1:
+            raise ValueError("unsupported HAVING condition: %s" % predicate.text)
+        left = "".join(t.text for t in tokens[:cut[0]]).strip()
+        right = "".join(t.text for t in tokens[cut[0] + 1:]).strip()
+        if _normal(left) in names:
+            index = names.index(_normal(left))
+        else:
+            outputs.append(output_for(left))
+            index = len(outputs) - 1
+        having.append((index, _COMPARE[tokens[cut[0]].text], _constant(right)))
+
+    order = []
+    for item in query.order_by:
+        if item.position is not None:
+            if not 1 <= item.position <= len(columns):
+                raise ValueError("ORDER BY position %d is out of range" % item.position)
+            index = item.position - 1
+        elif _normal(item.text) in names:
+            index = names.index(_normal(item.text))
+        elif _normal(item.text) in [_normal(i.text) for i in query.select]:
+            index = [_normal(i.text) for i in query.select].index(_normal(item.text))
+        else:
+            tokens = [t for _, t in significant(tokenize(item.text))]
+            bare = identifier(tokens[-1]) if tokens else None
+            matches = [i for i, c in enumerate(columns)
+                       if bare and _normal(c).split(".")[-1] == bare.lower()]
+            if len(matches) != 1:
+                raise ValueError("ORDER BY %s is not an output column" % item.text)
+            index = matches[0]
+        order.append((index, item.descending))
+    return Plan(columns, keys, aggregates, outputs, having, order, query.limit,
+                query.offset or 0, source, split, first.alias, where)
+
+
+def _ranges(conn, found, workers):
+    """Up to ``workers`` WHERE conditions splitting the first table into
+    disjoint key ranges, or ``[None]`` when it has no key to split on."""
+    if found.table is None:
+        return [None]
+    name = quote(found.alias or found.table)
+    if dialect_of(conn) == "sqlite":
+        column = "rowid"
+    else:
+        cursor = conn.cursor()
+        cursor.execute("SHOW KEYS FROM %s WHERE Key_name = 'PRIMARY'" % quote(found.table))
+        keys = cursor.fetchall()
+        cursor.close()
+        if len(keys) != 1:
+            return [None]
+        column = quote(keys[0][4])
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(%s), MAX(%s) FROM %s" % (column, column, quote(found.table)))
+    low, high = cursor.fetchone()
+    cursor.close()
+    if not isinstance(low, int) or not isinstance(high, int):
+        return [None]
+    step = (high - low) // workers + 1
+    return ["%s.%s BETWEEN %d AND %d" % (name, column, start, min(start + step - 1, high))
+            for start in range(low, high + 1, step)]
+
+
+def _partition(url, sql, params, found):
+    """Aggregate one key range in a worker; return its partial states."""
+    conn = connect(url)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        groups = found.partial(cursor)
+        cursor.close()
+    finally:
+        conn.close()
+    return groups
+
+
+def execute(url, sql, params=(), workers=None):
+    """Run the GROUP BY ``sql`` on ``workers`` processes; return ``(columns, rows)``.
+
+    ``url`` must name a database each worker can open by itself: a SQLite
+    file or a MySQL server.  With one worker, or a table that cannot be
+    split, everything runs in this process.
+    """
+    found = plan(sql)
+    workers = workers or os.cpu_count() or 1
+    if parse_url(url)["database"] == ":memory:":
+        raise ValueError("workers cannot open an in-memory database; use a file")
+    params = tuple(params)
+    ranges = [None]
+    if workers > 1:
+        conn = connect(url)
+        try:
+            ranges = _ranges(conn, found, workers)
+        finally:
+            conn.close()
+    if len(ranges) == 1:
+        groups = _partition(url, found.partial_sql(ranges[0]), params, found)
+        return found.columns, found.arrange(found.finish(groups))
+    with concurrent.futures.ProcessPoolExecutor(len(ranges)) as pool:
+        parts = [pool.submit(_partition, url, found.partial_sql(condition), params, found)
+                 for condition in ranges]
+        groups = {}
+        for part in parts:
+            found.merge(groups, part.result())
+    return found.columns, found.arrange(found.finish(groups))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Run a GROUP BY query on several processes.")
+    p.add_argument("sql")
+    p.add_argument("--url", default=DEFAULT_URL)
+    p.add_argument("--workers", type=int, default=None)
+    args = p.parse_args(argv)
+    columns, rows = execute(args.url, args.sql, workers=args.workers)
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join("NULL" if v is None else str(v) for v in row))
+
+
+if __name__ == "__main__":
+    main()
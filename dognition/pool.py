@@ -0,0 +1,242 @@
+"""Process-wide connection pool for dognitiondb.
+
+Every exercise notebook opens its own connection (``%sql mysql://...``
+followed by ``USE dognitiondb``), so running the ten exercises back to back
+pays the connect and auth handshake ten times.  :func:`get_pool` returns
+one pool per database URL for the whole process; connections are handed
+out with :meth:`ConnectionPool.acquire` and go back to the pool when they
+are closed::
+
+    with get_pool().acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM dogs")
+
+The pool never holds more than ``max_size`` connections.  A connection that
+has been idle for longer than ``ping_interval`` seconds is health-checked
+before it is handed out and replaced if the check fails.  When a
+connection is returned its open transaction is rolled back and, on MySQL,
+its session is reset through the driver's ``reset_connection()``
+(mysqlclient), which clears user variables, temporary tables and ``SET
+SESSION`` changes but keeps the login and default database.  A driver
+without that call (PyMySQL has no public one) cannot hand a clean session
+to the next borrower, so its connection is closed on return and the next
+:meth:`ConnectionPool.acquire` opens a fresh one; the pool still bounds
+the connections and health-checks them, but only saves the handshake with
+mysqlclient.
+"""
+
+import atexit
+import threading
+import time
+
+from .db import DEFAULT_URL, connect, dialect_of
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the acquire timeout."""
+
+
+class PooledConnection:
+    """A pooled DB-API connection; ``close()`` returns it to the pool."""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self.raw = raw
+        self.dialect = dialect_of(raw)
+
+    def __getattr__(self, name):
+        if self.raw is None:
+            raise RuntimeError("connection was returned to the pool")
+        return getattr(self.raw, name)
+
+    def cursor(self, *args):
+        if self.raw is None:
+            raise RuntimeError("connection was returned to the pool")
+        return self.raw.cursor(*args)
+
+    def close(self):
+        if self.raw is not None:
+            raw, self.raw = self.raw, None
+            self._pool._release(raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool:
+    """A bounded pool of connections to one database.
+
+    ``factory`` creates a new raw connection; it defaults to
+    ``connect(url)``.  ``reset_statements`` are run on every connection
+    after it has been reset, for session settings the exercises rely on.
+    """
+
+    def __init__(self, url=DEFAULT_URL, max_size=4, ping_interval=30.0,
+                 timeout=30.0, factory=None, reset_statements=()):
+        if max_size < 1:
+            raise ValueError("max_size must be positive")
+        self.url = url
+        self.max_size = max_size
+        self.ping_interval = ping_interval
+        self.timeout = timeout
+        self.reset_statements = tuple(reset_statements)
+        self._factory = factory or (lambda: connect(url))
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.stats = {"created": 0, "reused": 0, "discarded": 0}
+
+    @property
+    def size(self):
+        """Number of open connections, idle or in use."""
+        return self._size
+
+    def acquire(self, timeout=None):
+        """Return a :class:`PooledConnection`, waiting up to ``timeout`` seconds."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            raw, last_used = self._checkout(deadline)
+            if raw is None:
+                try:
+                    raw = self._factory()
+                except Exception:
+                    self._forget()
+                    raise
+                self.stats["created"] += 1
+                return PooledConnection(self, raw)
+            if (time.monotonic() - last_used < self.ping_interval
+                    or _is_healthy(raw)):
+                self.stats["reused"] += 1
+                return PooledConnection(self, raw)
+            _close_quietly(raw)
+            self.stats["discarded"] += 1
+            self._forget()
+
+    def _checkout(self, deadline):
+        """Take an idle connection, or reserve a slot for a new one."""
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("connection pool is closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        "no connection available after waiting; all %d in use"
+                        % self.max_size)
+                self._cond.wait(remaining)
+
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _release(self, raw):
+        try:
+            if not _reset_session(raw):
+                raise RuntimeError("the driver cannot reset the session")
+            for statement in self.reset_statements:
+                cursor = raw.cursor()
+                cursor.execute(statement)
+                cursor.close()
+        except Exception:
+            _close_quietly(raw)
+            self.stats["discarded"] += 1
+            self._forget()
+            return
+        with self._cond:
+            if self._closed:
+                _close_quietly(raw)
+                self._size -= 1
+                return
+            self._idle.append((raw, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        """Close idle connections; in-use ones are closed when released."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for raw, _ in idle:
+            _close_quietly(raw)
+
+
+def _is_healthy(raw):
+    try:
+        if hasattr(raw, "ping") and dialect_of(raw) == "mysql":
+            raw.ping(False)
+        else:
+            cursor = raw.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+def _reset_session(raw):
+    """Roll back and clear the session; ``False`` if the driver cannot clear it."""
+    raw.rollback()
+    if dialect_of(raw) != "mysql":
+        return True
+    reset = getattr(raw, "reset_connection", None)
+    if not callable(reset):
+        return False
+    reset()
+    return True
+
+
+def _close_quietly(raw):
+    try:
+        raw.close()
+    except Exception:
+        pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(url=DEFAULT_URL, **options):
+    """Return the process-wide pool for ``url``, creating it on first use.
+
+    ``options`` are passed to :class:`ConnectionPool` when the pool is
+    created and ignored afterwards; use :func:`configure` to replace a pool.
+    """
+    with _pools_lock:
+        pool = _pools.get(url)
+        if pool is None:
+            pool = _pools[url] = ConnectionPool(url, **options)
+        return pool
+
+
+def configure(url=DEFAULT_URL, **options):
+    """Create (or replace) the process-wide pool for ``url``."""
+    with _pools_lock:
+        old = _pools.get(url)
+        pool = _pools[url] = ConnectionPool(url, **options)
+    if old is not None:
+        old.close()
+    return pool
+
+
+@atexit.register
+def close_all():
+    """Close every process-wide pool."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
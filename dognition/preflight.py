@@ -0,0 +1,484 @@
+"""Check queries locally before they are sent to the server.
+
+Exercise 6 is a tour of queries that fail or mislead: a trailing comma
+before FROM, ``SELECT breed_type, COUNT(...), weight ... GROUP BY
+breed_type``, ``GROUP BY test_name`` while selecting
+``MONTH(created_at)``.  Each mistake costs a round trip to find out, and
+on a server without ``ONLY_FULL_GROUP_BY`` the second and third run the
+whole aggregation and return an arbitrary ``weight`` or month per group.
+:func:`check` finds them without contacting the server::
+
+    report = check(sql, catalog=SchemaCatalog.load(conn), stats=StatsCatalog.load(conn))
+    report.problems     # [Problem('error', 'group_by', "weight is not in GROUP BY ...")]
+    report.cost         # Cost(scanned=35050, joined=35050, rows=4)
+
+It reports
+
+* ``syntax``: statements :func:`dognition.sqlquery.parse` rejects (stray
+  commas, unbalanced parentheses, clauses out of order, ...);
+* ``table`` and ``column``: names the cached :class:`SchemaCatalog` does
+  not know, and unqualified columns that more than one table has;
+* ``group_by``: select-list and ORDER BY expressions that are neither
+  aggregated nor determined by the GROUP BY columns (or by a unique key
+  among them, or by a ``column = constant`` filter), as MySQL's
+  ``ONLY_FULL_GROUP_BY`` does.  They are errors when the server has that
+  SQL mode (:func:`full_group_by` asks it) and warnings otherwise;
+
+and, given :class:`dognition.stats.StatsCatalog` statistics, a
+:class:`Cost`: the rows read from the tables, the rows the FROM clause
+produces before grouping, and the rows returned.
+:func:`preflight` is the runner preprocessor: it raises
+:class:`PreflightError` for any error, or when the estimate reads more
+than ``max_scanned`` rows, so the query is recorded as failed and never
+sent.  Statements other than SELECT pass through unchecked.
+"""
+
+import argparse
+from collections import namedtuple
+
+from .catalog import SchemaCatalog
+from .db import connect, dialect_of
+from .sqlquery import AGGREGATES, ParseError, parse
+from .sqltext import depths, is_significant, keyword, significant, split_statements, tokenize
+from .stats import DEFAULT_OTHER, StatsCatalog
+from .workload import extract
+
+Problem = namedtuple("Problem", "severity code message")
+Cost = namedtuple("Cost", "scanned joined rows")
+
+
+class Report:
+    """The problems found in one statement, and its estimated cost."""
+
+    def __init__(self, sql, problems=(), cost=None):
+        self.sql = sql
+        self.problems = list(problems)
+        self.cost = cost
+
+    @property
+    def errors(self):
+        return [p for p in self.problems if p.severity == "error"]
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def __repr__(self):
+        return "<Report problems=%d cost=%s>" % (len(self.problems), self.cost)
+
+
+class PreflightError(ValueError):
+    """A query :func:`preflight` refused to send; ``report`` says why."""
+
+    def __init__(self, report, message):
+        super().__init__(message)
+        self.report = report
+
+
+def _normal(text):
+    return " ".join(text.split()).lower()
+
+
+def _is_select(sql):
+    sig = significant(tokenize(sql))
+    return bool(sig) and (keyword(sig[0][1]) == "SELECT" or sig[0][1].text == "(")
+
+
+def _without_aggregates(text):
+    """``text`` with every aggregate call replaced by ``0``."""
+    tokens = tokenize(text)
+    level = depths(tokens)
+    sig = significant(tokens)
+    kept, i = [], 0
+    for pos, (index, token) in enumerate(sig):
+        if index < i:
+            continue
+        nxt = sig[pos + 1][1] if pos + 1 < len(sig) else None
+        if keyword(token) in AGGREGATES and nxt is not None and nxt.text == "(":
+            start = sig[pos + 1][0]
+            end = next(j for j in range(start + 1, len(tokens))
+                       if tokens[j].text == ")" and level[j] == level[start])
+            kept.append("0")
+            i = end + 1
+            continue
+        kept.append(token.text)
+    return " ".join(kept)
+
+
+def _bare_columns(text):
+    """Column references of ``text`` that are outside aggregate calls."""
+    try:
+        return parse("SELECT " + _without_aggregates(text)).select[0].columns
+    except (ParseError, IndexError):
+        return []
+
+
+class _Scope:
+    """The tables visible in one query block: ``{alias: lower-cased columns or None}``."""
+
+    def __init__(self, query, catalog, outer=None):
+        self.outer = outer
+        self.tables = {}
+        self.unknown_tables = []
+        self.using = set()
+        for table in query.tables:
+            key = (table.alias or table.name).lower()
+            self.using.update(c.lower() for c in table.using)
+            if table.natural:
+                self.using.add("*")
+            if table.subquery is not None:
+                self.tables[key] = _output_names(table.subquery)
+            elif catalog is None:
+                self.tables[key] = None
+            elif table.name in catalog:
+                self.tables[key] = {c.lower() for c in catalog[table.name].column_names}
+            else:
+                self.unknown_tables.append(table.name)
+                self.tables[key] = None
+
+    def find(self, ref):
+        """``None`` when ``ref`` resolves, else a description of the problem."""
+        scope = self
+        while scope is not None:
+            if ref.qualifier is not None:
+                columns = scope.tables.get(ref.qualifier.lower(), False)
+                if columns is not False:
+                    if columns is None or ref.name.lower() in columns:
+                        return None
+                    return "unknown column %s.%s" % (ref.qualifier, ref.name)
+            else:
+                if any(columns is None for columns in scope.tables.values()):
+                    return None
+                owners = [a for a, columns in scope.tables.items() if ref.name.lower() in columns]
+                if len(owners) > 1 and not ({ref.name.lower(), "*"} & scope.using):
+                    return "column %s is ambiguous (in %s)" % (ref.name, ", ".join(owners))
+                if owners:
+                    return None
+            scope = scope.outer
+        if ref.qualifier is not None:
+            return "unknown table or alias %s in %s.%s" % (ref.qualifier, ref.qualifier, ref.name)
+        return "unknown column %s" % ref.name
+
+
+def _output_names(query):
+    """Lower-cased output column names of a derived table, or ``None`` if unknown."""
+    names = set()
+    for item in query.select:
+        if item.alias:
+            names.add(item.alias.lower())
+        elif item.text == "*" or item.text.endswith(".*"):
+            return None
+        else:
+            names.add(item.text.split(".")[-1].strip("`").lower())
+    return names
+
+
+def _check_names(query, catalog, problems, outer=None):
+    scope = _Scope(query, catalog, outer)
+    for name in scope.unknown_tables:
+        problems.append(Problem("error", "table", "unknown table %s" % name))
+    aliases = set(query.select_aliases)
+    refs = [(ref, False) for item in query.select for ref in item.columns]
+    refs += [(ref, False) for predicate in query.predicates() for ref in predicate.columns]
+    refs += [(ref, True) for item in query.group_by + query.order_by for ref in item.columns]
+    refs += [(ref, True) for predicate in query.having for ref in predicate.columns]
+    seen = set()
+    for ref, alias_ok in refs:
+        if alias_ok and ref.qualifier is None and ref.name.lower() in aliases:
+            continue
+        problem = scope.find(ref)
+        if problem is not None and problem not in seen:
+            seen.add(problem)
+            problems.append(Problem("error", "column", problem))
+    for table in query.tables:
+        if table.subquery is not None:
+            _check_names(table.subquery, catalog, problems, outer)
+    for sub in query.subqueries:
+        _check_names(sub, catalog, problems, scope)
+    for sub in query.unions:
+        _check_names(sub, catalog, problems, outer)
+
+
+def _key(query, ref, catalog):
+    table = query.resolve(ref, _schema(catalog))
+    return (table.lower() if table else None, ref.name.lower())
+
+
+def _schema(catalog):
+    if catalog is None:
+        return None
+    return {name: table.column_names for name, table in catalog.tables.items()}
+
+
+def _determined(query, catalog):
+    """Column keys fixed within a group: grouped, ``= constant`` or via a unique key."""
+    keys = set()
+    for item in query.group_by:
+        if item.position is not None:
+            columns = query.select[item.position - 1].columns
+        else:
+            alias = query.select_aliases.get(_normal(item.text))
+            columns = alias.columns if alias is not None else item.columns
+        keys.update(_key(query, ref, catalog) for ref in columns)
+    for predicate in query.where:
+        if predicate.kind == "eq" and predicate.value is not None:
+            keys.add(_key(query, predicate.columns[0], catalog))
+    # inner-join equalities carry a fixed value over to the other column
+    equal = [p for p in query.where if p.kind == "join" and p.op == "="]
+    for table in query.tables:
+        if table.join in ("from", "comma", "inner", "cross"):
+            equal += [p for p in table.condition if p.kind == "join" and p.op == "="]
+    equal = [[_key(query, ref, catalog) for ref in p.columns] for p in equal]
+    unique = {}
+    if catalog is not None:
+        for table in query.tables:
+            found = catalog.table(table.name) if table.name else None
+            if found is not None:
+                unique[table.name.lower()] = (
+                    [ix.columns for ix in found.indexes if ix.unique]
+                    + [[c.name] for c in found.columns if c.key == "PRI"], found.column_names)
+    while True:
+        before = len(keys)
+        for left, right in equal:
+            if left in keys or right in keys:
+                keys.update((left, right))
+        for owner, (indexes, columns) in unique.items():
+            if any(cols and all((owner, c.lower()) in keys for c in cols) for cols in indexes):
+                keys.update((owner, c.lower()) for c in columns)
+        if len(keys) == before:
+            return keys
+
+
+def _check_group_by(query, catalog, problems, severity="error"):
+    for block in query.walk():
+        if not block.is_aggregate:
+            continue
+        grouped_text = set()
+        for item in block.group_by:
+            if item.position is not None:
+                grouped_text.add(_normal(block.select[item.position - 1].text))
+            else:
+                alias = block.select_aliases.get(_normal(item.text))
+                grouped_text.add(_normal(alias.text if alias is not None else item.text))
+        determined = _determined(block, catalog)
+        names = {name for _, name in determined}
+
+        def loose(text):
+            if _normal(text) in grouped_text:
+                return []
+            found = []
+            for ref in _bare_columns(text):
+                key = _key(block, ref, catalog)
+                if key in determined or (key[0] is None and key[1] in names):
+                    continue
+                label = "%s.%s" % (ref.qualifier, ref.name) if ref.qualifier else ref.name
+                if label not in found:
+                    found.append(label)
+            return found
+
+        clause = "GROUP BY %s" % ", ".join(i.text for i in block.group_by) \
+            if block.group_by else "an aggregate query without GROUP BY"
+        for number, item in enumerate(block.select, 1):
+            for label in loose(item.text):
+                problems.append(Problem(severity, "group_by", (
+                    "%s (select item %d) is neither aggregated nor in %s; the server "
+                    "rejects it under ONLY_FULL_GROUP_BY or returns one arbitrary value "
+                    "per group" % (label, number, clause))))
+        aliases = set(block.select_aliases)
+        for item in block.order_by:
+            if item.position is not None or _normal(item.text) in aliases:
+                continue
+            for label in loose(item.text):
+                problems.append(Problem(severity, "group_by", (
+                    "ORDER BY %s uses %s, which is neither aggregated nor in %s"
+                    % (item.text, label, clause))))
+
+
+def estimate(query, stats, catalog=None):
+    """A :class:`Cost` for ``query`` from column statistics, or ``None``.
+
+    Each table is read in full unless a filter column leads one of its
+    indexes; the join keeps ``|L| * |R| / max(ndv)`` rows per equi-join
+    (a cross product where there is none), GROUP BY and DISTINCT keep at
+    most the product of the grouped columns' distinct counts, and LIMIT
+    caps the result.
+    """
+    schema = _schema(catalog)
+    scanned, rows, joined = 0.0, None, []
+    predicates = query.predicates()
+    for table in query.tables:
+        if table.subquery is not None:
+            inner = estimate(table.subquery, stats, catalog)
+            if inner is None:
+                return None
+            scanned += inner.scanned
+            size = inner.rows
+        else:
+            base = stats.rows(table.name) if table.name else None
+            if base is None:
+                return None
+            local = [p for p in predicates if p.kind != "join" and p.columns
+                     and all(query.resolve(ref, schema) == table.name for ref in p.columns)]
+            size = stats.estimate_rows(table.name, local)
+            found = catalog.table(table.name) if catalog is not None else None
+            indexed = found.indexed_prefixes() if found is not None else set()
+            usable = [p for p in local if p.kind in ("eq", "in", "range", "null")
+                      and p.columns[0].name.lower() in indexed]
+            scanned += size if usable else base
+        if rows is None:
+            rows = float(size)
+        else:
+            rows = _join(query, stats, schema, joined, table, rows, size, predicates)
+        joined.append(table)
+    if rows is None:
+        return Cost(0, 1, 1)
+    joined_rows = rows
+    if query.group_by or query.distinct:
+        items = query.group_by or query.select
+        rows = min(rows, _distinct(query, stats, schema, items, rows))
+    elif query.is_aggregate:
+        rows = 1.0
+    if query.limit is not None:
+        rows = min(rows, query.limit)
+    return Cost(int(round(scanned)), int(round(joined_rows)), int(round(rows)))
+
+
+def _join(query, stats, schema, joined, table, rows, size, predicates):
+    names = {t.name for t in joined if t.name}
+    if (table.using or table.natural) and table.name and schema is not None:
+        # USING (c) or NATURAL: equal columns of the same name; the most
+        # selective one stands for all of them
+        mine = {c.lower() for c in schema.get(table.name, ())}
+        shared = {c.lower() for c in table.using} if table.using else mine
+        found = []
+        for other in joined:
+            theirs = {c.lower() for c in schema.get(other.name, ())} if other.name else set()
+            for column in sorted(shared & mine & theirs):
+                try:
+                    found.append(stats.join_rows(other.name, column, table.name, column,
+                                                 rows, size))
+                except KeyError:
+                    found.append(rows * size * DEFAULT_OTHER)
+        if found:
+            return min(found)
+    for predicate in predicates:
+        if predicate.kind != "join":
+            continue
+        owners = [query.resolve(ref, schema) for ref in predicate.columns]
+        for mine, other in ((0, 1), (1, 0)):
+            if owners[mine] == table.name and owners[other] in names:
+                try:
+                    return stats.join_rows(
+                        owners[other], predicate.columns[other].name,
+                        table.name, predicate.columns[mine].name, rows, size)
+                except KeyError:
+                    return rows * size * DEFAULT_OTHER
+    return rows * size
+
+
+def _distinct(query, stats, schema, items, rows):
+    product = 1.0
+    for item in items:
+        columns = item.columns
+        if getattr(item, "position", None) is not None:
+            columns = query.select[item.position - 1].columns
+        for ref in columns:
+            table = query.resolve(ref, schema)
+            try:
+                product *= max(1, stats.column(table, ref.name).distinct)
+            except KeyError:
+                return rows
+            if product >= rows:
+                return rows
+    return product
+
+
+def full_group_by(conn):
+    """Whether the server runs with ``ONLY_FULL_GROUP_BY`` (SQLite never does)."""
+    if dialect_of(conn) == "sqlite":
+        return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT @@SESSION.sql_mode")
+        mode = cursor.fetchone()[0] or ""
+    finally:
+        cursor.close()
+    if isinstance(mode, bytes):
+        mode = mode.decode("ascii")
+    return "ONLY_FULL_GROUP_BY" in mode.upper().split(",")
+
+
+def check(sql, catalog=None, stats=None, only_full_group_by=True):
+    """Return the :class:`Report` for one statement.
+
+    With ``only_full_group_by`` false, as on servers without that SQL
+    mode, loosely grouped columns are warnings rather than errors.
+    """
+    report = Report(sql)
+    if not _is_select(sql):
+        return report
+    try:
+        query = parse(sql)
+    except ParseError as e:
+        report.problems.append(Problem("error", "syntax", str(e)))
+        return report
+    if catalog is not None:
+        _check_names(query, catalog, report.problems)
+    _check_group_by(query, catalog, report.problems,
+                    "error" if only_full_group_by else "warning")
+    if stats is not None and report.ok:
+        try:
+            report.cost = estimate(query, stats, catalog)
+        except KeyError:
+            report.cost = None
+    return report
+
+
+def preflight(sql, catalog=None, stats=None, max_scanned=None, only_full_group_by=True):
+    """Return ``sql`` unchanged if every statement in it passes :func:`check`.
+
+    Raises :class:`PreflightError` on the first statement with an error,
+    or whose estimated cost reads more than ``max_scanned`` rows.
+    """
+    for statement in split_statements(sql):
+        report = check(statement, catalog, stats, only_full_group_by)
+        if not report.ok:
+            raise PreflightError(report, "; ".join(
+                "%s: %s" % (p.code, p.message) for p in report.errors))
+        if max_scanned is not None and report.cost is not None \
+                and report.cost.scanned > max_scanned:
+            raise PreflightError(report, "estimated to read %d rows (limit %d)"
+                                 % (report.cost.scanned, max_scanned))
+    return sql
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Check exercise queries before running them.")
+    p.add_argument("sql", nargs="*", help="statements (default: every exercise query)")
+    p.add_argument("--url", default=None,
+                   help="database to read the schema and statistics of (default: none)")
+    args = p.parse_args(argv)
+    catalog = stats = None
+    strict = True
+    if args.url:
+        conn = connect(args.url)
+        try:
+            catalog = SchemaCatalog.load(conn)
+            stats = StatsCatalog.load(conn)
+            strict = full_group_by(conn)
+        finally:
+            conn.close()
+    queries = [("", 0, s) for s in args.sql] or extract()
+    for script, line, sql in queries:
+        report = check(sql, catalog, stats, strict)
+        if report.problems or args.sql:
+            print("%s:%d %s" % (script, line, " ".join(t.text for t in tokenize(sql)
+                                                       if is_significant(t))[:70]))
+            for problem in report.problems:
+                print("    %s %s: %s" % (problem.severity, problem.code, problem.message))
+            if report.cost is not None:
+                print("    reads ~%d rows, joins ~%d, returns ~%d" % report.cost)
+
+
+if __name__ == "__main__":
+    main()
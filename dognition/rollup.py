@@ -0,0 +1,727 @@
+"""Pre-aggregated time rollups of complete_tests and site_activities.
+
+Exercise 5 counts completed tests by ``test_name, MONTH(created_at)`` and by
+month alone, Exercise 2 filters on ``YEAR(created_at)`` and
+``MONTH(created_at)``, and each of those queries reads all of
+complete_tests.  A :class:`Rollup` holds one cell per (test_name,
+subcategory_name, day) with the number of rows and a HyperLogLog sketch of
+the distinct dogs in it, kept sparsely as the registers the day's dogs
+set, plus a :class:`dognition.hll.HyperLogLog` sketch of the dogs per
+month.  Any grouping or filter on those columns and on
+``YEAR``, ``MONTH``, ``DAY``/``DAYOFMONTH``, ``DAYOFWEEK`` or ``DATE`` of
+``created_at`` is then a pass over a few thousand cells instead of the
+table::
+
+    cube = Rollup.load(conn, "complete_tests")     # built once, then refreshed
+    cube.count(by=("test_name", "month"))
+    cube.count(by="month", where={"year": 2014})
+    cube.distinct(by="year", start="2014-01-01", end="2015-01-01")
+    cube.answer("SELECT test_name, MONTH(created_at) AS Month, COUNT(*) "
+                "FROM complete_tests GROUP BY test_name, Month")
+
+For site_activities the dimensions are ``activity_type`` and ``membership_id``.
+:meth:`Rollup.refresh` adds the rows created after the newest one already
+counted, so keeping the cube current costs one indexed range scan; rows
+updated or deleted in place need a :meth:`Rollup.build`.
+
+Distinct dogs are estimated by merging sketches, the monthly ones when the
+query is aligned to whole months and the day cells' otherwise (about 2%
+error either way), so a cell never holds more than a sketch's registers
+however many rows reach it.  ``Rollup(table, exact=True)`` also keeps the
+hashes of every dog in each day cell, which grows with the table, and
+``exact=True`` on :meth:`Rollup.aggregate`, :meth:`Rollup.answer` or
+:func:`answer` then counts the dogs exactly from them.  Text values
+compare and group without regard to case, as MySQL's default collation
+does.
+"""
+
+import argparse
+import base64
+import datetime
+import json
+import os
+
+from .breedsearch import like_regex
+from .catalog import default_cache_path
+from .db import DEFAULT_URL, connect, placeholder, quote
+from .hll import DEFAULT_ERROR, NO_DATE, HyperLogLog, estimate, hash64, precision_for, \
+    register_of
+from .sqlquery import ParseError, parse
+from .sqltext import identifier, keyword, significant, string_value, tokenize
+from .streaming import stream
+
+CUBES = {
+    "complete_tests": ("test_name", "subcategory_name"),
+    "site_activities": ("activity_type", "membership_id"),
+}
+TIME_PARTS = ("year", "month", "day", "date", "weekday")
+# bumped when the cache layout changes; an older cache is rebuilt
+FORMAT = 2
+PRECISION = precision_for(DEFAULT_ERROR)
+# SQL functions of the date column and the time part each one reads
+FUNCTIONS = {"YEAR": "year", "MONTH": "month", "DAY": "day", "DAYOFMONTH": "day",
+             "DATE": "date", "DAYOFWEEK": "weekday"}
+_DAY_PARTS = {"day", "date", "weekday"}
+
+
+class Unsupported(ValueError):
+    """The query needs something the rollup does not keep."""
+
+
+def _fold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+def _order(value):
+    return (value is not None, isinstance(value, str), value)
+
+
+def _day_of(value):
+    """``'YYYY-MM-DD'`` of a datetime or timestamp string, or ``None``."""
+    if value is None:
+        return None
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d")
+    return str(value)[:10]
+
+
+def _time_parts(day):
+    if day is None:
+        return (None,) * len(TIME_PARTS)
+    date = datetime.date(int(day[:4]), int(day[5:7]), int(day[8:10]))
+    return date.year, date.month, date.day, day, date.isoweekday() % 7 + 1
+
+
+def _day_bound(value, name):
+    """``value`` as a ``'YYYY-MM-DD'`` day boundary, or :class:`Unsupported`."""
+    if value is None:
+        return None
+    if hasattr(value, "strftime"):
+        value = value.strftime("%Y-%m-%d %H:%M:%S")
+    value = str(value)
+    if value[10:].strip(" T0:."):
+        raise Unsupported("%s %r is not at midnight" % (name, value))
+    return value[:10]
+
+
+def _pack(sketch):
+    """A sparse sketch ``{index: rank}`` as sorted ``index << 6 | rank`` integers."""
+    return sorted(index << 6 | rank for index, rank in sketch.items())
+
+
+def _unpack(packed):
+    return {value >> 6: value & 63 for value in packed}
+
+
+def _merge(sketch, other):
+    """Fold the sparse sketch ``other`` into ``sketch``."""
+    for index, rank in other.items():
+        if rank > sketch.get(index, 0):
+            sketch[index] = rank
+    return sketch
+
+
+def _matcher(value):
+    """A test for one ``where`` entry: a value, a collection or a callable.
+
+    Results are remembered per value, since the same few values repeat in
+    every cell.
+    """
+    if callable(value):
+        test = value
+    else:
+        values = value if isinstance(value, (list, tuple, set, frozenset)) else (value,)
+        wanted = {_fold(v) for v in values}
+
+        def test(v):
+            return _fold(v) in wanted
+    seen = {}
+
+    def check(v):
+        if v not in seen:
+            seen[v] = bool(test(v))
+        return seen[v]
+    return check
+
+
+class Rollup:
+    """Day cells and monthly dog sketches for one table.
+
+    ``cells`` maps ``(dimension values..., day)`` to ``[rows, sparse dog
+    sketch, dog hashes]``, the hashes ``None`` unless ``exact``, and
+    ``months`` maps ``(dimension values..., 'YYYY-MM')`` to ``[rows, dog
+    sketch]``; the day and month are ``None`` for rows without a date.
+    """
+
+    def __init__(self, table, dimensions=None, date_column="created_at",
+                 distinct_column="dog_guid", path=None, exact=False):
+        self.table = table
+        self.dimensions = tuple(dimensions or CUBES[table])
+        self.date_column = date_column
+        self.distinct_column = distinct_column
+        self.path = path
+        self.exact = exact
+        self.cells = {}
+        self.months = {}
+        self.watermark = None
+        self.rows = 0
+        self._index = None
+
+    @property
+    def parts(self):
+        return self.dimensions + TIME_PARTS
+
+    @classmethod
+    def load(cls, conn, table, path=None, refresh=True, exact=False):
+        """Read the cached rollup of ``table``, building or refreshing it as needed.
+
+        A cache without the dog hashes an ``exact`` rollup needs is rebuilt.
+        """
+        path = path or default_cache_path(conn, "rollup-%s" % table)
+        cube = cls(table, path=path, exact=exact)
+        data = None
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("format") != FORMAT or (exact and not data.get("exact")):
+                data = None
+        if data is not None:
+            cube._restore(data)
+            if refresh and cube.refresh(conn):
+                cube.save()
+        else:
+            cube.build(conn)
+            cube.save()
+        return cube
+
+    def _restore(self, data):
+        width = len(self.dimensions)
+        self.watermark = data["watermark"]
+        self.exact = bool(data.get("exact"))
+        for entry in data["cells"]:
+            key, count, packed = tuple(entry[:width + 1]), entry[width + 1], entry[width + 2]
+            hashes = set(entry[width + 3]) if self.exact else None
+            self.cells[key] = [count, _unpack(packed), hashes]
+            self.rows += count
+        for entry in data["months"]:
+            month = None if entry[width] == NO_DATE else entry[width]
+            self.months[tuple(entry[:width]) + (month,)] = [
+                entry[width + 1], HyperLogLog.from_bytes(base64.b64decode(entry[width + 2]))]
+
+    def save(self, path=None):
+        path = path or self.path
+        if path is None:
+            return  # an in-memory database: nothing to keep
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        width = len(self.dimensions)
+        data = {
+            "format": FORMAT, "table": self.table, "dimensions": self.dimensions,
+            "watermark": self.watermark, "exact": self.exact,
+            "cells": [list(key) + [count, _pack(sketch)]
+                      + ([sorted(hashes)] if self.exact else [])
+                      for key, (count, sketch, hashes) in self.cells.items()],
+            "months": [list(key[:width]) + [key[width] or NO_DATE, count,
+                                            base64.b64encode(sketch.to_bytes()).decode("ascii")]
+                       for key, (count, sketch) in self.months.items()],
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def build(self, conn, batch_size=10000):
+        """Scan the whole table and replace every cell."""
+        self.cells, self.months, self.rows, self.watermark = {}, {}, 0, None
+        return self._scan(conn, None, batch_size)
+
+    def refresh(self, conn, batch_size=10000):
+        """Add the rows created after :attr:`watermark`; return how many."""
+        if self.watermark is None:
+            return self.build(conn, batch_size)
+        return self._scan(conn, self.watermark, batch_size)
+
+    def _scan(self, conn, since, batch_size):
+        columns = self.dimensions + (self.date_column, self.distinct_column)
+        sql = "SELECT %s FROM %s" % (", ".join(quote(c) for c in columns), quote(self.table))
+        params = ()
+        if since is not None:
+            sql += " WHERE %s > %s" % (quote(self.date_column), placeholder(conn))
+            params = (since,)
+        added = 0
+        width = len(self.dimensions)
+        cells, months, watermark = self.cells, self.months, self.watermark
+        with stream(conn, sql, params, batch_size) as rows:
+            for row in rows:
+                moment, dog = row[width], row[width + 1]
+                day = _day_of(moment)
+                key = row[:width] + (day,)
+                cell = cells.get(key)
+                if cell is None:
+                    cell = cells[key] = [0, {}, set() if self.exact else None]
+                month_key = row[:width] + (day[:7] if day else None,)
+                month = months.get(month_key)
+                if month is None:
+                    month = months[month_key] = [0, HyperLogLog(PRECISION)]
+                cell[0] += 1
+                month[0] += 1
+                if dog is not None:
+                    x = hash64(dog)
+                    index, rank = register_of(x, PRECISION)
+                    if rank > cell[1].get(index, 0):
+                        cell[1][index] = rank
+                    if cell[2] is not None:
+                        cell[2].add(x)
+                    month[1].add_hash(x)
+                if moment is not None:
+                    moment = str(moment)
+                    if watermark is None or moment > watermark:
+                        watermark = moment
+                added += 1
+        self.watermark = watermark
+        self.rows += added
+        if added:
+            self._index = None
+        return added
+
+    def _cell_index(self, months=False):
+        """``[(day or month, part values, folded values, rows, dogs)]``.
+
+        ``dogs`` is ``(sparse sketch, hashes)`` for a day and the sketch for
+        a month.  The time parts are worked out once per day; month entries
+        leave the day, date and weekday parts ``None``.
+        """
+        if self._index is None:
+            self._index = {False: [], True: []}
+            parts = {}
+            for key, (count, sketch, hashes) in self.cells.items():
+                day = key[-1]
+                if day not in parts:
+                    parts[day] = _time_parts(day)
+                values = key[:-1] + parts[day]
+                self._index[False].append((day, values, tuple(map(_fold, values)), count,
+                                           (sketch, hashes)))
+            for key, (count, sketch) in self.months.items():
+                month = key[-1]
+                values = key[:-1] + ((int(month[:4]), int(month[5:7])) if month else (None, None))
+                values += (None,) * (len(self.parts) - len(values))
+                self._index[True].append((month, values, tuple(map(_fold, values)), count, sketch))
+        return self._index[months]
+
+    def _positions(self, names):
+        if isinstance(names, str):
+            names = (names,)
+        parts = [p.lower() for p in self.parts]
+        positions = []
+        for name in names:
+            if name.lower() not in parts:
+                raise ValueError("%s has no part named %r (expected one of %s)"
+                                 % (self.table, name, ", ".join(self.parts)))
+            positions.append(parts.index(name.lower()))
+        return positions
+
+    def aggregate(self, by=(), measures=("rows",), where=None, start=None, end=None,
+                  exact=False):
+        """``{group: (measure, ...)}`` for the rows selected, in one pass over the cells.
+
+        ``by`` names parts: the dimensions and :data:`TIME_PARTS`.  Each
+        measure is ``"rows"`` (``COUNT(*)``), ``"dogs"`` (``COUNT(DISTINCT
+        dog_guid)``) or a dimension or the date column (``COUNT(column)``).
+        ``where`` maps part names to a value, a collection of values or a
+        predicate, and ``start``/``end`` bound ``DATE(created_at)`` as
+        ``start <= day < end``.  Queries that never look below a month are
+        answered from the month cells.  Dog counts are estimates from the
+        sketches; ``exact`` counts the day cells' hashes instead, which
+        only a rollup built with ``exact=True`` keeps.
+        """
+        if exact and "dogs" in measures and not self.exact:
+            raise Unsupported("exact dog counts need a Rollup built with exact=True")
+        by = self._positions(by)
+        where = where or {}
+        tests = list(zip(self._positions(list(where)), map(_matcher, where.values())))
+        year = self.parts.index("year")
+        wanted = []
+        for measure in measures:
+            if measure in ("rows", "dogs"):
+                wanted.append(measure)
+            elif measure.lower() == self.date_column.lower():
+                wanted.append(year)
+            else:
+                wanted.append(self._positions(measure)[0])
+        start, end = _day_bound(start, "start"), _day_bound(end, "end")
+        daily = {p for p in self.parts if p in _DAY_PARTS}
+        monthly = (not {self.parts[i] for i in by} & daily
+                   and not {self.parts[i] for i, _ in tests} & daily
+                   and all(b.endswith("-01") for b in (start, end) if b is not None)
+                   and not (exact and "dogs" in wanted))
+        if monthly:
+            start, end = start and start[:7], end and end[:7]
+        groups = {}
+        for stamp, values, folded, count, dogs in self._cell_index(monthly):
+            if (start or end) and (stamp is None or (start and stamp < start)
+                                   or (end and stamp >= end)):
+                continue
+            if not all(values[i] is not None and test(values[i]) for i, test in tests):
+                continue
+            key = tuple(folded[i] for i in by)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [tuple(values[i] for i in by)] + [
+                    0 if m != "dogs" else None for m in wanted]
+            for slot, measure in enumerate(wanted, 1):
+                if measure == "rows":
+                    group[slot] += count
+                elif measure == "dogs":
+                    if monthly:
+                        if group[slot] is None:
+                            group[slot] = dogs.copy()
+                        else:
+                            group[slot].merge(dogs)
+                    elif exact:
+                        if group[slot] is None:
+                            group[slot] = set()
+                        group[slot].update(dogs[1])
+                    else:
+                        group[slot] = _merge(group[slot] or {}, dogs[0])
+                elif values[measure] is not None:
+                    group[slot] += count
+        result = {}
+        for key in sorted(groups, key=lambda k: tuple(map(_order, k))):
+            group = groups[key]
+            result[group[0]] = tuple(_dogs(v, monthly, exact) if m == "dogs" else v
+                                     for m, v in zip(wanted, group[1:]))
+        return result
+
+    def count(self, by=(), where=None, start=None, end=None, column=None):
+        """``{group: rows}``, like ``SELECT by..., COUNT(column) ... GROUP BY by...``.
+
+        Arguments as for :meth:`aggregate`; without ``column`` every row counts.
+        """
+        found = self.aggregate(by, (column or "rows",), where, start, end)
+        return {group: values[0] for group, values in found.items()}
+
+    def distinct(self, by=(), where=None, start=None, end=None, exact=False):
+        """``{group: dogs}``, like ``COUNT(DISTINCT dog_guid)`` per group."""
+        found = self.aggregate(by, ("dogs",), where, start, end, exact)
+        return {group: values[0] for group, values in found.items()}
+
+    def answer(self, sql, exact=False):
+        """Run an aggregate ``sql`` over this table from the rollup.
+
+        Returns ``(columns, rows)``; raises :class:`Unsupported` if the query
+        reads anything the rollup does not keep.  ``COUNT(DISTINCT dog_guid)``
+        is estimated unless ``exact``.
+        """
+        return _Translation(self, sql).run(exact)
+
+
+def _dogs(found, monthly, exact):
+    """The distinct-dog count of a group's merged sketch or hashes."""
+    if monthly:
+        return found.count()
+    if exact:
+        return len(found)
+    return estimate(1 << PRECISION, found.values())
+
+
+class _Translation:
+    """One SELECT mapped onto :meth:`Rollup.count` and :meth:`Rollup.distinct`."""
+
+    def __init__(self, cube, sql):
+        self.cube = cube
+        try:
+            self.query = query = parse(sql)
+        except ParseError as e:
+            raise Unsupported(str(e)) from None
+        if (len(query.tables) != 1 or query.tables[0].name is None
+                or query.tables[0].name.lower() != cube.table.lower()
+                or query.unions or any(q is not query for q in query.walk())):
+            raise Unsupported("not a single-table query over %s" % cube.table)
+        if query.having or query.where_has_or:
+            raise Unsupported("HAVING and OR are not supported")
+        self.where, self.start, self.end = {}, None, None
+        for predicate in query.where:
+            self._condition(predicate.text)
+        self.items = [self._item(item.text) for item in query.select]
+        self.by = [self._group_part(item) for item in query.group_by]
+        if query.distinct and not query.is_aggregate:
+            self.by = [value for kind, value in self.items]
+        for kind, value in self.items:
+            if kind == "part" and value not in self.by:
+                raise Unsupported("%s is neither grouped nor aggregated" % value)
+        if not query.is_aggregate and not query.distinct:
+            raise Unsupported("not an aggregate query")
+
+    def _tokens(self, text):
+        tokens = [t for _, t in significant(tokenize(text))]
+        while len(tokens) > 2 and tokens[0].text == "(" and tokens[-1].text == ")":
+            tokens = tokens[1:-1]
+        return tokens
+
+    def _column(self, tokens):
+        if len(tokens) == 3 and tokens[1].text == ".":
+            tokens = tokens[2:]
+        if len(tokens) == 1 and identifier(tokens[0]) is not None:
+            return identifier(tokens[0]).lower()
+        return None
+
+    def _term(self, tokens):
+        """The part ``tokens`` read, ``"@date"`` for the bare date column, else ``None``."""
+        column = self._column(tokens)
+        if column is not None:
+            if column == self.cube.date_column.lower():
+                return "@date"
+            return column if column in [d.lower() for d in self.cube.dimensions] else None
+        word = keyword(tokens[0]) if tokens else None
+        if (word in FUNCTIONS and len(tokens) >= 4 and tokens[1].text == "("
+                and tokens[-1].text == ")"
+                and self._column(tokens[2:-1]) == self.cube.date_column.lower()):
+            return FUNCTIONS[word]
+        return None
+
+    def _item(self, text):
+        tokens = self._tokens(text)
+        if (len(tokens) >= 4 and keyword(tokens[0]) == "COUNT"
+                and tokens[1].text == "(" and tokens[-1].text == ")"):
+            inner = tokens[2:-1]
+            if len(inner) == 1 and inner[0].text == "*":
+                return "count", None
+            if keyword(inner[0]) == "DISTINCT":
+                if self._column(inner[1:]) == self.cube.distinct_column.lower():
+                    return "distinct", None
+                raise Unsupported("only COUNT(DISTINCT %s) is kept" % self.cube.distinct_column)
+            term = self._term(inner)
+            if term in ("@date",) + tuple(d.lower() for d in self.cube.dimensions):
+                return "count", term
+            raise Unsupported("cannot count %s" % text)
+        term = self._term(tokens)
+        if term is None or term == "@date":
+            raise Unsupported("%s is not a rollup dimension" % text)
+        return "part", term
+
+    def _group_part(self, item):
+        query = self.query
+        if item.position is not None:
+            if not 1 <= item.position <= len(self.items):
+                raise Unsupported("GROUP BY position %d" % item.position)
+            kind, value = self.items[item.position - 1]
+        else:
+            alias = self._column(self._tokens(item.text))
+            if alias in query.select_aliases:
+                kind, value = self._item(query.select_aliases[alias].text)
+            else:
+                kind, value = "part", self._term(self._tokens(item.text))
+        if kind != "part" or value in (None, "@date"):
+            raise Unsupported("cannot group by %s" % item.text)
+        return value
+
+    def _constant(self, tokens):
+        negative = len(tokens) == 2 and tokens[0].text == "-"
+        if negative:
+            tokens = tokens[1:]
+        if len(tokens) != 1 or tokens[0].kind not in ("string", "number"):
+            raise Unsupported("not a constant: %s" % " ".join(t.text for t in tokens))
+        token = tokens[0]
+        if token.kind == "string":
+            return string_value(token)
+        value = float(token.text) if "." in token.text or "e" in token.text.lower() \
+            else int(token.text)
+        return -value if negative else value
+
+    def _condition(self, text):
+        tokens = self._tokens(text)
+        depth, split = 0, None
+        for i, token in enumerate(tokens):
+            if token.text == "(":
+                depth += 1
+            elif token.text == ")":
+                depth -= 1
+            elif depth == 0 and (keyword(token) in ("IN", "BETWEEN", "LIKE", "NOT", "IS")
+                                 or token.text in ("=", "<", "<=", ">", ">=", "<>", "!=")):
+                split = i
+                break
+        if split is None:
+            raise Unsupported("cannot filter on %s" % text)
+        term = self._term(tokens[:split])
+        op, rest = tokens[split].text.upper(), tokens[split + 1:]
+        if term is None:
+            raise Unsupported("cannot filter on %s" % text)
+        if op == "NOT" and rest and keyword(rest[0]) in ("IN", "LIKE"):
+            op, rest = "NOT " + keyword(rest[0]), rest[1:]
+        if op in ("IS", "NOT") or (term == "@date" and "LIKE" in op):
+            raise Unsupported("cannot filter on %s" % text)
+        if op in ("LIKE", "NOT LIKE"):
+            regex = like_regex(self._constant(rest))
+            matches = op == "LIKE"
+            self._add(term, lambda v: bool(regex.fullmatch(str(v))) == matches, text)
+            return
+        if op in ("IN", "NOT IN"):
+            if not rest or rest[0].text != "(" or rest[-1].text != ")":
+                raise Unsupported("cannot filter on %s" % text)
+            values, current = [], []
+            for token in rest[1:-1] + [None]:
+                if token is None or token.text == ",":
+                    values.append(self._coerce(term, self._constant(current)))
+                    current = []
+                else:
+                    current.append(token)
+            wanted = {_fold(v) for v in values}
+            if op == "IN":
+                self._add(term, lambda v: _fold(v) in wanted, text)
+            else:
+                self._add(term, lambda v: _fold(v) not in wanted, text)
+            return
+        if op == "BETWEEN":
+            cut = [i for i, t in enumerate(rest) if keyword(t) == "AND"]
+            if len(cut) != 1:
+                raise Unsupported("cannot filter on %s" % text)
+            low = self._coerce(term, self._constant(rest[:cut[0]]))
+            high = self._coerce(term, self._constant(rest[cut[0] + 1:]))
+            if term == "@date":
+                self._bound(">=", low, text)
+                self._bound("<=", high, text)
+            else:
+                self._add(term, lambda v: low <= v <= high, text)
+            return
+        value = self._coerce(term, self._constant(rest))
+        if term == "@date":
+            self._bound(op, value, text)
+            return
+        tests = {
+            "=": lambda v: _fold(v) == _fold(value),
+            "<>": lambda v: _fold(v) != _fold(value),
+            "!=": lambda v: _fold(v) != _fold(value),
+            "<": lambda v: v < value, "<=": lambda v: v <= value,
+            ">": lambda v: v > value, ">=": lambda v: v >= value,
+        }
+        self._add(term, tests[op], text)
+
+    def _coerce(self, term, value):
+        if term in ("year", "month", "day", "weekday") and isinstance(value, str):
+            try:
+                return int(value)
+            except ValueError:
+                raise Unsupported("%s compared with %r" % (term, value)) from None
+        return value
+
+    def _add(self, term, test, text):
+        earlier = self.where.get(term)
+        if earlier is None:
+            self.where[term] = test
+        else:
+            self.where[term] = lambda v: earlier(v) and test(v)
+
+    def _bound(self, op, value, text):
+        """Fold a comparison on the bare date column into ``start``/``end``."""
+        value = str(value)
+        day, rest = value[:10], value[10:].strip(" T")
+        midnight = not rest.strip("0:.")
+        last_second = rest.startswith("23:59:59")
+        following = None
+        if len(day) == 10:
+            following = (datetime.date(int(day[:4]), int(day[5:7]), int(day[8:10]))
+                         + datetime.timedelta(days=1)).isoformat()
+        if op == ">=" and midnight:
+            start = day
+        elif op == ">" and last_second:
+            start = following
+        elif op == "<" and midnight:
+            self.end = day if self.end is None else min(self.end, day)
+            return
+        elif op == "<=" and last_second:
+            self.end = following if self.end is None else min(self.end, following)
+            return
+        else:
+            raise Unsupported("%s does not fall on a day boundary" % text)
+        self.start = start if self.start is None else max(self.start, start)
+
+    def run(self, exact=False):
+        cube, query = self.cube, self.query
+        measures = []
+        for kind, value in self.items:
+            if kind == "count":
+                measures.append(cube.date_column if value == "@date" else value or "rows")
+            elif kind == "distinct":
+                measures.append("dogs")
+        groups = cube.aggregate(self.by, measures or ("rows",), self.where,
+                                self.start, self.end, exact)
+        if not self.by and not groups:
+            groups = {(): (0,) * len(measures)}
+        rows = []
+        for group, values in groups.items():
+            values, row = iter(values), []
+            for kind, value in self.items:
+                row.append(group[self.by.index(value)] if kind == "part" else next(values))
+            rows.append(tuple(row))
+        columns = [item.alias or item.text for item in query.select]
+        for item in reversed(query.order_by):
+            index = self._output(item, columns)
+            rows.sort(key=lambda r: _order(_fold(r[index])), reverse=item.descending)
+        offset = query.offset or 0
+        if query.limit is not None:
+            rows = rows[offset:offset + query.limit]
+        elif offset:
+            rows = rows[offset:]
+        return columns, rows
+
+    def _output(self, item, columns):
+        if item.position is not None:
+            if not 1 <= item.position <= len(columns):
+                raise Unsupported("ORDER BY position %d" % item.position)
+            return item.position - 1
+        name = self._column(self._tokens(item.text))
+        lowered = [c.lower() for c in columns]
+        if name is not None and name in lowered:
+            return lowered.index(name)
+        wanted = self._item(item.text)
+        if wanted in self.items:
+            return self.items.index(wanted)
+        raise Unsupported("cannot order by %s" % item.text)
+
+
+def answer(conn, sql, cube=None, exact=False):
+    """``(columns, rows)`` for ``sql`` from the rollup of the table it reads."""
+    if cube is None:
+        try:
+            table = parse(sql).tables[0].name
+        except (ParseError, IndexError):
+            raise Unsupported("not a query over a rolled-up table") from None
+        if table is None or table.lower() not in CUBES:
+            raise Unsupported("%s has no rollup" % table)
+        cube = Rollup.load(conn, table.lower(), exact=exact)
+    return cube.answer(sql, exact)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Answer aggregate queries from the time rollups.")
+    p.add_argument("sql", nargs="?")
+    p.add_argument("--url", default=DEFAULT_URL)
+    p.add_argument("--rebuild", action="store_true", help="rescan instead of refreshing")
+    p.add_argument("--exact", action="store_true",
+                   help="keep every dog's hash and count distinct dogs exactly")
+    args = p.parse_args(argv)
+    conn = connect(args.url)
+    try:
+        if args.rebuild:
+            for table in CUBES:
+                cube = Rollup(table, path=default_cache_path(conn, "rollup-%s" % table),
+                              exact=args.exact)
+                cube.build(conn)
+                cube.save()
+        if args.sql is None:
+            for table in CUBES:
+                cube = Rollup.load(conn, table, exact=args.exact)
+                print("%s: %d rows in %d day cells, up to %s"
+                      % (table, cube.rows, len(cube.cells), cube.watermark))
+            return
+        columns, rows = answer(conn, args.sql, exact=args.exact)
+    finally:
+        conn.close()
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join("NULL" if v is None else str(v) for v in row))
+
+
+if __name__ == "__main__":
+    main()
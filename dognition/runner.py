@@ -0,0 +1,258 @@
+"""Run the exercise scripts outside Jupyter on pooled connections.
+
+The exercise scripts are notebook exports: every query is a
+``get_ipython().run_cell_magic('sql', '', ...)`` call.  :func:`run_script`
+executes a script with a small stand-in for the IPython shell that sends
+those queries to a connection from :mod:`dognition.pool`, so a batch run
+of all ten exercises connects once (on SQLite, or on MySQL through
+mysqlclient, whose sessions the pool can reset)::
+
+    python -m dognition.runner                # every MySQL_Exercise_*.py
+    python -m dognition.runner --url sqlite:///dognition.db MySQL_Exercise_02*.py
+
+``%load_ext sql`` and ``%sql mysql://...`` become no-ops, ``SHOW tables``
+and ``DESCRIBE`` are answered from the cached :class:`SchemaCatalog`,
+YEAR()/MONTH() filters are made sargable (:mod:`dognition.sargable`),
+breed-cleaning expressions read the indexed columns of
+:mod:`dognition.cleaned` when they are installed, GUIDs are converted at
+the boundary once :mod:`dognition.guids` has made them binary, and a
+failing query is recorded and the script carries on, as it would in the
+notebook.  Every query is first checked by :func:`dognition.preflight.preflight`;
+one with a syntax error or an unknown name is recorded as failed without
+being sent, and so is one with a column missing from GROUP BY when the
+server's ``sql_mode`` has ``ONLY_FULL_GROUP_BY`` (otherwise the server runs
+it and so does the runner), or an accidental cross join estimated above
+``--max-join-rows`` (:mod:`dognition.cartesian`).
+"""
+
+import argparse
+import csv
+import functools
+import glob
+import io
+import os
+import re
+import tempfile
+import time
+
+from .cartesian import DEFAULT_MAX_ROWS, guard
+from .catalog import SchemaCatalog
+from .cleaned import installed, rewrite_cleaned
+from .db import DEFAULT_URL, dialect_of
+from .export import export_rows
+from .guids import decode_rows, migrated, rewrite_guids
+from .pool import get_pool
+from .preflight import PreflightError, full_group_by, preflight
+from .sargable import rewrite_dates
+from .stats import StatsCatalog
+
+_URL = re.compile(r"^\s*\w+(\+\w+)?://")
+_USE = re.compile(r"^\s*USE\s+\w+\s*;?\s*$", re.I)
+_SHOW_TABLES = re.compile(r"^\s*SHOW\s+TABLES\s*;?\s*$", re.I)
+_DESCRIBE = re.compile(
+    r"^\s*(?:DESCRIBE\s+|SHOW\s+COLUMNS\s+FROM\s+)`?(\w+)`?\s*;?\s*$", re.I)
+
+
+class ResultSet(list):
+    """Query rows plus column names, like ipython-sql's ResultSet."""
+
+    def __init__(self, rows, keys):
+        super().__init__(rows)
+        self.keys = list(keys)
+
+    def csv(self, filename=None, **options):
+        """Write the rows to ``filename`` (or return them as a CSV string).
+
+        The file is written in batches by :func:`dognition.export.export_rows`,
+        so ``filename`` may also end in ``.csv.gz`` or ``.parquet``;
+        ``options`` (``batch_size``, ``progress``) are passed through.
+        """
+        if filename is None:
+            out = io.StringIO()
+            writer = csv.writer(out)
+            writer.writerow(self.keys)
+            writer.writerows(self)
+            return out.getvalue()
+        export_rows(self, self.keys, filename, **options)
+        return filename
+
+
+class CellResult:
+    """What happened to one ``%sql`` call."""
+
+    def __init__(self, sql, rows=None, error=None, seconds=0.0):
+        self.sql = sql
+        self.rows = rows
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class Shell:
+    """Stand-in for ``get_ipython()`` that runs ``%sql`` on one connection.
+
+    ``preprocessors`` are functions from SQL text to SQL text applied, in
+    order, to every query before it is executed; one that raises
+    :class:`dognition.preflight.PreflightError` stops the query from
+    being sent, and the error is recorded as if the server had raised it.
+    ``postprocessors`` are functions from a list of result rows to a list
+    of rows, applied in order to every result.
+    """
+
+    def __init__(self, conn, catalog=None, preprocessors=(), postprocessors=()):
+        self.conn = conn
+        self.catalog = catalog
+        self.preprocessors = list(preprocessors)
+        self.postprocessors = list(postprocessors)
+        self.results = []
+
+    def run_line_magic(self, magic, line):
+        if magic == "load_ext":
+            return None
+        if magic != "sql":
+            raise NotImplementedError("%%%s is not supported" % magic)
+        return self.run_sql(line)
+
+    def run_cell_magic(self, magic, line, cell):
+        if magic != "sql":
+            raise NotImplementedError("%%%%%s is not supported" % magic)
+        # ipython-sql treats the magic line as the start of the statement
+        sql = cell if not line.strip() else line + "\n" + cell
+        return self.run_sql(sql)
+
+    def run_sql(self, sql):
+        if _URL.match(sql):
+            return None
+        if _USE.match(sql) and dialect_of(self.conn) == "sqlite":
+            return None
+        if self.catalog is not None:
+            answer = self._from_catalog(sql)
+            if answer is not None:
+                self.results.append(CellResult(sql, answer))
+                return answer
+        try:
+            for preprocess in self.preprocessors:
+                sql = preprocess(sql)
+        except PreflightError as exc:
+            self.results.append(CellResult(sql, error=exc))
+            return None
+        return self.execute(sql)
+
+    def execute(self, sql):
+        started = time.perf_counter()
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(sql)
+            keys = [d[0] for d in cursor.description or ()]
+            rows = cursor.fetchall() if keys else []
+            for postprocess in self.postprocessors:
+                rows = postprocess(rows)
+            rows = ResultSet(rows, keys)
+        except Exception as exc:
+            self.results.append(
+                CellResult(sql, error=exc, seconds=time.perf_counter() - started))
+            return None
+        finally:
+            cursor.close()
+        self.results.append(
+            CellResult(sql, rows, seconds=time.perf_counter() - started))
+        return rows
+
+    def _from_catalog(self, sql):
+        if _SHOW_TABLES.match(sql):
+            return ResultSet([(t,) for t in self.catalog.show_tables()],
+                             ["Tables_in_dognitiondb"])
+        match = _DESCRIBE.match(sql)
+        if match and match.group(1) in self.catalog:
+            return ResultSet(self.catalog.describe(match.group(1)),
+                             ["Field", "Type", "Null", "Key", "Default", "Extra"])
+        return None
+
+
+def run_script(path, conn, catalog=None, workdir=None, preprocessors=(),
+               postprocessors=()):
+    """Execute one exercise script on ``conn``; return its cell results.
+
+    Files the script writes (``breed_list.csv('breed_list.csv')``) land in
+    ``workdir``, a temporary directory by default.
+    """
+    shell = Shell(conn, catalog, preprocessors, postprocessors)
+    with open(path) as f:
+        code = compile(f.read(), path, "exec")
+    namespace = {"__name__": "__exercise__", "get_ipython": lambda: shell}
+    cwd = os.getcwd()
+    os.chdir(workdir or tempfile.mkdtemp(prefix="dognition-"))
+    try:
+        exec(code, namespace)
+    finally:
+        os.chdir(cwd)
+    return shell.results
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Run exercise scripts on a pool.")
+    p.add_argument("scripts", nargs="*")
+    p.add_argument("--url", default=DEFAULT_URL)
+    p.add_argument("--workdir")
+    p.add_argument("--no-rewrite", action="store_true",
+                   help="send queries to the server without rewriting them")
+    p.add_argument("--no-preflight", action="store_true",
+                   help="send queries without checking them locally first")
+    p.add_argument("--loose-group-by", action="store_true",
+                   help="allow columns missing from GROUP BY even when the server's "
+                        "sql_mode has ONLY_FULL_GROUP_BY")
+    p.add_argument("--max-scanned", type=int,
+                   help="refuse queries estimated to read more rows than this")
+    p.add_argument("--max-join-rows", type=int, default=DEFAULT_MAX_ROWS,
+                   help="budget for tables listed without a join condition")
+    p.add_argument("--cross-join", choices=("block", "limit", "allow"), default="block",
+                   help="refuse cross joins over the budget, add a LIMIT where "
+                        "that bounds them, or send them anyway (independent of "
+                        "--no-preflight)")
+    args = p.parse_args(argv)
+    preprocessors = [] if args.no_rewrite else [rewrite_dates]
+    scripts = args.scripts or sorted(glob.glob("MySQL_Exercise_*.py"))
+    pool = get_pool(args.url, max_size=1)
+    started = time.perf_counter()
+    with pool.acquire() as conn:
+        catalog = SchemaCatalog.load(conn)
+        # only statistics already collected: checking must not scan the tables
+        stats = StatsCatalog.load(conn, collect=False)
+        strict = full_group_by(conn) and not args.loose_group_by
+    if args.cross_join != "allow":
+        preprocessors.insert(0, functools.partial(
+            guard, stats=stats, catalog=catalog, max_rows=args.max_join_rows,
+            action=args.cross_join))
+    if not args.no_preflight:
+        preprocessors.insert(0, functools.partial(
+            preflight, catalog=catalog, stats=stats, max_scanned=args.max_scanned,
+            only_full_group_by=strict))
+    cleaned = installed(catalog)
+    if cleaned and not args.no_rewrite:
+        preprocessors.append(functools.partial(rewrite_cleaned, columns=cleaned))
+    postprocessors = []
+    binary = migrated(catalog)
+    if binary:
+        # not optional: the server returns bytes and compares bytes
+        preprocessors.append(functools.partial(rewrite_guids, names=binary))
+        postprocessors.append(decode_rows)
+    for path in scripts:
+        with pool.acquire() as conn:
+            results = run_script(path, conn, catalog, args.workdir,
+                                 preprocessors, postprocessors)
+        failed = [r for r in results if not r.ok]
+        print("%-60s %3d queries %2d failed %8.2fs" % (
+            os.path.basename(path), len(results), len(failed),
+            sum(r.seconds for r in results)))
+        for r in failed:
+            print("    %s: %s" % (type(r.error).__name__,
+                                  " ".join(r.sql.split())[:70]))
+    print("total %.2fs; connections %s" % (time.perf_counter() - started,
+                                          pool.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,598 @@
+"""A lightweight structural parser for the SELECT statements in the exercises.
+
+:func:`parse` turns one SELECT into a :class:`Query`: the select list,
+FROM items with their join kind and ON condition, WHERE/HAVING conjuncts
+classified by shape (equality, range, IN, IS NULL, LIKE, join, ...), GROUP
+BY, ORDER BY and LIMIT, with nested subqueries and derived tables parsed
+recursively.  It covers the MySQL the course uses, not the whole grammar;
+statements it cannot make sense of raise :class:`ParseError`.
+
+Column references are kept as written (``d.breed`` or ``breed``);
+:meth:`Query.resolve` maps them to base tables, using a ``{table:
+columns}`` schema for unqualified names.
+"""
+
+from collections import namedtuple
+
+from .sqltext import identifier, keyword, significant, string_value, tokenize
+
+
+class ParseError(ValueError):
+    """The statement is not SQL this parser understands."""
+
+
+AGGREGATES = {
+    "COUNT", "SUM", "AVG", "MIN", "MAX", "GROUP_CONCAT", "STD", "STDDEV",
+    "STDDEV_POP", "STDDEV_SAMP", "VARIANCE", "VAR_POP", "VAR_SAMP",
+    "BIT_AND", "BIT_OR", "BIT_XOR", "JSON_ARRAYAGG", "JSON_OBJECTAGG",
+}
+
+KEYWORDS = {
+    "SELECT", "DISTINCT", "DISTINCTROW", "ALL", "FROM", "WHERE", "GROUP",
+    "BY", "HAVING", "ORDER", "LIMIT", "OFFSET", "AS", "AND", "OR", "XOR",
+    "NOT", "IN", "IS", "NULL", "LIKE", "REGEXP", "RLIKE", "BETWEEN", "JOIN",
+    "INNER", "LEFT", "RIGHT", "OUTER", "CROSS", "NATURAL", "STRAIGHT_JOIN",
+    "ON", "USING", "ASC", "DESC", "CASE", "WHEN", "THEN", "ELSE", "END",
+    "EXISTS", "UNION", "TRUE", "FALSE", "DIV", "MOD", "INTERVAL", "LEADING",
+    "TRAILING", "BOTH", "SEPARATOR", "ESCAPE", "BINARY", "UNKNOWN", "ANY",
+    "SOME", "WITH", "ROLLUP", "FOR", "UPDATE", "INTO",
+}
+
+TIME_UNITS = {
+    "MICROSECOND", "SECOND", "MINUTE", "HOUR", "DAY", "WEEK", "MONTH",
+    "QUARTER", "YEAR",
+}
+
+_JOIN_WORDS = {"JOIN", "INNER", "LEFT", "RIGHT", "CROSS", "NATURAL",
+               "STRAIGHT_JOIN", "OUTER"}
+_CLAUSES = ("FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT")
+_COMPARISONS = {"=", "<=>", "<", "<=", ">", ">=", "<>", "!="}
+_FLIP = {"=": "=", "<=>": "<=>", "<": ">", "<=": ">=", ">": "<", ">=": "<=",
+         "<>": "<>", "!=": "!="}
+
+ColumnRef = namedtuple("ColumnRef", "qualifier name")
+Predicate = namedtuple("Predicate", "kind op columns value text")
+SelectItem = namedtuple("SelectItem", "text alias columns aggregate")
+# ``join`` is "from", "comma", "inner", "left", "right" or "cross";
+# ``natural`` marks a NATURAL join of any of those kinds
+TableRef = namedtuple("TableRef", "name alias join condition using subquery natural")
+Item = namedtuple("Item", "text columns position descending")
+
+
+class Query:
+    """The parts of one parsed SELECT."""
+
+    def __init__(self, text):
+        self.text = text
+        self.distinct = False
+        self.select = []
+        self.tables = []
+        self.where = []
+        self.where_has_or = False
+        self.group_by = []
+        self.having = []
+        self.order_by = []
+        self.limit = None
+        self.offset = None
+        self.subqueries = []
+        self.unions = []
+
+    @property
+    def aliases(self):
+        """Map of lower-cased alias (or table name) to :class:`TableRef`."""
+        return {(t.alias or t.name).lower(): t for t in self.tables if t.alias or t.name}
+
+    @property
+    def select_aliases(self):
+        return {item.alias.lower(): item for item in self.select if item.alias}
+
+    @property
+    def is_aggregate(self):
+        return bool(self.group_by) or any(i.aggregate for i in self.select)
+
+    def resolve(self, ref, schema=None):
+        """Return the base table a :class:`ColumnRef` belongs to, or ``None``.
+
+        Unqualified names are looked up in ``schema`` (``{table: columns}``)
+        among the tables in FROM; ambiguous or unknown names give ``None``.
+        """
+        if ref.qualifier is not None:
+            table = self.aliases.get(ref.qualifier.lower())
+            return table.name if table is not None and table.name else None
+        if schema is None:
+            named = [t for t in self.tables if t.name]
+            return named[0].name if len(named) == 1 else None
+        owners = [
+            t.name for t in self.tables
+            if t.name and ref.name.lower() in _lower(schema.get(t.name, ()))
+        ]
+        return owners[0] if len(set(owners)) == 1 else None
+
+    def predicates(self):
+        """WHERE conjuncts plus the ON conditions of every joined table."""
+        found = list(self.where)
+        for table in self.tables:
+            found.extend(table.condition)
+        return found
+
+    def walk(self):
+        """Yield this query and every nested subquery, derived table and union."""
+        yield self
+        for table in self.tables:
+            if table.subquery is not None:
+                yield from table.subquery.walk()
+        for sub in self.subqueries + self.unions:
+            yield from sub.walk()
+
+
+def _lower(names):
+    return {n.lower() for n in names}
+
+
+def parse(sql):
+    """Parse one SELECT statement (a trailing semicolon is allowed)."""
+    tokens = [t for _, t in significant(tokenize(sql))]
+    while tokens and tokens[-1].text == ";":
+        tokens.pop()
+    if any(t.text == ";" for t in tokens):
+        raise ParseError("more than one statement")
+    if not tokens:
+        raise ParseError("empty statement")
+    _check_balanced(tokens)
+    return _parse_select(tokens)
+
+
+def _check_balanced(tokens):
+    depth = 0
+    for token in tokens:
+        if token.text == "(":
+            depth += 1
+        elif token.text == ")":
+            depth -= 1
+            if depth < 0:
+                raise ParseError("unbalanced ')'")
+        elif token.kind in ("string", "quoted") and (
+                len(token.text) < 2 or token.text[-1] != token.text[0]):
+            raise ParseError("unterminated %s" % (
+                "string" if token.kind == "string" else "identifier"))
+    if depth:
+        raise ParseError("missing ')'")
+
+
+def _depths(tokens):
+    result, depth = [], 0
+    for token in tokens:
+        if token.text == ")":
+            depth -= 1
+        result.append(depth)
+        if token.text == "(":
+            depth += 1
+    return result
+
+
+def _text(tokens):
+    out = ""
+    for token in tokens:
+        if out and not (token.text in (",", ")", ".") or out.endswith(("(", "."))):
+            out += " "
+        out += token.text
+    return out
+
+
+def _split(tokens, separator):
+    """Split on depth-0 tokens for which ``separator(token)`` is true."""
+    parts, current = [], []
+    for token, depth in zip(tokens, _depths(tokens)):
+        if depth == 0 and separator(token):
+            parts.append(current)
+            current = []
+        else:
+            current.append(token)
+    parts.append(current)
+    return parts
+
+
+def _parse_select(tokens):
+    if keyword(tokens[0]) != "SELECT":
+        if tokens[0].text == "(" and tokens[-1].text == ")":
+            return _parse_select(tokens[1:-1])
+        raise ParseError("expected SELECT, found %r" % tokens[0].text)
+    query = Query(_text(tokens))
+    depth = _depths(tokens)
+
+    # split off UNION parts first
+    for i, token in enumerate(tokens):
+        if depth[i] == 0 and keyword(token) == "UNION":
+            rest = tokens[i + 1:]
+            if rest and keyword(rest[0]) in ("ALL", "DISTINCT"):
+                rest = rest[1:]
+            if not rest:
+                raise ParseError("UNION without a SELECT")
+            query.unions.append(_parse_select(rest))
+            tokens, depth = tokens[:i], depth[:i]
+            break
+
+    clauses = {"SELECT": []}
+    order = ["SELECT"]
+    current = "SELECT"
+    i = 1
+    while i < len(tokens):
+        word = keyword(tokens[i])
+        if depth[i] == 0 and word in _CLAUSES:
+            if word in ("GROUP", "ORDER"):
+                if i + 1 >= len(tokens) or keyword(tokens[i + 1]) != "BY":
+                    raise ParseError("%s without BY" % word)
+                i += 1
+            if word in clauses:
+                raise ParseError("duplicate %s clause" % word)
+            if _CLAUSES.index(word) < max(
+                    (_CLAUSES.index(c) for c in order if c in _CLAUSES), default=-1):
+                raise ParseError("%s clause out of order" % word)
+            current = word
+            clauses[current] = []
+            order.append(current)
+        else:
+            clauses[current].append(tokens[i])
+        i += 1
+
+    for word in order[1:]:
+        if not clauses[word]:
+            raise ParseError("empty %s clause" % word)
+
+    _parse_select_list(query, clauses["SELECT"])
+    if "FROM" in clauses:
+        _parse_from(query, clauses["FROM"])
+    if "WHERE" in clauses:
+        query.where, query.where_has_or = _parse_condition(query, clauses["WHERE"])
+    if "GROUP" in clauses:
+        query.group_by = _parse_items(query, clauses["GROUP"], "GROUP BY")
+    if "HAVING" in clauses:
+        query.having, _ = _parse_condition(query, clauses["HAVING"])
+    if "ORDER" in clauses:
+        query.order_by = _parse_items(query, clauses["ORDER"], "ORDER BY")
+    if "LIMIT" in clauses:
+        _parse_limit(query, clauses["LIMIT"])
+    return query
+
+
+def _parse_select_list(query, tokens):
+    if tokens and keyword(tokens[0]) in ("DISTINCT", "DISTINCTROW", "ALL"):
+        query.distinct = keyword(tokens[0]) != "ALL"
+        tokens = tokens[1:]
+    if not tokens:
+        raise ParseError("empty select list")
+    for part in _split(tokens, lambda t: t.text == ","):
+        if not part:
+            raise ParseError("empty item in select list (stray comma?)")
+        alias = None
+        if len(part) >= 3 and keyword(part[-2]) == "AS":
+            alias = _alias(part[-1])
+            part = part[:-2]
+        elif len(part) >= 2 and _implicit_alias(part):
+            alias = _alias(part[-1])
+            part = part[:-1]
+        columns, aggregate = _columns(query, part)
+        query.select.append(SelectItem(_text(part), alias, columns, aggregate))
+
+
+def _alias(token):
+    if token.kind == "string":
+        return string_value(token)
+    name = identifier(token)
+    if name is None:
+        raise ParseError("bad alias %r" % token.text)
+    return name
+
+
+def _implicit_alias(part):
+    last, before = part[-1], part[-2]
+    if last.kind not in ("name", "quoted") or keyword(last) in KEYWORDS:
+        return False
+    if before.text == "." or before.kind == "op":
+        return False
+    return before.text == ")" or before.kind in ("name", "quoted", "number", "string") \
+        and keyword(before) not in KEYWORDS
+
+
+def _columns(query, tokens):
+    """Column references in an expression, and whether it aggregates.
+
+    Subqueries found inside the expression are parsed and appended to
+    ``query.subqueries``; their columns are not returned.
+    """
+    columns, aggregate = [], False
+    depth = _depths(tokens)
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+        if token.text == "(" and nxt is not None and keyword(nxt) == "SELECT":
+            end = _matching(tokens, i, depth)
+            query.subqueries.append(_parse_select(tokens[i + 1:end]))
+            i = end + 1
+            continue
+        name = identifier(token)
+        if name is None:
+            i += 1
+            continue
+        word = keyword(token)
+        if nxt is not None and nxt.text == "(" and token.kind == "name":
+            if word in AGGREGATES:
+                aggregate = True
+            i += 1
+            continue
+        prev = tokens[i - 1] if i else None
+        if word in KEYWORDS or _is_unit(tokens, i):
+            i += 1
+            continue
+        if prev is not None and prev.text == ".":
+            i += 1
+            continue
+        if nxt is not None and nxt.text == "." and i + 2 < len(tokens):
+            field = tokens[i + 2]
+            if field.text != "*" and identifier(field) is not None:
+                columns.append(ColumnRef(name, identifier(field)))
+            i += 3
+            continue
+        columns.append(ColumnRef(None, name))
+        i += 1
+    return columns, aggregate
+
+
+def _is_unit(tokens, i):
+    if keyword(tokens[i]) not in TIME_UNITS:
+        return False
+    prev = keyword(tokens[i - 1]) if i else None
+    if prev == "INTERVAL":
+        return True
+    # TIMESTAMPDIFF(unit, a, b), TIMESTAMPADD(unit, n, a), EXTRACT(unit FROM a)
+    return (i >= 2 and tokens[i - 1].text == "("
+            and keyword(tokens[i - 2]) in ("TIMESTAMPDIFF", "TIMESTAMPADD", "EXTRACT"))
+
+
+def _matching(tokens, start, depth):
+    for j in range(start + 1, len(tokens)):
+        if tokens[j].text == ")" and depth[j] == depth[start]:
+            return j
+    raise ParseError("missing ')'")
+
+
+def _parse_from(query, tokens):
+    depth = _depths(tokens)
+    segments, join, natural = [], "from", False
+    start, i = 0, 0
+    while i < len(tokens):
+        word = keyword(tokens[i]) if depth[i] == 0 else None
+        if depth[i] == 0 and tokens[i].text == ",":
+            segments.append((join, natural, tokens[start:i]))
+            join, natural, start = "comma", False, i + 1
+        elif word in _JOIN_WORDS:
+            segments.append((join, natural, tokens[start:i]))
+            kind = []
+            while i < len(tokens) and keyword(tokens[i]) in _JOIN_WORDS:
+                kind.append(keyword(tokens[i]))
+                i += 1
+            if "JOIN" not in kind and "STRAIGHT_JOIN" not in kind:
+                raise ParseError("expected JOIN after %s" % " ".join(kind))
+            join = next((k.lower() for k in ("LEFT", "RIGHT", "CROSS") if k in kind), "inner")
+            natural = "NATURAL" in kind
+            start = i
+            continue
+        i += 1
+    segments.append((join, natural, tokens[start:]))
+    for join, natural, segment in segments:
+        if not segment:
+            raise ParseError("missing table in FROM clause")
+        query.tables.append(_parse_table_ref(query, join, natural, segment))
+
+
+def _parse_table_ref(query, join, natural, tokens):
+    depth = _depths(tokens)
+    condition, using = [], ()
+    for i, token in enumerate(tokens):
+        if depth[i] == 0 and keyword(token) in ("ON", "USING"):
+            if keyword(token) == "ON":
+                condition, _ = _parse_condition(query, tokens[i + 1:])
+            else:
+                using = tuple(identifier(t) for t in tokens[i + 1:]
+                              if identifier(t) is not None)
+            tokens = tokens[:i]
+            break
+    if not tokens:
+        raise ParseError("missing table before ON")
+    subquery, name = None, None
+    if tokens[0].text == "(":
+        end = _matching(tokens, 0, _depths(tokens))
+        subquery = _parse_select(tokens[1:end])
+        rest = tokens[end + 1:]
+    else:
+        if identifier(tokens[0]) is None or keyword(tokens[0]) in KEYWORDS:
+            raise ParseError("expected a table name, found %r" % tokens[0].text)
+        name, rest = identifier(tokens[0]), tokens[1:]
+        if len(rest) >= 2 and rest[0].text == ".":
+            # database.table
+            name, rest = identifier(rest[1]), rest[2:]
+    if rest and keyword(rest[0]) == "AS":
+        rest = rest[1:]
+    alias = None
+    if rest:
+        if len(rest) > 1 or identifier(rest[0]) is None or keyword(rest[0]) in KEYWORDS:
+            raise ParseError("unexpected %r in FROM clause" % _text(rest))
+        alias = identifier(rest[0])
+    if subquery is not None and alias is None:
+        raise ParseError("every derived table must have its own alias")
+    return TableRef(name, alias, join, condition, using, subquery, natural)
+
+
+def _parse_condition(query, tokens):
+    """Split a condition into classified conjuncts; report a top-level OR."""
+    if not tokens:
+        raise ParseError("empty condition")
+    has_or = any(
+        d == 0 and (keyword(t) in ("OR", "XOR") or t.text == "||")
+        for t, d in zip(tokens, _depths(tokens))
+    )
+    if has_or:
+        columns, _ = _columns(query, tokens)
+        return [Predicate("other", None, tuple(columns), None, _text(tokens))], True
+    conjuncts, current, between = [], [], False
+    for token, d in zip(tokens, _depths(tokens)):
+        word = keyword(token) if d == 0 else None
+        if word == "BETWEEN":
+            between = True
+        if word == "AND" or (d == 0 and token.text == "&&"):
+            if between:
+                between = False
+            else:
+                conjuncts.append(current)
+                current = []
+                continue
+        current.append(token)
+    conjuncts.append(current)
+    if any(not c for c in conjuncts):
+        raise ParseError("dangling AND in condition")
+    return [_classify(query, c) for c in conjuncts], False
+
+
+def _column_ref(tokens):
+    if len(tokens) == 1 and tokens[0].kind in ("name", "quoted") \
+            and keyword(tokens[0]) not in KEYWORDS:
+        return ColumnRef(None, identifier(tokens[0]))
+    if len(tokens) == 3 and tokens[1].text == "." \
+            and identifier(tokens[0]) is not None and identifier(tokens[2]) is not None:
+        return ColumnRef(identifier(tokens[0]), identifier(tokens[2]))
+    return None
+
+
+def _literal(tokens):
+    """Value of a literal (``'x'``, ``12``, ``("x")``, ``-1``), else ``None``."""
+    while len(tokens) >= 2 and tokens[0].text == "(" and tokens[-1].text == ")":
+        tokens = tokens[1:-1]
+    if len(tokens) == 2 and tokens[0].text == "-" and tokens[1].kind == "number":
+        return -float(tokens[1].text)
+    if len(tokens) != 1:
+        return None
+    token = tokens[0]
+    if token.kind == "string":
+        return string_value(token)
+    if token.kind == "number":
+        return float(token.text) if "." in token.text or "e" in token.text.lower() \
+            else int(token.text)
+    return None
+
+
+def _classify(query, tokens):
+    text = _text(tokens)
+    columns, _ = _columns(query, tokens)
+    columns = tuple(columns)
+    words = [keyword(t) for t in tokens]
+
+    def other():
+        return Predicate("other", None, columns, None, text)
+
+    if words[0] == "NOT" and len(tokens) > 1 and keyword(tokens[1]) == "EXISTS":
+        return Predicate("not_exists", None, columns, None, text)
+    if words[0] == "EXISTS":
+        return Predicate("exists", None, columns, None, text)
+
+    depth = _depths(tokens)
+    # col IS [NOT] NULL
+    if len(tokens) >= 3 and words[-1] == "NULL":
+        negated = words[-2] == "NOT"
+        head = tokens[:-3] if negated else tokens[:-2]
+        if (words[-3] if negated else words[-2]) == "IS":
+            ref = _column_ref(head)
+            if ref is not None:
+                return Predicate("notnull" if negated else "null", "IS",
+                                 (ref,), None, text)
+        return other()
+    for i, token in enumerate(tokens):
+        if depth[i] != 0:
+            continue
+        word = words[i]
+        if word in ("IN", "LIKE", "BETWEEN") or token.text in _COMPARISONS:
+            break
+    else:
+        return other()
+    negated = i > 0 and words[i - 1] == "NOT" and word in ("IN", "LIKE", "BETWEEN")
+    left = tokens[:i - 1] if negated else tokens[:i]
+    right = tokens[i + 1:]
+    ref = _column_ref(left)
+    if word == "IN":
+        if ref is None or not right or right[0].text != "(":
+            return other()
+        has_subquery = len(right) > 1 and keyword(right[1]) == "SELECT"
+        kind = "in_subquery" if has_subquery else "in"
+        values = None
+        if not has_subquery:
+            values = tuple(_literal(p) for p in _split(right[1:-1], lambda t: t.text == ","))
+        return Predicate("not_" + kind if negated else kind, "IN", (ref,), values, text)
+    if word == "LIKE":
+        value = _literal(right)
+        if ref is None or value is None:
+            return other()
+        return Predicate("not_like" if negated else "like", "LIKE", (ref,), value, text)
+    if word == "BETWEEN":
+        if ref is None or negated:
+            return other()
+        bounds = _split(right, lambda t: keyword(t) == "AND")
+        value = None
+        if len(bounds) == 2:
+            value = (_literal(bounds[0]), _literal(bounds[1]))
+        return Predicate("range", "BETWEEN", (ref,), value, text)
+    op = token.text
+    right_ref = _column_ref(right)
+    if ref is not None and right_ref is not None:
+        if op in ("=", "<=>"):
+            return Predicate("join", op, (ref, right_ref), None, text)
+        return other()
+    if ref is not None:
+        other_side = right
+    else:
+        ref, op, other_side = right_ref, _FLIP[op], left
+        if ref is None:
+            return other()
+    value = _literal(other_side)
+    if value is None and _columns(Query(""), other_side)[0]:
+        return other()
+    if op in ("=", "<=>"):
+        kind = "eq"
+    elif op in ("<>", "!="):
+        kind = "ne"
+    else:
+        kind = "range"
+    return Predicate(kind, op, (ref,), value, text)
+
+
+def _parse_items(query, tokens, clause):
+    items = []
+    for part in _split(tokens, lambda t: t.text == ","):
+        if not part:
+            raise ParseError("empty item in %s (stray comma?)" % clause)
+        descending = False
+        if keyword(part[-1]) in ("ASC", "DESC"):
+            descending = keyword(part[-1]) == "DESC"
+            part = part[:-1]
+            if not part:
+                raise ParseError("missing expression in %s" % clause)
+        position = None
+        if len(part) == 1 and part[0].kind == "number":
+            position = int(part[0].text)
+            if not 1 <= position <= len(query.select):
+                raise ParseError("%s position %d is out of range" % (clause, position))
+        columns, _ = _columns(query, part)
+        items.append(Item(_text(part), columns, position, descending))
+    return items
+
+
+def _parse_limit(query, tokens):
+    numbers = [t for t in tokens if t.kind == "number"]
+    words = [keyword(t) for t in tokens]
+    if len(tokens) == 1 and numbers:
+        query.limit = int(numbers[0].text)
+    elif len(tokens) == 3 and tokens[1].text == "," and len(numbers) == 2:
+        query.offset, query.limit = int(numbers[0].text), int(numbers[1].text)
+    elif len(tokens) == 3 and words[1] == "OFFSET" and len(numbers) == 2:
+        query.limit, query.offset = int(numbers[0].text), int(numbers[1].text)
+    else:
+        raise ParseError("bad LIMIT clause %r" % _text(tokens))
@@ -0,0 +1,475 @@
+"""Column statistics for dognitiondb, collected once and kept on disk.
+
+Exercise 4 profiles columns by hand: ``SUM(ISNULL(exclude))``,
+``COUNT(exclude)`` against ``COUNT(*)``, ``COUNT(DISTINCT breed)`` and so
+on, each a full scan.  :meth:`StatsCatalog.collect` reads each table once
+and records, for every column, the row and NULL counts, a distinct-count
+estimate (:class:`dognition.hll.HyperLogLog`), the minimum and maximum, an
+equi-depth histogram and the most frequent values::
+
+    stats = StatsCatalog.load(conn)          # collects what is missing
+    stats.column("dogs", "exclude").nulls    # SUM(ISNULL(exclude))
+    stats.column("dogs", "breed").distinct   # ~COUNT(DISTINCT breed)
+    stats.column("dogs", "breed").top[:5]    # the most common breeds
+    stats.estimate_rows("dogs", parse(sql).where)
+
+:meth:`StatsCatalog.refresh` reads only the rows dated after the newest
+one already seen (``created_at``, or ``start_time`` for exam_answers) and
+merges them in.  Updated or deleted rows are not noticed until the next
+full :meth:`collect`.
+
+Columns with at most 2,000 distinct values (gender, breed, weight, test
+names) keep an exact count per value, so their equality and range
+estimates are exact; wider columns fall back to the top values and a
+histogram built from a 512-row reservoir sample.  The same numbers give
+row-count estimates (:meth:`ColumnStats.selectivity`,
+:meth:`StatsCatalog.estimate_rows`, :meth:`StatsCatalog.join_rows`) for
+the planner-style helpers in this package.  From the command line::
+
+    python -m dognition.stats [--url URL] [--refresh] [table ...]
+"""
+
+import argparse
+import base64
+import bisect
+import json
+import math
+import os
+import random
+from collections import Counter
+
+from .catalog import SchemaCatalog, default_cache_path
+from .db import DEFAULT_URL, TABLES, connect, placeholder, quote
+from .hll import DATE_COLUMNS, HyperLogLog
+from .streaming import stream
+
+SAMPLE_SIZE = 512
+HISTOGRAM_BUCKETS = 16
+TOP_VALUES = 10
+MAX_TRACKED = 2000
+# fallbacks when a predicate cannot be estimated from the statistics
+DEFAULT_RANGE = 1 / 3.0
+DEFAULT_LIKE = 0.1
+DEFAULT_OTHER = 0.5
+
+
+def _plain(value):
+    """``value`` as something JSON keeps: numbers and text."""
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def _fold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+def _comparable(value):
+    """Sort key that keeps numbers before text instead of failing."""
+    return (isinstance(value, str), value)
+
+
+class ColumnStats:
+    """Statistics of one column; build with :meth:`extend` then :meth:`finish`."""
+
+    def __init__(self, name, rows=0, nulls=0, distinct=0, minimum=None, maximum=None,
+                 histogram=(), top=(), sketch=None, sample=(), seen=0, counts=None):
+        self.name = name
+        self.rows = rows
+        self.nulls = nulls
+        self.distinct = distinct
+        self.min = minimum
+        self.max = maximum
+        self.histogram = list(histogram)
+        self.top = [tuple(t) for t in top]
+        self.sketch = sketch or HyperLogLog()
+        self.sample = list(sample)
+        self.seen = seen
+        self.counts = Counter(counts) if counts is not None else Counter()
+        self._rng = random.Random(name)
+        self._next = self._weight = None
+
+    @property
+    def null_fraction(self):
+        return self.nulls / self.rows if self.rows else 0.0
+
+    def extend(self, values):
+        """Add one batch of the column's values."""
+        self.rows += len(values)
+        present = [v for v in values if v is not None]
+        self.nulls += len(values) - len(present)
+        if not present:
+            return
+        if not isinstance(present[0], (int, float, str)):
+            present = [_plain(v) for v in present]
+        self.sketch.update(set(present))
+        try:
+            low, high = min(present), max(present)
+        except TypeError:
+            low, high = min(present, key=_comparable), max(present, key=_comparable)
+        if self.min is None or _comparable(low) < _comparable(self.min):
+            self.min = low
+        if self.max is None or _comparable(high) > _comparable(self.max):
+            self.max = high
+        self._sample(present)
+        if self.counts is not None:
+            self.counts.update(present)
+            if len(self.counts) > MAX_TRACKED:
+                # too many values to count exactly; the sample takes over
+                self.counts = None
+
+    def _sample(self, values):
+        """Reservoir-sample ``values`` into :attr:`sample` (Li's algorithm L).
+
+        Once the reservoir is full only the rows that replace an entry are
+        visited, so the cost per batch is ``O(SAMPLE_SIZE * log(seen))``.
+        """
+        start = self.seen
+        self.seen += len(values)
+        free = SAMPLE_SIZE - len(self.sample)
+        if free > 0:
+            self.sample.extend(values[:free])
+            start += min(free, len(values))
+            if len(self.sample) < SAMPLE_SIZE:
+                return
+        rng = self._rng
+        if self._next is None:
+            self._weight = math.exp(math.log(rng.random()) / SAMPLE_SIZE)
+            self._next = start + self._skip()
+        while self._next < self.seen:
+            self.sample[rng.randrange(SAMPLE_SIZE)] = values[self._next - self.seen]
+            self._weight *= math.exp(math.log(rng.random()) / SAMPLE_SIZE)
+            self._next += self._skip() + 1
+
+    def _skip(self):
+        return int(math.log(self._rng.random()) / math.log(1 - self._weight))
+
+    def finish(self):
+        """Derive ``distinct``, ``histogram`` and ``top`` from what was added."""
+        self.distinct = min(self.sketch.count(), self.rows - self.nulls)
+        if self.counts is not None:
+            self.distinct = len(self.counts)
+            top = self.counts.most_common(TOP_VALUES)
+        else:
+            scale = self.seen / len(self.sample) if self.sample else 0
+            top = [(value, int(count * scale)) for value, count
+                   in Counter(self.sample).most_common(TOP_VALUES) if count > 1]
+        self.top = top
+        ordered = sorted(self.sample, key=_comparable)
+        if ordered:
+            step = len(ordered) / HISTOGRAM_BUCKETS
+            self.histogram = [ordered[min(len(ordered) - 1, int(step * i))]
+                              for i in range(1, HISTOGRAM_BUCKETS)]
+        else:
+            self.histogram = []
+        return self
+
+    def _fraction_below(self, value, inclusive):
+        """Estimated share of non-NULL values ``<`` (or ``<=``) ``value``."""
+        if self.counts is not None and self.seen:
+            try:
+                below = sum(n for v, n in self.counts.items()
+                            if v < value or (inclusive and v == value))
+            except TypeError:
+                below = None
+            if below is not None:
+                return below / float(self.seen)
+        if not self.histogram:
+            return DEFAULT_RANGE
+        keys = [_comparable(v) for v in self.histogram]
+        key = _comparable(_plain(value))
+        if self.min is not None and key < _comparable(self.min):
+            return 0.0
+        if self.max is not None and key > _comparable(self.max):
+            return 1.0
+        find = bisect.bisect_right if inclusive else bisect.bisect_left
+        return find(keys, key) / float(len(keys) + 1) + 0.5 / (len(keys) + 1)
+
+    def selectivity(self, kind, op=None, value=None):
+        """Estimated fraction of rows matching a :class:`sqlquery.Predicate`.
+
+        ``kind``, ``op`` and ``value`` are the predicate's fields.
+        """
+        if not self.rows:
+            return 0.0
+        present = 1.0 - self.null_fraction
+        if kind == "null":
+            return self.null_fraction
+        if kind == "notnull":
+            return present
+        if kind in ("eq", "ne"):
+            match = self._equal(value)
+            return match if kind == "eq" else max(0.0, present - match)
+        if kind in ("in", "not_in"):
+            match = min(present, sum(self._equal(v) for v in set(value or ())))
+            return match if kind == "in" else max(0.0, present - match)
+        if kind == "range":
+            if op == "BETWEEN":
+                low, high = value if value else (None, None)
+                if low is None or high is None:
+                    return DEFAULT_RANGE * present
+                share = self._fraction_below(high, True) - self._fraction_below(low, False)
+            elif value is None:
+                return DEFAULT_RANGE * present
+            elif op in ("<", "<="):
+                share = self._fraction_below(value, op == "<=")
+            else:
+                share = 1.0 - self._fraction_below(value, op == ">")
+            return max(0.0, min(1.0, share)) * present
+        if kind in ("like", "not_like"):
+            return (DEFAULT_LIKE if kind == "like" else 1 - DEFAULT_LIKE) * present
+        return DEFAULT_OTHER
+
+    def _equal(self, value):
+        """Fraction of rows equal to ``value``, ignoring case like MySQL."""
+        if value is None:
+            return 0.0
+        value = _plain(value)
+        folded = _fold(value)
+        if self.counts is not None:
+            return sum(n for v, n in self.counts.items() if _fold(v) == folded) / self.rows
+        for known, count in self.top:
+            if _fold(known) == folded:
+                return count / self.rows
+        covered = sum(count for _, count in self.top)
+        rest = max(0, self.rows - self.nulls - covered)
+        others = max(1, self.distinct - len(self.top))
+        return rest / others / self.rows
+
+    def merge(self, other):
+        """Fold the statistics of ``other`` (more rows of the same column) in."""
+        total = self.seen + other.seen
+        if other.seen:
+            # keep the union sample proportional to each side's row count
+            keep = min(SAMPLE_SIZE, len(self.sample) + len(other.sample))
+            take = int(round(keep * other.seen / total)) if total else 0
+            mine = self._rng.sample(self.sample, min(len(self.sample), keep - take))
+            theirs = self._rng.sample(other.sample, min(len(other.sample), take))
+            self.sample = mine + theirs
+            self._next = None
+        self.rows += other.rows
+        self.nulls += other.nulls
+        self.seen = total
+        self.sketch.merge(other.sketch)
+        for bound in (other.min, other.max):
+            if bound is None:
+                continue
+            if self.min is None or _comparable(bound) < _comparable(self.min):
+                self.min = bound
+            if self.max is None or _comparable(bound) > _comparable(self.max):
+                self.max = bound
+        if self.counts is not None and other.counts is not None:
+            self.counts.update(other.counts)
+            if len(self.counts) > MAX_TRACKED:
+                self.counts = None
+        else:
+            self.counts = None
+        return self.finish()
+
+    def to_dict(self):
+        return {
+            "name": self.name, "rows": self.rows, "nulls": self.nulls,
+            "distinct": self.distinct, "min": self.min, "max": self.max,
+            "histogram": self.histogram, "top": self.top, "sample": self.sample,
+            "seen": self.seen,
+            "sketch": base64.b64encode(self.sketch.to_bytes()).decode("ascii"),
+            "counts": None if self.counts is None else list(self.counts.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        counts = data.get("counts")
+        return cls(data["name"], data["rows"], data["nulls"], data["distinct"],
+                   data["min"], data["max"], data["histogram"], data["top"],
+                   HyperLogLog.from_bytes(base64.b64decode(data["sketch"])),
+                   data["sample"], data["seen"],
+                   None if counts is None else dict(map(tuple, counts)))
+
+
+class TableStats:
+    """Row count, per-column statistics and the refresh watermark of a table."""
+
+    def __init__(self, name, columns, rows=0, watermark=None, date_column=None):
+        self.name = name
+        self.columns = columns
+        self.rows = rows
+        self.watermark = watermark
+        self.date_column = date_column
+
+    def to_dict(self):
+        return {"name": self.name, "rows": self.rows, "watermark": self.watermark,
+                "date_column": self.date_column,
+                "columns": [c.to_dict() for c in self.columns.values()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        columns = {c["name"]: ColumnStats.from_dict(c) for c in data["columns"]}
+        return cls(data["name"], columns, data["rows"], data["watermark"],
+                   data["date_column"])
+
+
+def _scan(conn, table, date_column=None, since=None, batch_size=10000):
+    """Stream ``table`` (rows dated after ``since``) into fresh :class:`TableStats`."""
+    sql = "SELECT * FROM %s" % quote(table)
+    params = ()
+    if since is not None:
+        sql += " WHERE %s > %s" % (quote(date_column), placeholder(conn))
+        params = (since,)
+    with stream(conn, sql, params, batch_size) as rows:
+        names = list(rows.columns)
+        columns = [ColumnStats(name) for name in names]
+        date_index = names.index(date_column) if date_column in names else None
+        count = 0
+        while True:
+            batch = rows.head(batch_size)
+            if not batch:
+                break
+            count += len(batch)
+            for column, values in zip(columns, zip(*batch)):
+                column.extend(values)
+    for column in columns:
+        column.finish()
+    watermark = columns[date_index].max if date_index is not None else None
+    return TableStats(table, {c.name: c for c in columns}, count,
+                      watermark, date_column if date_index is not None else None)
+
+
+class StatsCatalog:
+    """:class:`TableStats` for the tables of one database, cached as JSON."""
+
+    def __init__(self, tables=None, path=None):
+        self.tables = tables or {}
+        self.path = path
+
+    @classmethod
+    def load(cls, conn, path=None, collect=True):
+        """Read the cached statistics, collecting any table that is missing."""
+        path = path or default_cache_path(conn, "stats")
+        catalog = cls(path=path)
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                catalog.tables = {t["name"]: TableStats.from_dict(t) for t in data["tables"]}
+            except (ValueError, KeyError, TypeError):
+                catalog.tables = {}
+        if collect:
+            present = SchemaCatalog.fetch(conn).tables
+            missing = [t for t in TABLES if t in present and t not in catalog.tables]
+            if missing:
+                catalog.collect(conn, missing)
+                catalog.save()
+        return catalog
+
+    def save(self, path=None):
+        path = path or self.path
+        if path is None:
+            return  # an in-memory database: nothing to keep
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"tables": [t.to_dict() for t in self.tables.values()]}, f)
+        os.replace(tmp, path)
+
+    def collect(self, conn, tables=None):
+        """Profile ``tables`` (default: all of them) with one full scan each."""
+        for table in tables or TABLES:
+            self.tables[table] = _scan(conn, table,
+                                       DATE_COLUMNS.get(table, "created_at"))
+        return self
+
+    def refresh(self, conn, tables=None):
+        """Merge in the rows dated after each table's watermark."""
+        for table in tables or list(self.tables):
+            current = self.tables.get(table)
+            if current is None or current.date_column is None or current.watermark is None:
+                self.collect(conn, [table])
+                continue
+            fresh = _scan(conn, table, current.date_column, current.watermark)
+            if not fresh.rows:
+                continue
+            for name, column in fresh.columns.items():
+                if name in current.columns:
+                    current.columns[name].merge(column)
+                else:
+                    current.columns[name] = column
+            current.rows += fresh.rows
+            current.watermark = max(current.watermark, fresh.watermark)
+        return self
+
+    def table(self, table):
+        return self.tables[table]
+
+    def column(self, table, column):
+        stats = self.tables[table].columns
+        if column in stats:
+            return stats[column]
+        for name, found in stats.items():
+            if name.lower() == column.lower():
+                return found
+        raise KeyError("%s.%s" % (table, column))
+
+    def rows(self, table):
+        return self.tables[table].rows if table in self.tables else None
+
+    def selectivity(self, table, predicate):
+        """Fraction of ``table``'s rows a single-column predicate keeps."""
+        if len(predicate.columns) != 1:
+            return DEFAULT_OTHER
+        try:
+            column = self.column(table, predicate.columns[0].name)
+        except KeyError:
+            return DEFAULT_OTHER
+        return column.selectivity(predicate.kind, predicate.op, predicate.value)
+
+    def estimate_rows(self, table, predicates=()):
+        """Rows of ``table`` left after AND-ed ``predicates`` (independence assumed)."""
+        rows = float(self.rows(table) or 0)
+        for predicate in predicates:
+            rows *= self.selectivity(table, predicate)
+        return rows
+
+    def join_rows(self, left, left_column, right, right_column,
+                  left_rows=None, right_rows=None):
+        """Rows of an equi-join: ``|L| * |R| / max(ndv(L.a), ndv(R.b))``."""
+        left_rows = self.rows(left) if left_rows is None else left_rows
+        right_rows = self.rows(right) if right_rows is None else right_rows
+        distinct = max(self.column(left, left_column).distinct,
+                       self.column(right, right_column).distinct, 1)
+        return left_rows * right_rows / float(distinct)
+
+    def describe(self, table):
+        """One row per column: name, rows, nulls, null %, distinct, min, max."""
+        stats = self.tables[table]
+        return [(c.name, c.rows, c.nulls, round(100 * c.null_fraction, 1), c.distinct,
+                 c.min, c.max) for c in stats.columns.values()]
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Profile the dognitiondb columns.")
+    p.add_argument("tables", nargs="*")
+    p.add_argument("--url", default=DEFAULT_URL)
+    p.add_argument("--refresh", action="store_true",
+                   help="merge in new rows instead of reusing the cache as is")
+    args = p.parse_args(argv)
+    conn = connect(args.url)
+    try:
+        catalog = StatsCatalog.load(conn)
+        if args.refresh:
+            catalog.refresh(conn, args.tables or None)
+            catalog.save()
+    finally:
+        conn.close()
+    for table in args.tables or list(catalog.tables):
+        print("%s: %d rows" % (table, catalog.rows(table)))
+        for name, rows, nulls, percent, distinct, low, high in catalog.describe(table):
+            print("  %-46s %8d nulls %5.1f%% %8d distinct  %s .. %s" % (
+                name, nulls, percent, distinct, str(low)[:19], str(high)[:19]))
+
+
+if __name__ == "__main__":
+    main()
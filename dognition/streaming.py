@@ -0,0 +1,143 @@
+"""Lazy, constant-memory execution of large SELECTs.
+
+``SELECT breed FROM dogs`` through ``%sql`` transfers and stores all 35,050
+rows before the notebook truncates the display to 1000 of them.
+:func:`stream` runs the query on an unbuffered server-side cursor and hands
+rows out as they arrive, ``batch_size`` at a time, so memory stays flat
+however large the table is::
+
+    with stream(conn, "SELECT breed FROM dogs") as rows:
+        first_page = rows.head(1000)
+
+When the consumer stops early, the result is closed: on MySQL the running
+statement is cancelled with ``KILL QUERY`` from a short-lived side
+connection (PyMySQL only; other drivers drain the remaining rows, which the
+protocol requires before the connection can be reused).
+"""
+
+import itertools
+
+from .db import dialect_of, raw_connection
+
+
+def _server_side_cursor(conn):
+    if dialect_of(conn) == "sqlite":
+        # sqlite3 cursors already step through the result lazily
+        return conn.cursor()
+    module = type(raw_connection(conn)).__module__.split(".")[0]
+    if module == "pymysql":
+        from pymysql.cursors import SSCursor
+    elif module == "MySQLdb":
+        from MySQLdb.cursors import SSCursor
+    else:
+        raise TypeError("no server-side cursor for %s connections" % module)
+    return conn.cursor(SSCursor)
+
+
+def _kill_query(conn):
+    """Cancel the statement running on a PyMySQL ``conn``; return success."""
+    conn = raw_connection(conn)
+    if type(conn).__module__.split(".")[0] != "pymysql":
+        return False
+    import pymysql
+
+    database = conn.db
+    if isinstance(database, bytes):
+        database = database.decode("utf-8")
+    try:
+        side = pymysql.connect(host=conn.host, port=conn.port, user=conn.user,
+                               password=conn.password, database=database)
+    except pymysql.MySQLError:
+        return False
+    try:
+        with side.cursor() as cursor:
+            cursor.execute("KILL QUERY %d" % conn.thread_id())
+        return True
+    except pymysql.MySQLError:
+        return False
+    finally:
+        side.close()
+
+
+class StreamingResult:
+    """Iterator over the rows of one streamed query.
+
+    ``columns`` holds the column names from the cursor description.
+    Iterating fetches ``batch_size`` rows per driver call; ``close()`` (or
+    leaving the ``with`` block) stops fetching.
+    """
+
+    def __init__(self, conn, cursor, batch_size):
+        self.conn = conn
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.columns = [d[0] for d in cursor.description or ()]
+        self.rows_fetched = 0
+        self.exhausted = False
+        self._rows = self._generate()
+
+    def _generate(self):
+        while True:
+            batch = self.cursor.fetchmany(self.batch_size)
+            if not batch:
+                self.exhausted = True
+                return
+            self.rows_fetched += len(batch)
+            yield from batch
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def head(self, n):
+        """Return the next ``n`` rows as a list."""
+        return list(itertools.islice(self, n))
+
+    def close(self):
+        if self.cursor is None:
+            return
+        cursor, self.cursor = self.cursor, None
+        if not self.exhausted and dialect_of(self.conn) != "sqlite":
+            _kill_query(self.conn)
+        try:
+            cursor.close()
+        except Exception:
+            # a killed query surfaces as an error while the cursor drains
+            pass
+        self._rows = iter(())
+
+
+def stream(conn, sql, params=(), batch_size=1000):
+    """Execute ``sql`` and return a :class:`StreamingResult` over its rows."""
+    cursor = _server_side_cursor(conn)
+    cursor.execute(sql, params)
+    return StreamingResult(conn, cursor, batch_size)
+
+
+def display(conn, sql, params=(), limit=1000):
+    """Return ``(rows, truncated)`` with at most ``limit`` rows fetched.
+
+    This is what the notebook display needs: the first ``limit`` rows and
+    whether more exist, without transferring the rest of the table.
+    """
+    with stream(conn, sql, params, batch_size=min(limit + 1, 1000)) as rows:
+        fetched = rows.head(limit + 1)
+    return fetched[:limit], len(fetched) > limit
+
+
+def write_csv(conn, sql, path, params=(), batch_size=1000):
+    """Stream the result of ``sql`` into a CSV file; return the row count.
+
+    See :func:`dognition.export.export` for gzip and Parquet output.
+    """
+    from .export import export
+
+    return export(conn, sql, path, params, "csv", batch_size).rows
@@ -0,0 +1,261 @@
+"""Build a synthetic SQLite copy of dognitiondb for local runs and benchmarks.
+
+The generated tables have the same names and columns as the course
+database and roughly the same shape: v1-style GUID keys, a handful of
+breeds spelled with stray leading dashes, negative and multi-thousand-hour
+exam durations, and a few orphaned keys in the child tables.  ``scale``
+multiplies the approximate row counts of the real tables.
+"""
+
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+from .db import register_mysql_functions
+
+ROW_COUNTS = {
+    "users": 33193,
+    "dogs": 35050,
+    "reviews": 17986,
+    "complete_tests": 193246,
+    "site_activities": 43045,
+    "exam_answers": 2460937,
+}
+
+COLUMNS = {
+    "dogs": (
+        "gender", "birthday", "breed", "breed_type", "breed_group", "weight",
+        "dog_fixed", "dna_tested", "dimension", "total_tests_completed",
+        "mean_iti_days", "mean_iti_minutes", "median_iti_days",
+        "median_iti_minutes", "time_diff_between_first_and_last_game_days",
+        "time_diff_between_first_and_last_game_minutes", "dog_guid",
+        "user_guid", "created_at", "updated_at", "exclude",
+    ),
+    "reviews": (
+        "rating", "created_at", "updated_at", "user_guid", "dog_guid",
+        "subcategory_name", "test_name",
+    ),
+    "complete_tests": (
+        "created_at", "updated_at", "user_guid", "dog_guid", "test_name",
+        "subcategory_name",
+    ),
+    "exam_answers": (
+        "script_detail_id", "subcategory_name", "test_name", "step_type",
+        "start_time", "end_time", "loop_number", "dog_guid",
+    ),
+    "site_activities": (
+        "activity_type", "description", "membership_id", "category_id",
+        "script_id", "script_detail_id", "test_number", "user_guid",
+        "dog_guid", "created_at", "updated_at",
+    ),
+    "users": (
+        "sign_in_count", "created_at", "updated_at", "max_dogs",
+        "membership_id", "subscribed", "exclude", "free_start_user",
+        "last_active_at", "membership_type", "user_guid", "city", "state",
+        "zip", "country", "utc_correction",
+    ),
+}
+
+INTEGER_COLUMNS = {
+    "weight", "dog_fixed", "dna_tested", "total_tests_completed", "rating",
+    "script_detail_id", "loop_number", "membership_id", "category_id",
+    "script_id", "test_number", "sign_in_count", "max_dogs", "subscribed",
+    "exclude", "free_start_user", "membership_type", "utc_correction",
+}
+REAL_COLUMNS = {
+    "mean_iti_days", "mean_iti_minutes", "median_iti_days",
+    "median_iti_minutes", "time_diff_between_first_and_last_game_days",
+    "time_diff_between_first_and_last_game_minutes",
+}
+
+BREEDS = (
+    "Labrador Retriever", "Golden Retriever", "German Shepherd Dog",
+    "Border Collie", "Australian Shepherd", "Mixed", "Beagle", "Poodle",
+    "Shih Tzu", "Boxer", "Dachshund", "Chihuahua", "Siberian Husky",
+    "Jack Russell Terrier", "Yorkshire Terrier", "Boston Terrier",
+    "Bull Terrier", "West Highland White Terrier", "Rat Terrier",
+    "Labrador Retriever-Golden Retriever Mix", "-American Pit Bull Terrier",
+    "-Pembroke Welsh Corgi", "Cavalier King Charles Spaniel", "Pug",
+    "Shetland Sheepdog", "-Bernese Mountain Dog", "Rottweiler",
+)
+BREED_GROUPS = ("Sporting", "Herding", "Working", "Toy", "Terrier", "Hound",
+                "Non-Sporting", "None", "", None)
+BREED_TYPES = ("Pure Breed", "Mixed Breed/ Other/ I Don't Know",
+               "Cross Breed", "Popular Hybrid")
+DIMENSIONS = ("charmer", "socialite", "stargazer", "maverick", "protodog",
+              "einstein", "ace", "expert", "renaissance-dog", None)
+TESTS = (
+    ("Introduction", "Yawn Warm-up"), ("Introduction", "Eye Contact Warm-up"),
+    ("Empathy", "Yawn Game"), ("Empathy", "Eye Contact Game"),
+    ("Communication", "Treat Warm-up"), ("Communication", "Arm Pointing"),
+    ("Communication", "Foot Pointing"), ("Cunning", "Watching"),
+    ("Cunning", "Turn Your Back"), ("Memory", "Memory versus Pointing"),
+    ("Memory", "Delayed Cup Game"), ("Reasoning", "Inferential Reasoning Game"),
+    ("Reasoning", "Physical Reasoning Game"), ("Puzzles", "Shaker Warm-Up"),
+    ("Numerosity", "Two Vs Four"), ("Bark Game", "Bark Game"),
+)
+STATES = ("NC", "NY", "CA", "TX", "FL", "NJ", "SC", "WA", "MA", "IL", None)
+COUNTRIES = ("US",) * 17 + ("CA", "GB", "AU", "N/A", None)
+ACTIVITIES = ("visit", "point_scored", "dog_edited", "test_started")
+
+START = datetime(2013, 2, 5)
+SPAN_SECONDS = int((datetime(2015, 10, 14) - START).total_seconds())
+
+
+def table_ddl(table):
+    """Return a CREATE TABLE statement for ``table``."""
+    defs = []
+    for column in COLUMNS[table]:
+        if column in INTEGER_COLUMNS:
+            kind = "INTEGER"
+        elif column in REAL_COLUMNS:
+            kind = "REAL"
+        else:
+            kind = "TEXT"
+        defs.append("%s %s" % (column, kind))
+    return "CREATE TABLE %s (%s)" % (table, ", ".join(defs))
+
+
+class _Generator:
+    def __init__(self, scale, seed):
+        self.rng = random.Random(seed)
+        self.scale = scale
+        self.guid_counter = 0
+
+    def count(self, table):
+        return max(1, int(ROW_COUNTS[table] * self.scale))
+
+    def guid(self):
+        # v1 layout: time_low-time_mid-time_hi_and_version-clock_seq-node
+        self.guid_counter += 1
+        time_low = (0xCE225842 + self.guid_counter * 9973) & 0xFFFFFFFF
+        time_mid = 0x7144 + self.guid_counter // 400000
+        return "%08x-%04x-11e5-ba71-058fbc01cf0b" % (time_low, time_mid)
+
+    def timestamp(self):
+        moment = START + timedelta(seconds=self.rng.randrange(SPAN_SECONDS))
+        return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+    def users(self):
+        rng = self.rng
+        for _ in range(self.count("users")):
+            created = self.timestamp()
+            yield (
+                rng.randint(1, 40), created, created, rng.randint(0, 4),
+                rng.randint(1, 5), rng.randint(0, 1), rng.choice((None, 1)),
+                rng.choice((None, 0, 1)), created, rng.choice((1, 2, 3, 4, 5)),
+                self.guid(), rng.choice(("Durham", "Raleigh", "Gainesville",
+                                         "New York", None)),
+                rng.choice(STATES), "%05d" % rng.randint(1000, 99999),
+                rng.choice(COUNTRIES), rng.randint(-8, 0),
+            )
+
+    def dogs(self, user_guids):
+        rng = self.rng
+        for _ in range(self.count("dogs")):
+            created = self.timestamp()
+            # a few dogs point at users that do not exist
+            owner = rng.choice(user_guids) if rng.random() > 0.01 else self.guid()
+            iti = rng.uniform(1, 20000)
+            yield (
+                rng.choice(("male", "female")), str(rng.randint(1995, 2015)),
+                rng.choice(BREEDS), rng.choice(BREED_TYPES),
+                rng.choice(BREED_GROUPS), rng.randint(0, 190),
+                rng.randint(0, 1), rng.randint(0, 1), rng.choice(DIMENSIONS),
+                rng.randint(1, 40), iti / 1440, iti, iti / 2880, iti / 2,
+                iti / 60, iti * 24, self.guid(), owner, created, created,
+                1 if rng.random() < 0.03 else None,
+            )
+
+    def reviews(self, dogs):
+        rng = self.rng
+        for _ in range(self.count("reviews")):
+            dog_guid, user_guid = rng.choice(dogs)
+            subcategory, test = rng.choice(TESTS)
+            created = self.timestamp()
+            yield (rng.choice((None, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9)), created,
+                   created, user_guid, dog_guid, subcategory, test)
+
+    def complete_tests(self, dogs):
+        rng = self.rng
+        for _ in range(self.count("complete_tests")):
+            dog_guid, user_guid = rng.choice(dogs)
+            subcategory, test = rng.choice(TESTS)
+            created = self.timestamp()
+            yield (created, created, user_guid, dog_guid, test, subcategory)
+
+    def site_activities(self, dogs):
+        rng = self.rng
+        for _ in range(self.count("site_activities")):
+            dog_guid, user_guid = rng.choice(dogs)
+            if rng.random() < 0.2:
+                dog_guid = None
+            elif rng.random() < 0.01:
+                dog_guid = self.guid()
+            created = self.timestamp()
+            yield (
+                rng.choice(ACTIVITIES), None, rng.randint(1, 5),
+                rng.randint(1, 20), rng.randint(1, 40),
+                rng.choice((None, rng.randint(1, 300))), rng.randint(1, 20),
+                user_guid, dog_guid, created, created,
+            )
+
+    def exam_answers(self, dogs):
+        rng = self.rng
+        for _ in range(self.count("exam_answers")):
+            dog_guid = rng.choice(dogs)[0]
+            subcategory, test = rng.choice(TESTS)
+            start = START + timedelta(seconds=rng.randrange(SPAN_SECONDS))
+            roll = rng.random()
+            if roll < 0.002:
+                length = -rng.randint(60, 200000)
+            elif roll < 0.004:
+                length = rng.randint(6000 * 3600, 9000 * 3600)
+            else:
+                length = int(rng.expovariate(1 / 600.0))
+            end = start + timedelta(seconds=length)
+            yield (
+                rng.randint(1, 300), subcategory, test,
+                rng.choice(("question", "instruction")),
+                start.strftime("%Y-%m-%d %H:%M:%S"),
+                end.strftime("%Y-%m-%d %H:%M:%S"), rng.randint(0, 5), dog_guid,
+            )
+
+
+def create(path=":memory:", scale=1.0, seed=0, tables=None):
+    """Create a synthetic dognitiondb at ``path`` and return the connection.
+
+    ``tables`` limits generation to a subset of tables; ``users`` and
+    ``dogs`` are always generated because the other tables reference them.
+    """
+    wanted = set(tables or COLUMNS) | {"users", "dogs"}
+    gen = _Generator(scale, seed)
+    conn = sqlite3.connect(path)
+    register_mysql_functions(conn)
+
+    def load(table, rows):
+        conn.execute("DROP TABLE IF EXISTS %s" % table)
+        conn.execute(table_ddl(table))
+        marks = ", ".join("?" * len(COLUMNS[table]))
+        conn.executemany("INSERT INTO %s VALUES (%s)" % (table, marks), rows)
+
+    users = list(gen.users())
+    load("users", users)
+    user_guids = [row[10] for row in users]
+    dogs = list(gen.dogs(user_guids))
+    load("dogs", dogs)
+    dog_keys = [(row[16], row[17]) for row in dogs]
+    for table in ("reviews", "complete_tests", "site_activities",
+                  "exam_answers"):
+        if table in wanted:
+            load(table, getattr(gen, table)(dog_keys))
+    # the course database has plain (MUL) indexes on the GUID columns
+    for table in wanted:
+        for column in ("dog_guid", "user_guid"):
+            if column in COLUMNS[table]:
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)"
+                    % (table, column, table, column)
+                )
+    conn.commit()
+    return conn
@@ -0,0 +1,414 @@
+"""Approximate quantiles of durations and ratings from mergeable t-digests.
+
+Exercises 4 and 5 report ``AVG``, ``MIN`` and ``MAX`` of the exam_answers
+durations, and the negative and 6000-hour outliers they turn up drag the
+average a long way from a typical test.  A median or 90th percentile would
+not move, but MySQL has no quantile aggregate and computing one exactly
+means sorting the whole column for every group.  A :class:`TDigest`
+summarizes a distribution in a hundred or so centroids, accurate to a
+fraction of a percent near the tails, and two digests merge into the
+digest of the combined data.  :class:`DigestStore` keeps one digest per
+measure, grouping (``test_name`` or ``breed_group``), group and month,
+built in one scan and served from the cache afterwards::
+
+    store = DigestStore.load(conn)
+    store.build(conn, "duration")                     # one scan, then cached
+    store.quantiles("duration", "test_name")          # {test: [p50, p90, p99]}
+    store.quantiles("duration", "breed_group", (0.5,), low=0, high=6000 * 60)
+    store.save()
+
+``duration`` is ``TIMESTAMPDIFF(MINUTE, start_time, end_time)`` of
+exam_answers and ``rating`` the rating of reviews; ``breed_group`` comes
+from the dog row with the same ``dog_guid``.  As in
+:mod:`dognition.hll`, date ranges are rounded out to whole months and
+:meth:`DigestStore.build` with ``since`` rescans only the months from that
+date on.  ``low``/``high`` drop the outliers after the fact: the quantile
+is taken within the part of the distribution between the two values.
+"""
+
+import argparse
+import base64
+import json
+import math
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from itertools import chain, islice, repeat
+
+from .catalog import default_cache_path
+from .db import DEFAULT_URL, connect, dialect_of, placeholder, quote
+from .hll import NO_DATE, last_month, month_of
+from .streaming import stream
+
+DEFAULT_COMPRESSION = 200
+QUANTILES = (0.5, 0.9, 0.99)
+# values buffered per unit of compression before they are merged into centroids
+BUFFER_FACTOR = 10
+
+Measure = namedtuple("Measure", "table date_column value")
+
+MEASURES = {
+    "duration": Measure("exam_answers", "start_time", {
+        "mysql": "TIMESTAMPDIFF(MINUTE, t.start_time, t.end_time)",
+        # integer division truncates towards zero, as TIMESTAMPDIFF does
+        "sqlite": "(CAST(strftime('%s', t.end_time) AS INTEGER)"
+                  " - CAST(strftime('%s', t.start_time) AS INTEGER)) / 60",
+    }),
+    "rating": Measure("reviews", "created_at", {"mysql": "t.rating", "sqlite": "t.rating"}),
+}
+GROUPINGS = ("test_name", "breed_group")
+
+
+def _fold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+class TDigest:
+    """A merging t-digest with at most about ``compression`` centroids.
+
+    Values are buffered and merged into the sorted ``(mean, weight)``
+    centroids in batches; the arcsine scale function keeps centroids small
+    near both ends, so the tails (p1, p99) are the most accurate.
+    """
+
+    def __init__(self, compression=DEFAULT_COMPRESSION, centroids=(), minimum=None,
+                 maximum=None):
+        self.compression = compression
+        self.centroids = list(centroids)
+        self.count = sum(w for _, w in self.centroids)
+        self.min = minimum
+        self.max = maximum
+        self._buffer = []
+
+    def add(self, value):
+        if value is not None:
+            self._buffer.append(float(value))
+            if len(self._buffer) >= BUFFER_FACTOR * self.compression:
+                self._compress()
+
+    def update(self, values):
+        self._buffer.extend(float(v) for v in values if v is not None)
+        if len(self._buffer) >= BUFFER_FACTOR * self.compression:
+            self._compress()
+
+    def merge(self, *others):
+        """Fold ``others`` into this digest (the digest of all the inputs)."""
+        self._compress()
+        others = [o for o in others if len(o)]
+        for other in others:
+            other._compress()
+        if others:
+            self._compress([c for o in others for c in o.centroids],
+                           min(o.min for o in others), max(o.max for o in others))
+        return self
+
+    def copy(self):
+        self._compress()
+        return TDigest(self.compression, self.centroids, self.min, self.max)
+
+    def __len__(self):
+        return int(self.count + len(self._buffer))
+
+    def _limit(self, q):
+        """The largest cumulative fraction a centroid starting at ``q`` may reach."""
+        k = self.compression / (2 * math.pi) * math.asin(2 * q - 1) + 1
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(2 * math.pi * k / self.compression) + 1) / 2
+
+    def _compress(self, centroids=(), minimum=None, maximum=None):
+        points, self._buffer = self._buffer, []
+        if points:
+            minimum = min(points) if minimum is None else min(minimum, min(points))
+            maximum = max(points) if maximum is None else max(maximum, max(points))
+        elif not centroids:
+            return
+        self.min = minimum if self.min is None else min(self.min, minimum)
+        self.max = maximum if self.max is None else max(self.max, maximum)
+        total = self.count + len(points) + sum(w for _, w in centroids)
+        items = sorted(chain(self.centroids, centroids, zip(points, repeat(1))))
+        merged, so_far = [], 0
+        mean, weight = items[0]
+        limit = self._limit(0) * total
+        for value, w in islice(items, 1, None):
+            if so_far + weight + w <= limit:
+                weight += w
+                mean += (value - mean) * w / weight
+            else:
+                merged.append((mean, weight))
+                so_far += weight
+                limit = self._limit(so_far / total) * total
+                mean, weight = value, w
+        merged.append((mean, weight))
+        self.centroids, self.count = merged, total
+
+    def _points(self):
+        """``(positions, values)``: each centroid at its middle, min and max at the ends."""
+        self._compress()
+        positions, values, so_far = [0.0], [self.min], 0
+        for mean, weight in self.centroids:
+            positions.append(so_far + weight / 2)
+            values.append(mean)
+            so_far += weight
+        positions.append(float(so_far))
+        values.append(self.max)
+        return positions, values
+
+    def quantile(self, q):
+        """The estimated value below which a fraction ``q`` of the data lies."""
+        if not 0 <= q <= 1:
+            raise ValueError("quantile must be between 0 and 1, not %r" % (q,))
+        positions, values = self._points()
+        if not self.count:
+            return None
+        target = q * self.count
+        i = min(bisect_right(positions, target), len(positions) - 1)
+        low, high = positions[i - 1], positions[i]
+        if high == low:
+            return values[i]
+        return values[i - 1] + (values[i] - values[i - 1]) * (target - low) / (high - low)
+
+    def cdf(self, x):
+        """The estimated fraction of the data at or below ``x``."""
+        positions, values = self._points()
+        if not self.count:
+            return None
+        if x < self.min:
+            return 0.0
+        if x >= self.max:
+            return 1.0
+        i = bisect_right(values, x)
+        low, high = values[i - 1], values[i]
+        position = positions[i - 1] + (positions[i] - positions[i - 1]) * (x - low) / (high - low)
+        return position / self.count
+
+    def to_bytes(self):
+        self._compress()
+        flat = array("d", [v for centroid in self.centroids for v in centroid])
+        header = struct.pack("<Bddd", 1, self.compression,
+                             *(math.nan if v is None else v for v in (self.min, self.max)))
+        return header + zlib.compress(flat.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        size = struct.calcsize("<Bddd")
+        if len(data) < size or data[0] != 1:
+            raise ValueError("not a serialized digest")
+        _, compression, minimum, maximum = struct.unpack("<Bddd", data[:size])
+        flat = array("d")
+        flat.frombytes(zlib.decompress(data[size:]))
+        return cls(compression, zip(flat[::2], flat[1::2]),
+                   None if math.isnan(minimum) else minimum,
+                   None if math.isnan(maximum) else maximum)
+
+
+class DigestStore:
+    """Monthly digests per measure, grouping and group, persisted as JSON.
+
+    ``digests[(measure, grouping)]`` maps each group value (``None`` for
+    NULL) to ``{month: TDigest}``.  Group values that differ only in case
+    share a digest, under the spelling seen first.
+    """
+
+    def __init__(self, path=None, digests=None):
+        self.path = path
+        self.digests = digests or {}
+
+    @classmethod
+    def load(cls, conn=None, path=None):
+        """Read the store at ``path`` (default: the cache file for ``conn``)."""
+        path = path or default_cache_path(conn, "digests")
+        store = cls(path)
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            for key, groups in data.items():
+                measure, grouping = key.split(".", 1)
+                store.digests[(measure, grouping)] = {
+                    group: {month: TDigest.from_bytes(base64.b64decode(blob))
+                            for month, blob in months.items()}
+                    for group, months in groups}
+        return store
+
+    def save(self, path=None):
+        path = path or self.path
+        if path is None:
+            return  # an in-memory database: nothing to keep
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # a list of [group, months] pairs, because JSON keys cannot be NULL
+        data = {"%s.%s" % key: [
+            [group, {month: base64.b64encode(digest.to_bytes()).decode("ascii")
+                     for month, digest in sorted(months.items())}]
+            for group, months in groups.items()]
+            for key, groups in self.digests.items()}
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def __contains__(self, measure):
+        return any(key[0] == measure for key in self.digests)
+
+    def build(self, conn, measure, since=None, compression=DEFAULT_COMPRESSION,
+              batch_size=10000):
+        """Scan the measure's table once and (re)build its digests for every grouping.
+
+        With ``since`` (a date string) only rows dated on or after it are
+        read and only their months are replaced; earlier months are kept.
+        """
+        try:
+            spec = MEASURES[measure]
+        except KeyError:
+            raise ValueError("unknown measure %r (expected one of %s)"
+                             % (measure, ", ".join(MEASURES))) from None
+        sql = "SELECT %s, %s, test_name, dog_guid FROM %s t" % (
+            spec.value[dialect_of(conn)], quote(spec.date_column), quote(spec.table))
+        params = ()
+        if since is not None:
+            sql += " WHERE %s >= %s" % (spec.date_column, placeholder(conn))
+            params = (since[:7] + "-01",)
+        # a dictionary lookup per row instead of a join: dogs is small
+        cursor = conn.cursor()
+        cursor.execute("SELECT dog_guid, breed_group FROM dogs")
+        breeds = {}
+        for dog, breed_group in cursor.fetchall():
+            breeds.setdefault(dog, breed_group)
+        cursor.close()
+        fresh = tuple({} for _ in GROUPINGS)
+        spellings = tuple({} for _ in GROUPINGS)
+
+        def flush(key, values):
+            test, breed_group, month = key
+            for i, group in enumerate((test, breed_group)):
+                group = spellings[i].setdefault(_fold(group), group)
+                months = fresh[i].setdefault(group, {})
+                digest = months.get(month)
+                if digest is None:
+                    digest = months[month] = TDigest(compression)
+                digest.update(values)
+
+        # values wait per (test, breed group, month) until there are enough
+        # to be worth a digest update
+        pending, full = {}, BUFFER_FACTOR * compression
+        with stream(conn, sql, params, batch_size) as rows:
+            for value, moment, test, dog in rows:
+                if value is None:
+                    continue
+                key = (test, breeds.get(dog), month_of(moment))
+                values = pending.get(key)
+                if values is None:
+                    values = pending[key] = []
+                values.append(value)
+                if len(values) >= full:
+                    flush(key, pending.pop(key))
+        for key, values in pending.items():
+            flush(key, values)
+        for grouping, groups in zip(GROUPINGS, fresh):
+            stored = self.digests.setdefault((measure, grouping), {})
+            if since is None:
+                stored.clear()
+            for group, months in groups.items():
+                known = [g for g in stored if _fold(g) == _fold(group)]
+                stored.setdefault(known[0] if known else group, {}).update(months)
+        return sum(len(months) for months in fresh[0].values())
+
+    def digest(self, measure, grouping, group, start=None, end=None):
+        """The merged digest of ``group`` for the months overlapping ``[start, end)``."""
+        try:
+            groups = self.digests[(measure, grouping)]
+        except KeyError:
+            raise KeyError("no digests for %s by %s; build them first"
+                           % (measure, grouping)) from None
+        months = groups.get(group)
+        if months is None:
+            folded = [m for g, m in groups.items() if _fold(g) == _fold(group)]
+            months = folded[0] if folded else {}
+        unbounded = start is None and end is None
+        first = start[:7] if start else None
+        last = last_month(end) if end else None
+        picked = []
+        for month, digest in months.items():
+            if month == NO_DATE:
+                if not unbounded:
+                    continue
+            elif (first and month < first) or (last and month > last):
+                continue
+            picked.append(digest)
+        if not picked:
+            return None
+        return TDigest(picked[0].compression).merge(*picked)
+
+    def groups(self, measure, grouping):
+        return list(self.digests.get((measure, grouping), ()))
+
+    def quantiles(self, measure, grouping, qs=QUANTILES, start=None, end=None,
+                  low=None, high=None):
+        """``{group: [value at each q]}``, optionally within ``low < value < high``."""
+        result = {}
+        for group in self.groups(measure, grouping):
+            digest = self.digest(measure, grouping, group, start, end)
+            if digest is not None and digest.count:
+                result[group] = trimmed_quantiles(digest, qs, low, high)
+        return result
+
+    def overall(self, measure, qs=QUANTILES, start=None, end=None, low=None, high=None):
+        """Quantiles over every row, merged from the ``test_name`` digests."""
+        picked = [self.digest(measure, "test_name", group, start, end)
+                  for group in self.groups(measure, "test_name")]
+        picked = [d for d in picked if d is not None]
+        if not picked:
+            return None
+        return trimmed_quantiles(TDigest(picked[0].compression).merge(*picked), qs, low, high)
+
+
+def trimmed_quantiles(digest, qs=QUANTILES, low=None, high=None):
+    """Quantiles of the part of ``digest`` between ``low`` and ``high``."""
+    bottom = digest.cdf(low) if low is not None else 0.0
+    top = digest.cdf(high) if high is not None else 1.0
+    if top <= bottom:
+        return [None for _ in qs]
+    return [digest.quantile(bottom + q * (top - bottom)) for q in qs]
+
+
+def quantiles(conn, measure, grouping="test_name", qs=QUANTILES, store=None, **kwargs):
+    """Quantiles per group from cached digests, building them if needed."""
+    store = store or DigestStore.load(conn)
+    if measure not in store:
+        store.build(conn, measure)
+        store.save()
+    return store.quantiles(measure, grouping, qs, **kwargs)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Quantiles of test durations or ratings.")
+    p.add_argument("measure", choices=sorted(MEASURES))
+    p.add_argument("--by", choices=list(GROUPINGS), default="test_name")
+    p.add_argument("--url", default=DEFAULT_URL)
+    p.add_argument("--quantiles", default=",".join(str(q) for q in QUANTILES))
+    p.add_argument("--low", type=float, help="ignore values at or below this")
+    p.add_argument("--high", type=float, help="ignore values at or above this")
+    p.add_argument("--rebuild", action="store_true", help="rescan instead of using the cache")
+    args = p.parse_args(argv)
+    qs = [float(q) for q in args.quantiles.split(",")]
+    conn = connect(args.url)
+    try:
+        store = DigestStore.load(conn)
+        if args.rebuild or args.measure not in store:
+            store.build(conn, args.measure)
+            store.save()
+    finally:
+        conn.close()
+    print("%-40s %s" % (args.by, " ".join("%10s" % ("p%g" % (q * 100)) for q in qs)))
+    found = store.quantiles(args.measure, args.by, qs, low=args.low, high=args.high)
+    for group, values in sorted(found.items(), key=lambda item: str(item[0])):
+        print("%-40s %s" % (group, " ".join(
+            "%10s" % ("NULL" if v is None else "%.1f" % v) for v in values)))
+
+
+if __name__ == "__main__":
+    main()
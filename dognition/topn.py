@@ -0,0 +1,219 @@
+"""Top-N execution of ``ORDER BY ... LIMIT k`` with a bounded heap.
+
+``SELECT user_guid, dog_guid, test_name FROM complete_tests ORDER BY
+created_at LIMIT 10`` needs 10 rows, but without an index on
+``created_at`` the server sorts all 193,246 of them first.  :func:`top_n`
+keeps only the best ``k`` rows seen so far in a heap, which is
+``O(n log k)`` time and ``O(k)`` memory over any iterable of rows: a
+snapshot loaded from an export, a cached table, or a server-side stream.
+
+:func:`execute` runs a query that way: it drops the ``ORDER BY`` and
+``LIMIT`` clauses, streams the remaining query with
+:func:`dognition.streaming.stream`, and applies the ordering locally::
+
+    columns, rows = execute(conn, "SELECT d.breed, COUNT(s.script_detail_id) AS activity "
+                                  "FROM dogs d, site_activities s WHERE ... "
+                                  "GROUP BY breed ORDER BY activity DESC LIMIT 3")
+
+Sort keys may be output columns (by name, alias or position) or, for
+queries without ``DISTINCT``/``GROUP BY``, any column of the FROM tables,
+which is then fetched alongside and dropped from the result.  NULLs sort
+first in ascending and last in descending order, as in MySQL; rows that
+tie keep the order they arrived in.
+"""
+
+import functools
+import heapq
+
+from .sqlquery import ParseError, parse
+from .sqltext import depths, identifier, keyword, significant, tokenize
+from .streaming import stream
+
+MAX_LIMIT = 10000
+
+
+def _ascending_key(row, order):
+    return tuple((row[i] is not None, row[i]) for i, _ in order)
+
+
+def _compare(a, b, order):
+    for i, descending in order:
+        x, y = a[i], b[i]
+        if x == y:
+            continue
+        if x is None:
+            result = -1
+        elif y is None:
+            result = 1
+        else:
+            result = -1 if x < y else 1
+        return -result if descending else result
+    return 0
+
+
+def top_n(rows, k, order, offset=0):
+    """The first ``k`` rows (after skipping ``offset``) under ``order``.
+
+    ``order`` is a list of ``(column index, descending)`` pairs.  Only
+    ``k + offset`` rows are held at any time.
+    """
+    keep = k + offset
+    if keep <= 0:
+        return []
+    directions = {descending for _, descending in order}
+    if len(order) == 1:
+        index = order[0][0]
+
+        def key(row):
+            return row[index] is not None, row[index]
+    else:
+        key = functools.partial(_ascending_key, order=order)
+    if directions == {False}:
+        best = heapq.nsmallest(keep, rows, key=key)
+    elif directions == {True}:
+        best = heapq.nlargest(keep, rows, key=key)
+    else:
+        key = functools.cmp_to_key(lambda a, b: _compare(a, b, order))
+        best = heapq.nsmallest(keep, rows, key=key)
+    return best[offset:]
+
+
+def _normal(text):
+    return " ".join(text.split()).lower()
+
+
+def _bare_name(text):
+    """``name`` for ``name``, ``t.name`` or quoted forms; otherwise ``None``."""
+    tokens = [t for _, t in significant(tokenize(text))]
+    if len(tokens) == 3 and tokens[1].text == ".":
+        tokens = tokens[2:]
+    if len(tokens) == 1 and identifier(tokens[0]) is not None:
+        return identifier(tokens[0]).lower()
+    return None
+
+
+class Plan:
+    """How to run one ``ORDER BY ... LIMIT`` query as a local top-N.
+
+    ``inner`` is the query to stream, ``targets`` holds one entry per sort
+    key, ``("name", column)``, ``("index", i)`` or ``("extra", j)``, and
+    ``extras`` the expressions appended to the select list for the
+    ``"extra"`` keys.
+    """
+
+    def __init__(self, inner, targets, descending, extras, limit, offset):
+        self.inner = inner
+        self.targets = targets
+        self.descending = descending
+        self.extras = extras
+        self.limit = limit
+        self.offset = offset
+
+    def order(self, columns):
+        """``(index, descending)`` pairs for the streamed ``columns``."""
+        width = len(columns) - len(self.extras)
+        names = [c.lower() for c in columns[:width]]
+        order = []
+        for (kind, value), descending in zip(self.targets, self.descending):
+            if kind == "index":
+                index = value
+            elif kind == "extra":
+                index = width + value
+            elif value in names:
+                index = names.index(value)
+            else:
+                raise ValueError("no output column %r to sort on" % value)
+            order.append((index, descending))
+        return order
+
+
+def _split(sql):
+    """Split ``sql`` into the select list and FROM ... up to the top-level ORDER BY."""
+    tokens = tokenize(sql)
+    depth = depths(tokens)
+    sig = significant(tokens)
+    order_at = from_at = None
+    for pos, (i, token) in enumerate(sig):
+        if depth[i] != 0:
+            continue
+        word = keyword(token)
+        if word == "FROM" and from_at is None:
+            from_at = i
+        if (word == "ORDER" and pos + 1 < len(sig)
+                and keyword(sig[pos + 1][1]) == "BY"):
+            order_at = i
+            break
+    if order_at is None or from_at is None:
+        return None, None
+    head = "".join(t.text for t in tokens[:from_at])
+    tail = "".join(t.text for t in tokens[from_at:order_at])
+    return head, tail
+
+
+def plan(sql, max_limit=MAX_LIMIT):
+    """Return a :class:`Plan` for ``sql``, or ``None`` if it is not a top-N.
+
+    A top-N here is a single SELECT (no UNION) with ``ORDER BY`` and a
+    ``LIMIT`` of at most ``max_limit`` rows (offset included).
+    """
+    try:
+        query = parse(sql)
+    except ParseError:
+        return None
+    if (query.limit is None or not query.order_by or query.unions
+            or query.limit + (query.offset or 0) > max_limit):
+        return None
+    outputs = {}
+    star = False
+    for position, item in enumerate(query.select):
+        if item.text == "*" or item.text.endswith(".*"):
+            star = True
+            continue
+        name = item.alias.lower() if item.alias else _bare_name(item.text)
+        outputs.setdefault(_normal(item.text), ("index", position))
+        if name is not None:
+            outputs.setdefault(name, ("name", name))
+    grouped = query.distinct or query.is_aggregate
+    targets, extras = [], []
+    for item in query.order_by:
+        bare = _bare_name(item.text)
+        if item.position is not None:
+            if not 1 <= item.position <= len(query.select) or star:
+                return None
+            targets.append(("index", item.position - 1))
+        elif bare is not None and bare in outputs:
+            targets.append(outputs[bare])
+        elif _normal(item.text) in outputs:
+            targets.append(outputs[_normal(item.text)])
+        elif bare is not None and star:
+            targets.append(("name", bare))
+        elif not grouped:
+            targets.append(("extra", len(extras)))
+            extras.append(item.text)
+        else:
+            return None
+    head, tail = _split(sql)
+    if head is None:
+        return None
+    if extras:
+        head = head.rstrip() + ", " + ", ".join(extras) + " "
+    return Plan(head + tail, targets, [item.descending for item in query.order_by],
+                extras, query.limit, query.offset or 0)
+
+
+def execute(conn, sql, params=(), max_limit=MAX_LIMIT, batch_size=10000):
+    """Run ``sql`` as a streamed top-N; return ``(columns, rows)``.
+
+    Raises ``ValueError`` if ``sql`` is not a query :func:`plan` accepts.
+    """
+    found = plan(sql, max_limit)
+    if found is None:
+        raise ValueError("not an ORDER BY ... LIMIT query: %s" % " ".join(sql.split()))
+    with stream(conn, found.inner, params, batch_size) as rows:
+        columns = rows.columns
+        best = top_n(rows, found.limit, found.order(columns), found.offset)
+    width = len(columns) - len(found.extras)
+    if found.extras:
+        best = [row[:width] for row in best]
+    return columns[:width], best
+
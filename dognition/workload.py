@@ -0,0 +1,61 @@
+"""The SQL workload of the exercise scripts.
+
+Every query in the exercise notebooks is a ``run_cell_magic('sql', ...)``
+or ``run_line_magic('sql', ...)`` call in the exported scripts.
+:func:`extract` reads them statically (the scripts are not executed) so
+analysis tools can look at the whole course workload at once.
+"""
+
+import ast
+import glob
+import os
+import re
+from collections import namedtuple
+
+WorkloadQuery = namedtuple("WorkloadQuery", "script line sql")
+
+_NOT_QUERIES = re.compile(
+    r"^\s*(\w+(\+\w+)?://|USE\s|SHOW\s|DESCRIBE\s|DESC\s)", re.I)
+
+
+def magic_sql(line, cell=None):
+    """The statement ipython-sql runs for ``%sql line`` / ``%%sql line`` + cell."""
+    if cell is None:
+        return line
+    return cell if not line.strip() else line + "\n" + cell
+
+
+def exercise_scripts(root="."):
+    return sorted(glob.glob(os.path.join(root, "MySQL_Exercise_*.py")))
+
+
+def extract(paths=None):
+    """Return a :class:`WorkloadQuery` for every query in ``paths``.
+
+    ``paths`` defaults to the exercise scripts in the current directory.
+    Connection strings, ``USE``, ``SHOW`` and ``DESCRIBE`` are skipped.
+    """
+    queries = []
+    for path in paths or exercise_scripts():
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if not (isinstance(node, ast.Call)
+                    and isinstance(node.func, ast.Attribute)
+                    and node.func.attr in ("run_cell_magic", "run_line_magic")):
+                continue
+            args = [a.value if isinstance(a, ast.Constant) else None
+                    for a in node.args]
+            if not args or args[0] != "sql" or None in args:
+                continue
+            if node.func.attr == "run_cell_magic" and len(args) == 3:
+                sql = magic_sql(args[1], args[2])
+            elif node.func.attr == "run_line_magic" and len(args) == 2:
+                sql = magic_sql(args[1])
+            else:
+                continue
+            if not _NOT_QUERIES.match(sql):
+                queries.append(WorkloadQuery(os.path.basename(path),
+                                             node.lineno, sql))
+    queries.sort(key=lambda q: (q.script, q.line))
+    return queries